@@ -19,22 +19,48 @@
     appear in the local dicitonary, the call if passed to the parent. However,
     in this case we see that local keys can shadow those in a parent.
     Communication with the parent is handled using sockets, with the parent
-    being a server and the interactive dictionary a client.
-
-    The default persistence mechanism is a pickle file, RDict.db, written
-    whenever an argument is changed locally. A timer thread is created after
-    an initial change, so that many rapid changes do not cause many writes.
+    being a server and the interactive dictionary a client. Each request is a
+    frame holding an opcode, which names the operation, and the length of
+    the pickled arguments, followed by the arguments, and the parent replies
+    with a frame holding a status and the pickled result or exception. A
+    client may write several requests before reading the replies, so that
+    getMany() and update() need a single round trip for any number of keys.
+    A child caches what it learns of the entries of its parent, and writes
+    through to the parent. Whenever an entry of the parent changes, it pushes
+    an invalidation frame to every child, which the child reads before using
+    its cache again, so that repeated reads of unchanging entries never leave
+    the process.
+
+    The default persistence mechanism is a snapshot, RDict.db, which holds
+    each local entry pickled separately behind an index of the keys, and a
+    journal, RDict.db.journal. Whenever an argument is changed locally, a
+    record of the change is appended to the journal, so that a write costs in
+    proportion to the entry rather than the dictionary. The records are synced
+    to disk together, at most once every syncInterval seconds, and once the
+    journal outgrows the snapshot, both are compacted into a new snapshot.
     Each dictionary only saves its local entries, so all parents also
     separately save data in different RDict.db files. Each time a dictionary
-    is created, the current directory is searched for an RDict.db file, and
-    if found the contents are loaded into the dictionary.
+    is created, the current directory is searched for an RDict.db file, and if
+    found the index of the snapshot is loaded and the journal replayed on top
+    of it, up to the first record which was not completely written. The
+    snapshot is memory mapped, and an entry is only unpickled when it is first
+    used, so that opening a dictionary costs in proportion to the number of
+    keys, and large entries which are not used, such as the configure cache,
+    are never read.
 
     This script also provides some default actions:
 
       - server [parent]
         Starts a server in the current directory with an optional parent. This
         server will accept socket connections from other dictionaries and act
-        as a parent.
+        as a parent. It listens on a Unix domain socket, RDict.sock, and
+        answers all its children from a single thread. Once no child has made
+        a request for shutdownDelay seconds, or on SIGTERM, it saves its
+        entries and exits.
+
+      - tcpServer [parent]
+        Starts a server as above, which listens on a TCP port instead, so that
+        dictionaries on other machines may use it as a parent.
 
       - client [parent]
         Creates a dictionary in the current directory with an optional parent
@@ -62,6 +88,7 @@ import nargs
 
 import cPickle
 import os
+import struct
 import sys
 useThreads = nargs.Arg.findArgument('useThreads', sys.argv[1:])
 if useThreads is None:
@@ -69,33 +96,81 @@ if useThreads is None:
 else:
   useThreads = int(useThreads)
 
+class LazyArg(object):
+  '''A placeholder for an Arg in the snapshot of an RDict, which is unpickled on first use
+     - Whether the value is set is kept in the index, so that listing the keys unpickles nothing'''
+  def __init__(self, key, data, offset, length, valueSet):
+    self.key      = key
+    self.data     = data
+    self.offset   = offset
+    self.length   = length
+    self.valueSet = valueSet
+    return
+
+  def __reduce__(self):
+    '''Pickle the Arg itself, so that copies of the dictionary do not depend on the snapshot'''
+    return (cPickle.loads, (self.getData(),))
+
+  def __str__(self):
+    return str(self.load())
+
+  def getData(self):
+    '''Return the pickle of the Arg'''
+    return self.data[self.offset:self.offset+self.length]
+
+  def load(self):
+    return cPickle.loads(self.getData())
+
+  def isValueSet(self):
+    return self.valueSet
+
+  def getTemporary(self):
+    return 0
+
 class RDict(dict):
   '''An RDict is a typed dictionary, which may be hierarchically composed. All elements derive from the
 Arg class, which wraps the usual value.'''
   # The server will self-shutdown after this many seconds
   shutdownDelay = 60*60*5
+  # The journal is synced to disk at most once in this many seconds, unless a save is forced
+  syncInterval  = 1.0
+  # The journal is compacted into the snapshot once it is larger than both the snapshot and this many bytes
+  compactSize   = 1024*1024
+  # The first bytes of an indexed snapshot, which distinguish it from the earlier pickle of the whole dictionary
+  snapshotMagic = 'RDict\0\2\n'
+  # The operations a child may request of its parent, numbered by their position
+  opcodes       = ['stop', '__len__', 'getType', '__getitem__', 'setType', '__setitem__', '__delitem__', 'clear',
+                   'has_key', 'hasType', 'items', 'keys', 'types', 'update', 'lookup']
+  opcodeNumbers = dict([(name, number) for number, name in enumerate(opcodes)])
+  # The status of a frame which a parent pushes to its children, holding the keys which changed, or None for all keys
+  invalidationStatus = 2
 
   def __init__(self, parentAddr = None, parentDirectory = None, load = 1, autoShutdown = 1, readonly = False):
     import atexit
     import time
-    import xdrlib
 
     self.logFile         = None
     self.setupLogFile()
     self.target          = ['default']
     self.parent          = None
     self.saveTimer       = None
-    self.shutdownTimer   = None
+    self.journalFd       = None
+    self.journalName     = None
+    self.journalSize     = 0
+    self.journalLock     = None
+    self.lastSync        = time.time()
     self.lastAccess      = time.time()
     self.saveFilename    = 'RDict.db'
     self.addrFilename    = 'RDict.loc'
+    self.socketFilename  = 'RDict.sock'
     self.parentAddr      = parentAddr
     self.isServer        = 0
     self.readonly        = readonly
     self.parentDirectory = parentDirectory
-    self.packer          = xdrlib.Packer()
-    self.unpacker        = xdrlib.Unpacker('')
-    self.stopCmd         = cPickle.dumps(('stop',))
+    self.posted          = 0
+    self.cache           = {}
+    self.children        = []
+    self.generation      = 0
     self.writeLogLine('Greetings')
     self.connectParent(self.parentAddr, self.parentDirectory)
     if load: self.load()
@@ -105,25 +180,31 @@ Arg class, which wraps the usual value.'''
     return
 
   def __getstate__(self):
-    '''Remove any parent socket object, the XDR translators, and the log file from the dictionary before pickling'''
+    '''Remove any parent socket object and the log file from the dictionary before pickling'''
     self.writeLogLine('Pickling RDict')
     d = self.__dict__.copy()
     if 'parent'    in d: del d['parent']
     if 'saveTimer' in d: del d['saveTimer']
+    for name in ['journalFd', 'journalName', 'journalLock']:
+      if name in d: del d[name]
     if '_setCommandLine' in d: del d['_setCommandLine']
-    del d['packer']
-    del d['unpacker']
+    for name in ['cache', 'children']:
+      if name in d: del d[name]
     del d['logFile']
     return d
 
   def __setstate__(self, d):
-    '''Reconnect the parent socket object, recreate the XDR translators and reopen the log file after unpickling'''
+    '''Reconnect the parent socket object and reopen the log file after unpickling'''
     self.logFile  = file('RDict.log', 'a')
     self.writeLogLine('Unpickling RDict')
+    self.saveTimer   = None
+    self.journalFd   = None
+    self.journalName = None
+    self.journalLock = None
     self.__dict__.update(d)
-    import xdrlib
-    self.packer   = xdrlib.Packer()
-    self.unpacker = xdrlib.Unpacker('')
+    self.posted      = 0
+    self.cache       = {}
+    self.children    = []
     self.connectParent(self.parentAddr, self.parentDirectory)
     return
 
@@ -150,16 +231,24 @@ Arg class, which wraps the usual value.'''
     '''Returns the length of both the local and parent dictionaries'''
     length = dict.__len__(self)
     if not self.parent is None:
-      length = length + self.send()
+      length = length + self.send(operation = '__len__')
     return length
 
+  def getLocalType(self, key):
+    '''Returns the local Arg object, unpickling it from the snapshot on first use'''
+    value = dict.__getitem__(self, key)
+    if isinstance(value, LazyArg):
+      value = value.load()
+      dict.__setitem__(self, key, value)
+    return value
+
   def getType(self, key):
     '''Checks for the key locally, and if not found consults the parent. Returns the Arg object or None if not found.'''
     if dict.has_key(self, key):
-      self.writeLogLine('getType: Getting local type for '+key+' '+str(dict.__getitem__(self, key)))
-      return dict.__getitem__(self, key)
+      self.writeLogLine('getType: Getting local type for '+key)
+      return self.getLocalType(key)
     elif not self.parent is None:
-      return self.send(key)
+      return self.send(key, operation = 'getType')
     return None
 
   def __getitem__(self, key):
@@ -169,31 +258,78 @@ Arg class, which wraps the usual value.'''
       self.writeLogLine('__getitem__: '+key+' has local type')
       pass
     elif not self.parent is None:
-      self.writeLogLine('__getitem__: Checking parent value')
-      if self.send(key, operation = 'has_key'):
-        self.writeLogLine('__getitem__: Parent has value')
-        return self.send(key)
-      else:
-        self.writeLogLine('__getitem__: Checking parent type')
-        arg = self.send(key, operation = 'getType')
+      return self.getMany([key])[0]
+    else:
+      self.writeLogLine('__getitem__: Setting local type for '+key)
+      dict.__setitem__(self, key, nargs.Arg(key))
+      self.save(keys = [key])
+    self.writeLogLine('__getitem__: Setting local value for '+key)
+    return self.getLocalType(key).getValue()
+
+  def getMany(self, keys):
+    '''Returns the values of the keys, as __getitem__ would, consulting the parent once for all the keys not found locally
+       - If the parent has no value for a key, the user is prompted for it, and the parent is sent the value without waiting for a reply'''
+    values = {}
+    remote = [key for key in keys if not dict.has_key(self, key)]
+    if remote and not self.parent is None:
+      for key, (found, value) in zip(remote, self.getParentEntries(remote)):
+        if found:
+          values[key] = value
+          continue
+        arg = value
         if not arg:
-          self.writeLogLine('__getitem__: Parent has no type')
+          self.writeLogLine('getMany: Parent has no type for '+key)
           arg = nargs.Arg(key)
         try:
           value = arg.getValue()
         except AttributeError, e:
-          self.writeLogLine('__getitem__: Parent had invalid entry: '+str(e))
+          self.writeLogLine('getMany: Parent had invalid entry: '+str(e))
           arg   = nargs.Arg(key)
           value = arg.getValue()
-        self.writeLogLine('__getitem__: Setting parent value '+str(value))
-        self.send(key, value, operation = '__setitem__')
-        return value
+        self.writeLogLine('getMany: Setting parent value for '+key)
+        self.post('__setitem__', (key, value))
+        self.uncache([key])
+        values[key] = value
+    results = []
+    for key in keys:
+      if key in values:
+        results.append(values[key])
+      else:
+        results.append(self[key])
+    return results
+
+  def getParentEntries(self, keys):
+    '''Returns the lookup() of the keys in the parent, from the cache when possible, and otherwise with one request whose results are cached'''
+    self.pollInvalidations()
+    missing = [key for key in keys if not key in self.cache]
+    if missing:
+      entries = self.send(missing, operation = 'lookup')
+      if entries is None:
+        return [(0, None) for key in keys]
+      for key, entry in zip(missing, entries):
+        self.cache[key] = entry
+    return [self.cache[key] for key in keys]
+
+  def uncache(self, keys = None):
+    '''Drop the cached entries of the parent for the keys, or for all keys if None'''
+    if keys is None:
+      self.cache.clear()
     else:
-      self.writeLogLine('__getitem__: Setting local type for '+key)
-      dict.__setitem__(self, key, nargs.Arg(key))
-      self.save()
-    self.writeLogLine('__getitem__: Setting local value for '+key)
-    return dict.__getitem__(self, key).getValue()
+      for key in keys:
+        if key in self.cache:
+          del self.cache[key]
+    return
+
+  def lookup(self, keys):
+    '''Returns, for each key, (1, value) if it has a value, and otherwise (0, type), where the type is None if it is not defined
+       - A child sends this request, so that it finds any number of values with one round trip to its parent'''
+    results = []
+    for key in keys:
+      if self.has_key(key):
+        results.append((1, self[key]))
+      else:
+        results.append((0, self.getType(key)))
+    return results
 
   def setType(self, key, value, forceLocal = 0):
     '''Checks for the key locally, and if not found consults the parent. Sets the type for this key.
@@ -203,45 +339,50 @@ Arg class, which wraps the usual value.'''
     value.setKey(key)
     if forceLocal or self.parent is None or dict.has_key(self, key):
       if dict.has_key(self, key):
-        v = dict.__getitem__(self, key)
+        v = self.getLocalType(key)
         if v.isValueSet():
           try:
             value.setValue(v.getValue())
           except TypeError: pass
       dict.__setitem__(self, key, value)
-      self.save()
+      self.save(keys = [key])
     else:
-      return self.send(key, value)
+      self.uncache([key])
+      return self.send(key, value, operation = 'setType')
     return
 
   def __setitem__(self, key, value):
     '''Checks for the key locally, and if not found consults the parent. Sets the value of the Arg.'''
     if not dict.has_key(self, key):
       if not self.parent is None:
-        return self.send(key, value)
+        self.uncache([key])
+        return self.send(key, value, operation = '__setitem__')
       else:
         dict.__setitem__(self, key, nargs.Arg(key))
-    dict.__getitem__(self, key).setValue(value)
+    self.getLocalType(key).setValue(value)
     self.writeLogLine('__setitem__: Set value for '+key+' to '+str(dict.__getitem__(self, key)))
-    self.save()
+    self.save(keys = [key])
     return
 
   def __delitem__(self, key):
     '''Checks for the key locally, and if not found consults the parent. Deletes the Arg completely.'''
     if dict.has_key(self, key):
       dict.__delitem__(self, key)
-      self.save()
+      self.save(keys = [key])
     elif not self.parent is None:
-      self.send(key)
+      self.uncache([key])
+      self.send(key, operation = '__delitem__')
     return
 
   def clear(self):
     '''Clears both the local and parent dictionaries'''
     if dict.__len__(self):
       dict.clear(self)
+      self.invalidate(None)
       self.save()
     if not self.parent is None:
-      self.send()
+      self.uncache()
+      self.send(operation = 'clear')
     return
 
   def __contains__(self, key):
@@ -257,7 +398,7 @@ Arg class, which wraps the usual value.'''
         self.writeLogLine('has_key: Do not have value for '+key)
       return dict.__getitem__(self, key).isValueSet()
     elif not self.parent is None:
-      return self.send(key)
+      return self.getParentEntries([key])[0][0]
     return 0
 
   def get(self, key, default=None):
@@ -271,38 +412,45 @@ Arg class, which wraps the usual value.'''
     if dict.has_key(self, key):
       return 1
     elif not self.parent is None:
-      return self.send(key)
+      return self.send(key, operation = 'hasType')
     return 0
 
   def items(self):
     '''Return a list of all accessible items, as (key, value) pairs.'''
-    l = dict.items(self)
+    l = self.localitems()
     if not self.parent is None:
-      l.extend(self.send())
+      l.extend(self.send(operation = 'items'))
     return l
 
   def localitems(self):
     '''Return a list of all the items stored locally, as (key, value) pairs.'''
-    return dict.items(self)
+    return [(key, self.getLocalType(key)) for key in dict.keys(self)]
 
   def keys(self):
     '''Returns the list of keys in both the local and parent dictionaries'''
     keyList = filter(lambda key: dict.__getitem__(self, key).isValueSet(), dict.keys(self))
     if not self.parent is None:
-      keyList.extend(self.send())
+      keyList.extend(self.send(operation = 'keys'))
     return keyList
 
   def types(self):
     '''Returns the list of keys for which types are defined in both the local and parent dictionaries'''
     keyList = dict.keys(self)
     if not self.parent is None:
-      keyList.extend(self.send())
+      keyList.extend(self.send(operation = 'types'))
     return keyList
 
   def update(self, d):
-    '''Update the dictionary with the contents of d'''
+    '''Update the dictionary with the contents of d, sending all the keys not found locally to the parent in one request'''
+    remote = {}
     for k in d:
-      self[k] = d[k]
+      if dict.has_key(self, k) or self.parent is None:
+        self[k] = d[k]
+      else:
+        remote[k] = d[k]
+    if remote:
+      self.uncache(remote.keys())
+      self.send(remote, operation = 'update')
     return
 
   def updateTypes(self, d):
@@ -426,9 +574,13 @@ Arg class, which wraps the usual value.'''
     import socket
     import errno
     connected = 0
-    s         = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     timeout   = 1
     for i in range(10):
+      # A server on a Unix domain socket has the path of the socket as its address
+      if isinstance(addr, str):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      else:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
       try:
         self.writeLogLine('CLIENT: Trying to connect to '+str(addr))
         s.connect(addr)
@@ -436,7 +588,8 @@ Arg class, which wraps the usual value.'''
         break
       except socket.error, e:
         self.writeLogLine('CLIENT: Failed to connect: '+str(e))
-        if e[0] == errno.ECONNREFUSED:
+        s.close()
+        if e[0] in [errno.ECONNREFUSED, errno.ENOENT]:
           try:
             import time
             time.sleep(timeout)
@@ -450,118 +603,166 @@ Arg class, which wraps the usual value.'''
             if os.path.isfile(filename):
               os.remove(filename)
             self.startServer(filename)
+            # A new TCP server listens on whatever port was free
+            addr = self.getServerAddr(dir)
       except Exception, e:
         self.writeLogLine('CLIENT: Failed to connect: '+str(e.__class__)+': '+str(e))
     if not connected:
       self.writeLogLine('CLIENT: Failed to connect to parent')
       return 0
+    if not isinstance(addr, str):
+      s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     self.parent = s
+    self.uncache()
     self.writeLogLine('CLIENT: Connected to '+str(self.parent))
     return 1
 
-  def sendPacket(self, s, packet, source = 'Unknown', isPickled = 0):
-    '''Pickle the input packet. Send first the size of the pickled string in 32-bit integer, and then the string itself'''
-    self.writeLogLine(source+': Sending packet '+str(packet))
-    if isPickled:
-      p = packet
-    else:
-      p = cPickle.dumps(packet)
-    self.packer.reset()
-    self.packer.pack_uint(len(p))
-    if hasattr(s, 'write'):
-      s.write(self.packer.get_buffer())
-      s.write(p)
-    else:
-      s.sendall(self.packer.get_buffer())
-      s.sendall(p)
-    self.writeLogLine(source+': Sent packet')
-    return
+  def packFrame(self, code, value):
+    '''Return a frame, which is the code and the length of the pickled value in a 5 byte header, followed by the pickle'''
+    data = cPickle.dumps(value, 2)
+    return struct.pack('!BI', code, len(data))+data
+
+  def readFrame(self, s):
+    '''Read a frame from a socket or file, and return the code and the pickle of the value
+       - Raises EOFError if the connection is closed before a complete frame'''
+    header = self.readBytes(s, 5)
+    (code, length) = struct.unpack('!BI', header)
+    return (code, self.readBytes(s, length))
 
-  def recvPacket(self, s, source = 'Unknown'):
-    '''Receive first the size of the pickled string in a 32-bit integer, and then the string itself. Return the unpickled object'''
-    self.writeLogLine(source+': Receiving packet')
+  def readBytes(self, s, length):
     if hasattr(s, 'read'):
-      s.read(4)
-      value = cPickle.load(s)
+      data = s.read(length)
     else:
-      # I probably need to check that it actually read these 4 bytes
-      self.unpacker.reset(s.recv(4))
-      length    = self.unpacker.unpack_uint()
-      objString = ''
-      while len(objString) < length:
-        objString += s.recv(length - len(objString))
-      value = cPickle.loads(objString)
-    self.writeLogLine(source+': Received packet '+str(value))
-    return value
+      data = ''
+      while len(data) < length:
+        chunk = s.recv(length - len(data))
+        if not chunk: break
+        data += chunk
+    if len(data) < length:
+      raise EOFError('Connection closed after '+str(len(data))+' of '+str(length)+' bytes')
+    return data
+
+  def readResponse(self):
+    '''Read the reply to a request from the parent, and return the status, which is nonzero for an exception, and the result or exception
+       - Invalidations pushed by the parent before the reply are applied'''
+    while 1:
+      (status, data) = self.readFrame(self.parent)
+      if not status == self.invalidationStatus:
+        return (status, cPickle.loads(data))
+      self.applyInvalidation(cPickle.loads(data))
+
+  def applyInvalidation(self, keys):
+    '''Drop the cached entries for keys which changed in the parent, and pass the invalidation on to our own children'''
+    self.uncache(keys)
+    self.invalidate(keys)
+    return
 
-  def send(self, key = None, value = None, operation = None):
-    '''Send a request to the parent'''
-    import inspect
+  def pollInvalidations(self):
+    '''Apply any invalidations which the parent has pushed, without waiting for more'''
+    import select
+
+    if self.parent is None:
+      return
+    try:
+      while select.select([self.parent], [], [], 0)[0]:
+        if self.posted:
+          self.readPosted()
+          continue
+        (status, data) = self.readFrame(self.parent)
+        if status == self.invalidationStatus:
+          self.applyInvalidation(cPickle.loads(data))
+        else:
+          self.writeLogLine('CLIENT: Unexpected frame with status '+str(status))
+    except (select.error, EnvironmentError, EOFError), e:
+      self.writeLogLine('CLIENT: Error reading invalidations '+str(e))
+      self.uncache()
+    return
 
-    objString = ''
+  def invalidate(self, keys):
+    '''Push an invalidation of the keys, or of all keys if None, to each child connected to this server
+       - The generation counts the changes, so that a server knows which of its saved replies are still current'''
+    self.generation += 1
+    if not self.children:
+      return
+    frame = self.packFrame(self.invalidationStatus, keys)
+    for child in self.children[:]:
+      child.writeFrame(frame)
+    return
+
+  def readPosted(self):
+    '''Read the replies to requests which were posted without waiting, logging any exception'''
+    while self.posted:
+      self.posted -= 1
+      (status, response) = self.readResponse()
+      if status:
+        self.writeLogLine('CLIENT: Posted request failed: '+str(response))
+    return
+
+  def post(self, operation, args):
+    '''Send a request to the parent without waiting for the reply, which is read before that of the next request'''
+    self.parent.sendall(self.packFrame(self.opcodeNumbers[operation], args))
+    self.posted += 1
+    return
+
+  def request(self, requests):
+    '''Send the requests, a list of (operation, args) pairs, to the parent together, and return the list of replies
+       - If the parent raised an exception for any request, the first one is raised here once all replies are read'''
+    import socket
+
+    frames    = ''.join([self.packFrame(self.opcodeNumbers[operation], args) for operation, args in requests])
+    responses = None
     for i in range(3):
       try:
-        packet = []
-        if operation is None:
-          operation = inspect.stack()[1][3]
-        packet.append(operation)
-        if not key is None:
-          packet.append(key)
-          if not value is None:
-            packet.append(value)
-        self.sendPacket(self.parent, tuple(packet), source = 'CLIENT')
-        response = self.recvPacket(self.parent, source = 'CLIENT')
+        self.parent.sendall(frames)
+        self.readPosted()
+        responses = [self.readResponse() for request in requests]
         break
-      except IOError, e:
-        self.writeLogLine('CLIENT: IOError '+str(e))
-        if e.errno == 32:
-          self.connectParent(self.parentAddr, self.parentDirectory)
-      except Exception, e:
-        self.writeLogLine('CLIENT: Exception '+str(e)+' '+str(e.__class__))
-    try:
-      if isinstance(response, Exception):
+      except (socket.error, EnvironmentError, EOFError), e:
+        self.writeLogLine('CLIENT: Error communicating with parent '+str(e)+' '+str(e.__class__))
+        self.posted = 0
+        self.connectParent(self.parentAddr, self.parentDirectory)
+    if responses is None:
+      self.writeLogLine('CLIENT: Could not get a response from the parent')
+      return [None for request in requests]
+    for status, response in responses:
+      if status:
         self.writeLogLine('CLIENT: Got an exception '+str(response))
         raise response
-      else:
-        self.writeLogLine('CLIENT: Received value '+str(response)+' '+str(type(response)))
-    except UnboundLocalError:
-      self.writeLogLine('CLIENT: Could not unpickle response')
-      response  = None
-    return response
-
-  def serve(self):
-    '''Start a server'''
-    import socket
-    import SocketServer
+    return [response for status, response in responses]
 
-    if not useThreads:
-      raise RuntimeError('Cannot run a server if threads are disabled')
+  def send(self, key = None, value = None, operation = None):
+    '''Send a single request to the parent, and return the reply
+       - If the operation is not given, it is the name of the calling method'''
+    if operation is None:
+      operation = sys._getframe(1).f_code.co_name
+    args = ()
+    if not key is None:
+      args = (key,)
+      if not value is None:
+        args = (key, value)
+    return self.request([(operation, args)])[0]
+
+  def createServer(self, address):
+    '''Return a server at the address, a path for a Unix domain socket or a (host, port) pair, which answers the requests of the children of this dictionary'''
+    return RDictServer(self, address)
+
+  def getServerAddress(self, tcp = 0):
+    '''Return the address for a server in the current directory, which is a Unix domain socket unless tcp is true, or those are unavailable
+       - A TCP server binds any free port, so no ports need to be tried'''
+    import socket
 
-    class ProcessHandler(SocketServer.StreamRequestHandler):
-      def handle(self):
-        import time
+    if not tcp and hasattr(socket, 'AF_UNIX'):
+      path = os.path.abspath(self.socketFilename)
+      # The path of a Unix domain socket is limited to about 100 characters
+      if len(path) < 100:
+        return path
+    return (socket.gethostname(), 0)
 
-        self.server.rdict.lastAccess = time.time()
-        self.server.rdict.writeLogLine('SERVER: Started new handler')
-        while 1:
-          try:
-            value = self.server.rdict.recvPacket(self.rfile, source = 'SERVER')
-          except EOFError, e:
-            self.server.rdict.writeLogLine('SERVER: EOFError receiving packet '+str(e)+' '+str(e.__class__))
-            return
-          except Exception, e:
-            self.server.rdict.writeLogLine('SERVER: Error receiving packet '+str(e)+' '+str(e.__class__))
-            self.server.rdict.sendPacket(self.wfile, e, source = 'SERVER')
-            continue
-          if value[0] == 'stop': break
-          try:
-            response = getattr(self.server.rdict, value[0])(*value[1:])
-          except Exception, e:
-            self.server.rdict.writeLogLine('SERVER: Error executing operation '+str(e)+' '+str(e.__class__))
-            self.server.rdict.sendPacket(self.wfile, e, source = 'SERVER')
-          else:
-            self.server.rdict.sendPacket(self.wfile, response, source = 'SERVER')
-        return
+  def serve(self, tcp = 0):
+    '''Start a server, which exits once it has been idle for shutdownDelay seconds, or on SIGTERM'''
+    import errno
+    import signal
+    import socket
 
     # check if server is running
     if os.path.exists(self.addrFilename):
@@ -586,123 +787,517 @@ Arg class, which wraps the usual value.'''
         if e.errno != errno.EBADF:
           raise RuntimeError('Could not close default descriptor '+str(i))
 
-    # wish there was a better way to get a usable socket
     self.writeLogLine('SERVER: Establishing socket server')
-    basePort = 8000
-    flag     = 'nosocket'
-    p        = 1
-    while p < 1000 and flag == 'nosocket':
-      try:
-        server = SocketServer.ThreadingTCPServer((socket.gethostname(), basePort+p), ProcessHandler)
-        flag   = 'socket'
-      except Exception, e:
-        p = p + 1
-    if flag == 'nosocket':
-      p = 1
-      while p < 1000 and flag == 'nosocket':
-        try:
-          server = SocketServer.ThreadingTCPServer(('localhost', basePort+p), ProcessHandler)
-          flag   = 'socket'
-        except Exception, e:
-          p = p + 1
-    if flag == 'nosocket':
-      self.writeLogLine('SERVER: Could not established socket server on port '+str(basePort+p))
-      raise RuntimeError,'Cannot get available socket'
-    self.writeLogLine('SERVER: Established socket server on port '+str(basePort+p))
+    address = self.getServerAddress(tcp)
+    try:
+      server = self.createServer(address)
+    except socket.error, e:
+      if not isinstance(address, tuple):
+        raise
+      self.writeLogLine('SERVER: Could not listen on '+str(address)+': '+str(e))
+      server = self.createServer(('localhost', 0))
+    self.writeLogLine('SERVER: Established socket server at '+str(server.server_address))
 
     self.isServer = 1
     self.writeServerAddr(server)
-    self.serverShutdown(os.getpid())
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
 
-    server.rdict = self
     self.writeLogLine('SERVER: Started server')
-    server.serve_forever()
+    try:
+      server.serve_forever(idleTimeout = self.shutdownDelay)
+    finally:
+      server.server_close()
+      self.shutdown()
     return
 
   def load(self):
-    '''Load the saved dictionary'''
+    '''Load the saved dictionary, replaying the journal on top of the snapshot'''
     if not self.parentDirectory is None and os.path.samefile(os.getcwd(), self.parentDirectory):
       return
     self.saveFilename = os.path.abspath(self.saveFilename)
     if os.path.exists(self.saveFilename):
       try:
-        dbFile = file(self.saveFilename)
-        data   = cPickle.load(dbFile)
-        self.updateTypes(data)
+        dbFile = file(self.saveFilename, 'rb')
+        if dbFile.read(len(self.snapshotMagic)) == self.snapshotMagic:
+          self.loadSnapshot(dbFile)
+        else:
+          dbFile.seek(0)
+          self.updateTypes(cPickle.load(dbFile))
         dbFile.close()
         self.writeLogLine('Loaded dictionary from '+self.saveFilename)
       except Exception, e:
         self.writeLogLine('Problem loading dictionary from '+self.saveFilename+'\n--> '+str(e))
     else:
       self.writeLogLine('No dictionary to load in this file: '+self.saveFilename)
+    self.replayJournal()
     return
 
-  def save(self, force = 0):
-    '''Save the dictionary after 5 seconds, ignoring all subsequent calls until the save
-       - Giving force = True will cause an immediate save'''
+  def loadSnapshot(self, dbFile):
+    '''Enter a LazyArg for each key in the index of the snapshot, with the file memory mapped when possible'''
+    import struct
+
+    (length,) = struct.unpack('!I', dbFile.read(4))
+    index     = cPickle.loads(dbFile.read(length))
+    start     = len(self.snapshotMagic) + 4 + length
+    try:
+      import mmap
+      data = mmap.mmap(dbFile.fileno(), 0, access = mmap.ACCESS_READ)
+    except (ImportError, EnvironmentError):
+      dbFile.seek(0)
+      data = dbFile.read()
+    for key, offset, length, valueSet in index:
+      dict.__setitem__(self, key, LazyArg(key, data, start+offset, length, valueSet))
+    return
+
+  def writeSnapshot(self, dbFile):
+    '''Write the index of the local entries followed by their pickles, copying those never unpickled as they are'''
+    import struct
+
+    index  = []
+    values = []
+    offset = 0
+    for key, value in dict.items(self):
+      if isinstance(value, LazyArg):
+        data = value.getData()
+      elif value.getTemporary():
+        continue
+      else:
+        data = cPickle.dumps(value, 2)
+      index.append((key, offset, len(data), value.isValueSet()))
+      values.append(data)
+      offset += len(data)
+    index = cPickle.dumps(index, 2)
+    dbFile.write(self.snapshotMagic+struct.pack('!I', len(index))+index)
+    for data in values:
+      dbFile.write(data)
+    return
+
+  def getJournalFilename(self):
+    return self.saveFilename+'.journal'
+
+  def replayJournal(self):
+    '''Apply the records of the journal, and cut off a last record which was not completely written'''
+    import struct
+    import zlib
+
+    filename = self.getJournalFilename()
+    if not os.path.isfile(filename):
+      return
+    f = file(filename, 'rb')
+    data = f.read()
+    f.close()
+    offset  = 0
+    records = 0
+    while offset + 8 <= len(data):
+      (length, crc) = struct.unpack('!II', data[offset:offset+8])
+      payload       = data[offset+8:offset+8+length]
+      if not len(payload) == length or not zlib.crc32(payload) & 0xffffffffL == crc:
+        break
+      try:
+        (operation, key, arg) = cPickle.loads(payload)
+      except Exception, e:
+        self.writeLogLine('Problem loading journal record from '+filename+'\n--> '+str(e))
+        break
+      if operation == 'set':
+        dict.__setitem__(self, key, arg)
+      elif operation == 'del' and dict.has_key(self, key):
+        dict.__delitem__(self, key)
+      offset  += 8+length
+      records += 1
+    self.journalSize = offset
+    self.writeLogLine('Replayed '+str(records)+' journal records from '+filename)
+    if offset < len(data):
+      self.writeLogLine('Discarding '+str(len(data) - offset)+' bytes of incomplete journal records from '+filename)
+      if not self.readonly:
+        f = file(filename, 'r+b')
+        f.truncate(offset)
+        f.close()
+    return
+
+  def getJournal(self):
+    '''Return the descriptor of the journal of the current saveFilename, opened for appending'''
+    filename = self.getJournalFilename()
+    if not self.journalName == filename:
+      if not self.journalFd is None:
+        os.close(self.journalFd)
+      self.journalFd   = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+      self.journalName = filename
+      self.journalSize = os.fstat(self.journalFd).st_size
+    return self.journalFd
+
+  def getSaveLock(self):
+    if self.journalLock is None:
+      if not useThreads:
+        return None
+      import threading
+      self.journalLock = threading.RLock()
+    return self.journalLock
+
+  def save(self, force = 0, keys = None):
+    '''Append a journal record for each of the keys, or without keys, write the whole dictionary as the snapshot
+       - The records are synced to disk with the others made within syncInterval seconds, and giving force = True will cause an immediate sync'''
+    import struct
+    import time
+    import zlib
+
+    if not keys is None:
+      self.invalidate(keys)
+    if self.readonly: return
+    if keys is None:
+      return self.compact()
+    records = []
+    for key in keys:
+      if dict.has_key(self, key) and not self.getLocalType(key).getTemporary():
+        payload = cPickle.dumps(('set', key, self.getLocalType(key)), 2)
+      else:
+        payload = cPickle.dumps(('del', key, None), 2)
+      records.append(struct.pack('!II', len(payload), zlib.crc32(payload) & 0xffffffffL)+payload)
+    lock = self.getSaveLock()
+    if lock: lock.acquire()
+    try:
+      fd = self.getJournal()
+      # A single write keeps the records of one save together, even with several writers
+      os.write(fd, ''.join(records))
+      self.journalSize += sum(map(len, records))
+      if force or time.time() - self.lastSync >= self.syncInterval:
+        self.sync()
+      elif useThreads and not self.saveTimer:
+        import threading
+        self.saveTimer = threading.Timer(self.syncInterval, self.sync)
+        self.saveTimer.setDaemon(1)
+        self.saveTimer.start()
+      if self.journalSize > self.compactSize and self.journalSize > self.getSnapshotSize():
+        self.compact()
+    finally:
+      if lock: lock.release()
+    return
+
+  def sync(self):
+    '''Flush the journal to disk, cancelling any pending timer to do so'''
+    import time
+
+    if self.saveTimer:
+      self.saveTimer.cancel()
+    self.saveTimer = None
+    self.lastSync  = time.time()
+    if not self.journalFd is None:
+      os.fsync(self.journalFd)
+    return
+
+  def getSnapshotSize(self):
+    if os.path.isfile(self.saveFilename):
+      return os.path.getsize(self.saveFilename)
+    return 0
+
+  def compact(self):
+    '''Write the local entries as a new snapshot, replacing it atomically, and empty the journal
+       - A crash after the snapshot is replaced only replays records already in it, which changes nothing'''
+    import tempfile
+
     if self.readonly: return
-    if force or not useThreads:
-      self.saveTimer = None
-      # This should be a critical section
-      dbFile = file(self.saveFilename, 'w')
-      data   = dict(filter(lambda i: not i[1].getTemporary(), self.localitems()))
-      cPickle.dump(data, dbFile)
+    lock = self.getSaveLock()
+    if lock: lock.acquire()
+    try:
+      (fd, tmpName) = tempfile.mkstemp(prefix = os.path.basename(self.saveFilename)+'.', dir = os.path.dirname(os.path.abspath(self.saveFilename)))
+      dbFile = os.fdopen(fd, 'wb')
+      self.writeSnapshot(dbFile)
+      dbFile.flush()
+      os.fsync(dbFile.fileno())
       dbFile.close()
+      os.chmod(tmpName, 0666 & ~self.getUmask())
+      os.rename(tmpName, self.saveFilename)
+      fd = self.getJournal()
+      os.ftruncate(fd, 0)
+      self.journalSize = 0
+      self.sync()
       self.writeLogLine('Saved local dictionary to '+os.path.abspath(self.saveFilename))
-    elif not self.saveTimer:
-      import threading
-      self.saveTimer = threading.Timer(5, self.save, [], {'force': 1})
-      self.saveTimer.setDaemon(1)
-      self.saveTimer.start()
+    finally:
+      if lock: lock.release()
     return
 
+  def getUmask(self):
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
   def shutdown(self):
     '''Shutdown the dictionary, writing out changes and notifying parent'''
     if self.saveTimer:
       self.saveTimer.cancel()
-      self.save(force = 1)
+      self.sync()
+    if not self.journalFd is None:
+      os.close(self.journalFd)
+      self.journalFd   = None
+      self.journalName = None
     if self.isServer and os.path.isfile(self.addrFilename):
       os.remove(self.addrFilename)
     if not self.parent is None:
-      self.sendPacket(self.parent, self.stopCmd, isPickled = 1)
+      try:
+        self.readPosted()
+        self.parent.sendall(self.packFrame(self.opcodeNumbers['stop'], ()))
+      except Exception, e:
+        self.writeLogLine('CLIENT: Error stopping the connection to the parent '+str(e))
       self.parent.close()
       self.parent = None
     self.writeLogLine('Shutting down')
     self.logFile.close()
     return
 
-  def serverShutdown(self, pid, delay = shutdownDelay):
-    if self.shutdownTimer is None:
-      import threading
+class RDictConnection(object):
+  '''A child connected to an RDictServer, with the bytes read but not yet framed, the queue of its requests, and the output not yet sent'''
+  def __init__(self, server, sock):
+    self.server   = server
+    self.socket   = sock
+    self.input    = ''
+    self.requests = []
+    self.output   = []
+    return
+
+  def read(self):
+    '''Read what the child has sent, queueing each complete request, and return False once the child has closed the connection'''
+    import errno
+    import socket
+
+    try:
+      data = self.socket.recv(65536)
+    except socket.error, e:
+      if e[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+        return 1
+      return 0
+    if not data:
+      return 0
+    self.input += data
+    offset = 0
+    while len(self.input) - offset >= 5:
+      (opcode, length) = struct.unpack('!BI', self.input[offset:offset+5])
+      if len(self.input) - offset - 5 < length:
+        break
+      self.requests.append((opcode, self.input[offset+5:offset+5+length]))
+      offset += 5+length
+    self.input = self.input[offset:]
+    return 1
+
+  def writeFrame(self, frame):
+    '''Send a frame to the child at once if no output is waiting before it, and otherwise queue it
+       - An invalidation may come from another thread, so the output is guarded by the lock of the server'''
+    self.server.lock.acquire()
+    try:
+      self.output.append(frame)
+      if len(self.output) == 1:
+        self.send()
+      queued = len(self.output)
+    finally:
+      self.server.lock.release()
+    if queued:
+      self.server.wake()
+    return
+
+  def flush(self):
+    '''Send as much of the output as the socket accepts without blocking, and return False if the child is gone'''
+    self.server.lock.acquire()
+    try:
+      return self.send()
+    finally:
+      self.server.lock.release()
+
+  def send(self):
+    import errno
+    import socket
 
-      self.shutdownTimer = threading.Timer(delay, self.serverShutdown, [pid], {'delay': 0})
-      self.shutdownTimer.setDaemon(1)
-      self.shutdownTimer.start()
-      self.writeLogLine('SERVER: Set shutdown timer for process '+str(pid)+' at '+str(delay)+' seconds')
+    data = ''.join(self.output)
+    self.output = []
+    try:
+      sent = self.socket.send(data)
+    except socket.error, e:
+      if not e[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+        return 0
+      sent = 0
+    if sent < len(data):
+      self.output = [data[sent:]]
+    return 1
+
+class RDictServer(object):
+  '''Answers the children of an RDict from a single thread, which waits on all their sockets with select()
+     - The requests of each child are queued, and at most requestsPerRound are answered before turning to the next child, so that no child waits behind a long batch
+     - Replies to requests which only read are saved until the next change to the dictionary, so that children reading the same entries cost one lookup'''
+  requestsPerRound = 16
+  readOperations   = ['__len__', 'getType', 'has_key', 'hasType', 'items', 'keys', 'types', 'lookup']
+  maxReplies       = 10000
+
+  def __init__(self, rdict, address):
+    import socket
+    import threading
+
+    if isinstance(address, str):
+      if os.path.exists(address):
+        os.remove(address)
+      self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     else:
+      self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.socket.bind(address)
+    self.socket.listen(128)
+    self.socket.setblocking(0)
+    self.server_address = self.socket.getsockname()
+    self.rdict          = rdict
+    self.connections    = {}
+    self.replies        = {}
+    self.generation     = rdict.generation
+    self.running        = 0
+    self.lock           = threading.Lock()
+    (self.wakeRead, self.wakeWrite) = os.pipe()
+    return
+
+  def wake(self):
+    '''Interrupt the select() of the server, so that output queued by another thread is sent'''
+    try:
+      os.write(self.wakeWrite, 'w')
+    except OSError:
+      pass
+    return
+
+  def accept(self):
+    import errno
+    import socket
+
+    try:
+      (sock, address) = self.socket.accept()
+    except socket.error, e:
+      if e[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+        return
+      raise
+    sock.setblocking(0)
+    if sock.family == socket.AF_INET:
+      # Replies and invalidations are small, and must not wait for the acknowledgement of earlier frames
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection = RDictConnection(self, sock)
+    self.connections[sock] = connection
+    self.rdict.children.append(connection)
+    self.rdict.writeLogLine('SERVER: Accepted a child, now '+str(len(self.connections)))
+    return
+
+  def close(self, connection):
+    if connection.socket in self.connections:
+      del self.connections[connection.socket]
+      self.rdict.children.remove(connection)
+      connection.socket.close()
+      self.rdict.writeLogLine('SERVER: Closed a child, now '+str(len(self.connections)))
+    return
+
+  def answer(self, connection, opcode, data):
+    '''Answer one request of the child, from the saved replies when the request only reads'''
+    import time
+
+    rdict = self.rdict
+    rdict.lastAccess = time.time()
+    if opcode >= len(rdict.opcodes):
+      rdict.writeLogLine('SERVER: Invalid opcode '+str(opcode))
+      return self.close(connection)
+    operation = rdict.opcodes[opcode]
+    if operation == 'stop':
+      return self.close(connection)
+    if not self.generation == rdict.generation:
+      self.replies.clear()
+      self.generation = rdict.generation
+    request = None
+    if operation in self.readOperations:
+      request = (opcode, data)
+      if request in self.replies:
+        return connection.writeFrame(self.replies[request])
+    try:
+      response = (0, getattr(rdict, operation)(*cPickle.loads(data)))
+    except Exception, e:
+      rdict.writeLogLine('SERVER: Error executing '+operation+': '+str(e)+' '+str(e.__class__))
+      response = (1, e)
+    try:
+      frame = rdict.packFrame(*response)
+    except Exception, e:
+      rdict.writeLogLine('SERVER: Error packing reply to '+operation+': '+str(e)+' '+str(e.__class__))
+      response = (1, e)
+      frame    = rdict.packFrame(1, RuntimeError('Could not send reply: '+str(e)))
+    # A read which reached our own parent may have brought invalidations, and then the reply is not saved
+    if not request is None and not response[0] and self.generation == rdict.generation:
+      if len(self.replies) >= self.maxReplies:
+        self.replies.clear()
+      self.replies[request] = frame
+    connection.writeFrame(frame)
+    return
+
+  def serve_forever(self, idleTimeout = None, pollInterval = 1.0):
+    '''Answer requests until shutdown() is called, or no request has arrived for idleTimeout seconds'''
+    import errno
+    import select
+    import time
+
+    self.running = 1
+    while self.running:
+      readers = [self.socket, self.wakeRead]+self.connections.keys()
+      if not self.rdict.parent is None:
+        # Invalidations pushed by our own parent are passed on to the children as they arrive
+        readers.append(self.rdict.parent)
+      writers = [c.socket for c in self.connections.values() if c.output]
+      timeout = pollInterval
+      if [c for c in self.connections.values() if c.requests]:
+        timeout = 0
       try:
-        import signal
-        import time
-
-        idleTime = time.time() - self.lastAccess
-        self.writeLogLine('SERVER: Last access '+str(self.lastAccess))
-        self.writeLogLine('SERVER: Idle time '+str(idleTime))
-        if idleTime < RDict.shutdownDelay:
-          self.writeLogLine('SERVER: Extending shutdown timer for '+str(pid)+' by '+str(RDict.shutdownDelay - idleTime)+' seconds')
-          self.shutdownTimer = None
-          self.serverShutdown(pid, RDict.shutdownDelay - idleTime)
-        else:
-          self.writeLogLine('SERVER: Killing server '+str(pid))
-          os.kill(pid, signal.SIGTERM)
-      except Exception, e:
-        self.writeLogLine('SERVER: Exception killing server: '+str(e))
+        (readable, writable, exceptional) = select.select(readers, writers, [], timeout)
+      except select.error, e:
+        if e[0] == errno.EINTR:
+          continue
+        raise
+      for sock in readable:
+        if sock is self.socket:
+          self.accept()
+        elif sock is self.wakeRead:
+          os.read(self.wakeRead, 4096)
+        elif sock is self.rdict.parent:
+          self.rdict.pollInvalidations()
+        elif sock in self.connections:
+          connection = self.connections[sock]
+          if not connection.read():
+            self.close(connection)
+      for connection in self.connections.values():
+        for i in range(min(self.requestsPerRound, len(connection.requests))):
+          (opcode, data) = connection.requests.pop(0)
+          self.answer(connection, opcode, data)
+          if not connection.socket in self.connections:
+            break
+      for connection in self.connections.values():
+        if connection.output and not connection.flush():
+          self.close(connection)
+      if idleTimeout and time.time() - self.rdict.lastAccess > idleTimeout:
+        self.rdict.writeLogLine('SERVER: Idle for '+str(idleTimeout)+' seconds, shutting down')
+        break
+    self.running = 0
+    return
+
+  def shutdown(self):
+    '''Stop the server loop, which may be running in another thread or interrupted by a signal'''
+    self.running = 0
+    self.wake()
+    return
+
+  def server_close(self):
+    '''Send what the children are owed, and close all sockets'''
+    for connection in self.connections.values():
+      connection.socket.setblocking(1)
+      try:
+        connection.socket.sendall(''.join(connection.output))
+      except Exception:
+        pass
+      self.close(connection)
+    self.socket.close()
+    if isinstance(self.server_address, str) and os.path.exists(self.server_address):
+      os.remove(self.server_address)
+    os.close(self.wakeRead)
+    os.close(self.wakeWrite)
     return
 
 if __name__ ==  '__main__':
   import sys
   try:
     if len(sys.argv) < 2:
-      print 'RDict.py [server | client | clear | insert | remove] [parent]'
+      print 'RDict.py [server | tcpServer | client | clear | insert | remove] [parent]'
     else:
       action = sys.argv[1]
       parent = None
@@ -710,6 +1305,8 @@ if __name__ ==  '__main__':
         if not sys.argv[2] == 'None': parent = sys.argv[2]
       if action == 'server':
         RDict(parentDirectory = parent).serve()
+      elif action == 'tcpServer':
+        RDict(parentDirectory = parent).serve(tcp = 1)
       elif action == 'client':
         print 'Entries in server dictionary'
         rdict = RDict(parentDirectory = parent)
@@ -16,6 +16,17 @@ class Builder (base.Base):
       inputs[None] = input
     return inputs
 
+  def handleFileSet(self, vertex, set):
+    '''Process the FileSet with the transform, charging the resources used by its commands to the class of the transform'''
+    import commandEngine
+
+    commandEngine.ResourceUsage.enter(vertex.__class__.__module__+'.'+vertex.__class__.__name__)
+    try:
+      vertex.handleFileSet(set)
+    finally:
+      commandEngine.ResourceUsage.leave()
+    return
+
   def execute(self, start = None, input = None):
     '''Execute the topologically sorted build graph, optionally starting from the transform "start" with the optional FileSet "input"'''
     import build.buildGraph
@@ -33,13 +44,13 @@ class Builder (base.Base):
         started = 1
         if None in inputs:
           self.debugPrint('Processing initial input '+self.debugFileSetStr(inputs[None]), 3, 'build')
-          vertex.handleFileSet(inputs[None])
+          self.handleFileSet(vertex, inputs[None])
       if vertex in inputs:
         self.debugPrint('Processing specified input '+self.debugFileSetStr(inputs[vertex]), 3, 'build')
-        vertex.handleFileSet(inputs[vertex])
+        self.handleFileSet(vertex, inputs[vertex])
       for parent in self.buildGraph.getEdges(vertex)[0]:
         self.debugPrint('Processing input '+self.debugFileSetStr(parent.output)+' from vertex: '+str(parent), 3, 'build')
-        vertex.handleFileSet(parent.output)
+        self.handleFileSet(vertex, parent.output)
       self.debugPrint('Generated output '+self.debugFileSetStr(vertex.output)+' from vertex: '+str(vertex), 3, 'build')
       self.currentVertex = vertex
       yield vertex
@@ -120,7 +120,7 @@ class Compiler(build.processor.Processor):
     '''Compile all the files in "set" using a shell command'''
     if not len(set) or set.tag.startswith('old'): return self.output
     self.debugPrint('Compiling '+str(set)+' into a '+self.language+' '+self.action, 3, 'compile')
-    command = ' '.join([self.getProcessor()]+self.getFlags(set)+set)
+    command = self.getCommand([self.getProcessor()]+self.getFlags(set), set)
     output  = self.executeShellCommand(command, self.handleErrors)
     #self.output.extend(map(self.getIntermediateFileName, set))
     return self.output
@@ -1,6 +1,7 @@
 import user
 import importer
 import base
+import profiler
 import sourceDatabase
 
 import atexit
@@ -654,6 +655,8 @@ class Framework(base.Base):
     if self.argDB['help']:
       self.executeTarget('printTargets')
       return
+    if self.argDB['profile-python'] and profiler.PythonProfiler.defaultProfiler is None:
+      return profiler.PythonProfiler(self.argDB['profile-python']).run(self.mainBuild, target)
     target = self.expandTargets(target)
     self.setupProject()
     if 'activate' in target:
@@ -669,6 +672,7 @@ class Framework(base.Base):
     self.setupBuild()
     self.stampBuild()
     map(self.executeTarget, target)
+    self.logResourceUsage()
     return
 
   def main(self, target = None):
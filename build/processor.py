@@ -2,6 +2,8 @@ from __future__ import generators
 import base
 import build.transform
 import build.fileset
+import commandEngine
+import script
 
 import os
 
@@ -37,6 +39,18 @@ class Processor(build.transform.Transform):
     return self._processor
   processor = property(getProcessor, setProcessor, doc = 'This is the executable which will process files')
 
+  def getCommand(self, flags, files, trailingFlags = []):
+    '''Return the argument vector which runs the processor on the files
+       - The flags and trailing flags are shell text, and the files are passed verbatim between them
+       - If the flags use shell features, this returns a shell command instead'''
+    argv     = script.Script.getArgv(' '.join(flags))
+    trailing = script.Script.splitWords(' '.join(trailingFlags))
+    if argv is None or trailing is None:
+      return ' '.join(flags+[script.Script.formatArgv(files)]+trailingFlags)
+    argv.extend(files)
+    argv.extend(trailing)
+    return argv
+
   def handleErrors(self, command, status, output):
     if status:
       raise RuntimeError('Could not execute \''+command+'\':\n'+output)
@@ -204,11 +218,33 @@ class Compiler(Processor):
     '''Compile all the files in "set"'''
     objs = map(self.getIntermediateFileName, set)
     self.debugPrint('Compiling '+str(set)+' into '+str(objs), 3, 'compile')
-    command = ' '.join([self.processor]+self.getFlags(set)+set)
+    command = self.getCommand([self.processor]+self.getFlags(set), set)
     output  = self.executeShellCommand(command, self.handleErrors)
     self.output.extend(objs)
     return self.output
 
+  def handleFileSet(self, set):
+    '''Compile the files of the set concurrently if they are processed individually
+       - The sources are updated in order, as each compile is found to have succeeded'''
+    if self.isSetwise or not self.checkTag(None, set.tag):
+      return Processor.handleFileSet(self, set)
+    commands = []
+    for f in set:
+      source = build.fileset.FileSet([f], tag = set.tag)
+      self.debugPrint('Compiling '+str(source)+' into '+str(map(self.getIntermediateFileName, source)), 3, 'compile')
+      commands.append((f, script.Script.submitShellCommand(self.getCommand([self.processor]+self.getFlags(source), source))))
+    try:
+      for f, command in commands:
+        script.Script.finishShellCommand(command, self.handleErrors)
+        self.output.append(self.getIntermediateFileName(f))
+        self.updateFile(f)
+    finally:
+      # After a failure, the remaining compiles are stopped
+      for f, command in commands:
+        commandEngine.CommandEngine.getDefault().kill(command)
+    map(self.handleFileSet, set.children)
+    return self.output
+
   def processOldFile(self, f, set):
     '''Put "old" object in for old source'''
     self.oldOutput.append(self.getIntermediateFileName(f))
@@ -328,7 +364,7 @@ class Linker(Processor):
       build.transform.Transform.handleFile(self, f, set)
     library = self.getLibrary(set)
     self.debugPrint('Linking '+str(set)+' into '+library, 3, 'compile')
-    command = ' '.join([self.processor]+set+self.getFlags(set))
+    command = self.getCommand([self.processor], set, self.getFlags(set))
     output  = self.executeShellCommand(command, self.handleErrors)
     self.output.append(library)
     return self.output
@@ -373,7 +409,7 @@ class DirectoryArchiver(Linker):
     if not os.path.exists(library):
       os.makedirs(library)
     self.debugPrint('Linking '+str(set)+' into '+library, 3, 'compile')
-    command = ' '.join([self.processor]+set+self.getFlags(set))
+    command = self.getCommand([self.processor], set, self.getFlags(set))
     output  = self.executeShellCommand(command, self.handleErrors)
     self.output.extend(map(lambda f: os.path.join(library, os.path.basename(f)), set))
     return self.output
@@ -0,0 +1,535 @@
+'''
+  The CommandEngine runs subprocesses concurrently from a single thread. Commands are submitted
+and later awaited, and the engine
+    - Starts at most "jobs" commands at once, queueing the rest in submission order
+    - Reads the output and error of every running command as it arrives, using select()
+    - Kills the process group of a command which passes its deadline, and reaps it
+
+Each command runs in its own process group, so that a timeout also kills the programs it started,
+such as the compiler passes run by a driver, and nothing is left running once configure has given
+up on a command.
+
+  The output and error are kept in an OutputBuffer, which holds everything by default. A caller
+which only needs the status, or the beginning and end of a long build, can ask for just the first
+and last lines, and can have the output written to the log as it arrives, so that memory stays
+bounded however much a command prints.
+
+  The resources used by each command, its CPU time, largest resident set, and block I/O, are read
+when it is reaped with os.wait4(), and include the programs it ran and waited for. They are totaled
+by ResourceUsage into the account innermost when the command finished, such as a configure module,
+the build of a package, or a build transform.
+
+  A command may also be a Python function, which is run in a forked process and given a file
+descriptor for its result. The parallel configure runs its workers this way. A worker asked to stop
+kills the commands it is running before it exits.
+'''
+import os
+import sys
+import time
+
+from collections import deque
+
+class OutputBuffer(object):
+  '''Collects the data read from a stream, keeping either all of it, or only its first and last lines
+     - If headLines or tailLines is given, only that many lines are kept from the beginning or end
+     - Each chunk is also written to the tee stream as it arrives, if one is given'''
+  def __init__(self, headLines = None, tailLines = None, tee = None):
+    self.headLines = headLines
+    self.tailLines = tailLines
+    self.tee       = tee
+    self.size      = 0
+    self.chunks    = []
+    self.head      = []
+    # The start of a line which is not yet complete, while the head is being filled
+    self.partial   = ''
+    # Chunks after the head, with their number of newlines, holding at least the last tailLines lines
+    self.tail      = deque()
+    self.tailCount = 0
+    self.lineCount = 0
+    return
+
+  def isBounded(self):
+    return not (self.headLines is None and self.tailLines is None)
+
+  def isHeadFull(self):
+    return self.headLines is None or len(self.head) >= self.headLines
+
+  def write(self, data):
+    self.size += len(data)
+    if not self.tee is None:
+      self.tee.write(data)
+    if not self.isBounded():
+      self.chunks.append(data)
+      return
+    if not self.isHeadFull():
+      lines = (self.partial+data).split('\n')
+      self.partial = lines.pop()
+      while lines and not self.isHeadFull():
+        self.head.append(lines.pop(0)+'\n')
+      if not self.isHeadFull():
+        return
+      data = ''.join([line+'\n' for line in lines])+self.partial
+      self.partial = ''
+    count = data.count('\n')
+    self.lineCount += count
+    if self.tailLines:
+      self.tail.append((data, count))
+      self.tailCount += count
+      # Only whole chunks are dropped, so a few more lines than needed are kept
+      while len(self.tail) > 1 and self.tailCount - self.tail[0][1] >= self.tailLines:
+        self.tailCount -= self.tail.popleft()[1]
+    return
+
+  def getvalue(self):
+    '''Return the data kept, with a line marking any lines which were dropped'''
+    if not self.isBounded():
+      return ''.join(self.chunks)
+    if self.partial:
+      self.head.append(self.partial)
+      self.partial = ''
+    text  = ''.join([chunk for chunk, count in self.tail])
+    lines = text.split('\n')
+    if not lines[-1]:
+      lines.pop()
+    else:
+      # The last line has no newline
+      self.lineCount += 1
+    kept = []
+    if self.tailLines and lines:
+      kept = lines[-self.tailLines:]
+    tail = '\n'.join(kept)
+    if kept and text.endswith('\n'):
+      tail += '\n'
+    if self.lineCount > len(kept):
+      return ''.join(self.head)+'[... '+str(self.lineCount-len(kept))+' lines omitted ...]\n'+tail
+    return ''.join(self.head)+tail
+
+class ResourceUsage(object):
+  '''Totals of the resources used by commands, charged to named accounts
+     - The CPU times and block counts are summed, and the resident set is the largest of any command
+     - The resident set is given in the units of the system, which are kilobytes on Linux'''
+  fields   = ['user', 'system', 'maxRSS', 'inBlocks', 'outBlocks']
+  # The names of the accounts entered, innermost last
+  stack    = []
+  # The ResourceUsage of each account by name
+  accounts = {}
+
+  def __init__(self):
+    self.commands  = 0
+    self.user      = 0.0
+    self.system    = 0.0
+    self.maxRSS    = 0
+    self.inBlocks  = 0
+    self.outBlocks = 0
+    return
+
+  def __str__(self):
+    return '%d commands, %.2fs user, %.2fs system, %d max RSS, %d blocks in, %d blocks out' % (self.commands, self.user, self.system, self.maxRSS, self.inBlocks, self.outBlocks)
+
+  def getUsage(rusage):
+    '''Return the fields of a resource usage from os.wait4() as a dictionary'''
+    return {'user': rusage.ru_utime, 'system': rusage.ru_stime, 'maxRSS': rusage.ru_maxrss, 'inBlocks': rusage.ru_inblock, 'outBlocks': rusage.ru_oublock}
+  getUsage = staticmethod(getUsage)
+
+  def add(self, usage, commands = 1):
+    '''Add a usage dictionary, from getUsage() or getDict()'''
+    self.commands  += commands
+    self.user      += usage['user']
+    self.system    += usage['system']
+    self.maxRSS     = max(self.maxRSS, usage['maxRSS'])
+    self.inBlocks  += usage['inBlocks']
+    self.outBlocks += usage['outBlocks']
+    return
+
+  def getDict(self):
+    d = dict([(name, getattr(self, name)) for name in self.fields])
+    d['commands'] = self.commands
+    return d
+
+  def enter(name):
+    '''Charge the commands which finish from now on to the named account, until leave()'''
+    ResourceUsage.stack.append(name)
+    return
+  enter = staticmethod(enter)
+
+  def leave():
+    ResourceUsage.stack.pop()
+    return
+  leave = staticmethod(leave)
+
+  def charge(cmd):
+    '''Add the usage of a finished Command to the innermost account, if there is one'''
+    if cmd.usage is None or not ResourceUsage.stack:
+      return
+    name = ResourceUsage.stack[-1]
+    if not name in ResourceUsage.accounts:
+      ResourceUsage.accounts[name] = ResourceUsage()
+    ResourceUsage.accounts[name].add(cmd.usage)
+    return
+  charge = staticmethod(charge)
+
+  def getAccounts():
+    '''Return the totals of each account as dictionaries, for sending to another process'''
+    return dict([(name, usage.getDict()) for name, usage in ResourceUsage.accounts.items()])
+  getAccounts = staticmethod(getAccounts)
+
+  def mergeAccounts(accounts):
+    '''Add the totals from getAccounts() in another process'''
+    for name, usage in accounts.items():
+      if not name in ResourceUsage.accounts:
+        ResourceUsage.accounts[name] = ResourceUsage()
+      ResourceUsage.accounts[name].add(usage, usage['commands'])
+    return
+  mergeAccounts = staticmethod(mergeAccounts)
+
+  def getSummary():
+    '''Return a report of the accounts, those using the most CPU time first'''
+    accounts = [(usage.user+usage.system, name, usage) for name, usage in ResourceUsage.accounts.items()]
+    accounts.sort()
+    accounts.reverse()
+    return 'Resources used by commands:\n'+''.join(['  '+name+': '+str(usage)+'\n' for t, name, usage in accounts])
+  getSummary = staticmethod(getSummary)
+
+class Command(object):
+  '''A submitted command, which holds its output, error, and status once it has finished'''
+  def __init__(self, command, argv = None, cwd = None, timeout = None, function = None, abortText = None, headLines = None, tailLines = None, tee = None):
+    # The command as a string, used for the shell and messages
+    self.command   = command
+    # The argument vector, or None if the command is run by the shell
+    self.argv      = argv
+    self.cwd       = cwd
+    self.timeout   = timeout
+    self.function  = function
+    # Text which ends the command if it appears in its output, such as a password prompt
+    self.abortText = abortText
+    self.pid       = None
+    self.deadline  = None
+    self.started   = None
+    self.finished  = None
+    # Map from a file descriptor to the name of the stream read from it
+    self.streams   = {}
+    # Only the output is written to the tee stream
+    self.buffers   = {'output': OutputBuffer(headLines, tailLines, tee), 'error': OutputBuffer(headLines, tailLines)}
+    # The end of the data read from each stream, which may hold the start of the abort text
+    self.recent    = {'output': '', 'error': ''}
+    self.output    = ''
+    self.error     = ''
+    self.status    = None
+    self.timedOut  = 0
+    self.aborted   = 0
+    # The resources used by the process and the children it waited for, or None if unknown
+    self.usage     = None
+    return
+
+  def __str__(self):
+    return 'Command('+self.command+')'
+
+  def isDone(self):
+    return not self.status is None
+
+  def addOutput(self, name, data):
+    '''Record data read from one of the streams of the command, returning True if it completes the abort text'''
+    self.buffers[name].write(data)
+    if self.abortText is None:
+      return 0
+    recent = self.recent[name]+data
+    self.recent[name] = recent[-len(self.abortText):]
+    return recent.find(self.abortText) >= 0
+
+  def getSizes(self):
+    '''Return the number of bytes of output and error, including any which were not kept'''
+    return (self.buffers['output'].size, self.buffers['error'].size)
+
+  def finish(self, status):
+    '''Record the exit status, and collect the captured streams'''
+    self.output   = self.buffers['output'].getvalue()
+    self.error    = self.buffers['error'].getvalue()
+    self.status   = status
+    self.finished = time.time()
+    return
+
+  def getResult(self):
+    '''Return (output, error, status), where a command which passed its deadline has status -1'''
+    return (self.output, self.error, self.status)
+
+class CommandEngine(object):
+  # The engine used by Script.executeShellCommand()
+  defaultEngine = None
+
+  def __init__(self, jobs = 1):
+    self.jobs    = max(1, jobs)
+    self.pending = []
+    self.running = []
+    # Map from a file descriptor to the running command which owns it
+    self.fds     = {}
+    return
+
+  def getDefault():
+    '''Return the default engine, which runs as many commands at once as there are processors'''
+    if CommandEngine.defaultEngine is None:
+      CommandEngine.defaultEngine = CommandEngine(CommandEngine.getProcessorCount())
+    return CommandEngine.defaultEngine
+  getDefault = staticmethod(getDefault)
+
+  def getProcessorCount():
+    try:
+      return max(1, int(os.sysconf('SC_NPROCESSORS_ONLN')))
+    except (AttributeError, ValueError, OSError):
+      return 1
+  getProcessorCount = staticmethod(getProcessorCount)
+
+  def isAvailable():
+    '''The engine requires fork() and process groups'''
+    return hasattr(os, 'fork') and hasattr(os, 'killpg') and hasattr(os, 'setpgid')
+  isAvailable = staticmethod(isAvailable)
+
+  def submit(self, command, argv = None, cwd = None, timeout = None, abortText = None, headLines = None, tailLines = None, tee = None):
+    '''Queue a command, which is run by the shell unless an argument vector is given, and return its Command
+       - The timeout in seconds counts from the start of the command, and None means no limit
+       - The headLines, tailLines, and tee arguments are given to the OutputBuffer of each stream'''
+    cmd = Command(command, argv, cwd, timeout, abortText = abortText, headLines = headLines, tailLines = tailLines, tee = tee)
+    self.pending.append(cmd)
+    self.startPending()
+    return cmd
+
+  def submitFunction(self, function, name = 'function'):
+    '''Queue a function, which is called in a forked process with a file descriptor for its result, and return its Command
+       - The output of the Command is the data written to the descriptor'''
+    cmd = Command(name, function = function)
+    self.pending.append(cmd)
+    self.startPending()
+    return cmd
+
+  def startPending(self):
+    while self.pending and len(self.running) < self.jobs:
+      self.start(self.pending.pop(0))
+    return
+
+  def closeDescriptors(self):
+    import popen2
+
+    if hasattr(os, 'closerange'):
+      os.closerange(3, popen2.MAXFD)
+    else:
+      for fd in xrange(3, popen2.MAXFD):
+        try:
+          os.close(fd)
+        except OSError:
+          pass
+    return
+
+  def runChild(self, cmd, outputWrite, errorWrite):
+    '''Execute the command in the child process, never returning'''
+    try:
+      try:
+        os.setpgid(0, 0)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(outputWrite, 1)
+        os.dup2(errorWrite, 2)
+        if not cmd.cwd is None:
+          os.chdir(cmd.cwd)
+        self.closeDescriptors()
+        if not cmd.argv is None:
+          try:
+            os.execvp(cmd.argv[0], cmd.argv)
+          except OSError:
+            # The shell gives the usual message and status for a program which cannot be run
+            pass
+        os.execv('/bin/sh', ['/bin/sh', '-c', cmd.command])
+      except Exception, e:
+        os.write(2, 'Could not execute '+cmd.command+': '+str(e)+'\n')
+    finally:
+      os._exit(127)
+    return
+
+  def runFunction(self, cmd, resultWrite):
+    '''Call the function in the child process, never returning'''
+    import signal
+
+    status = 1
+    try:
+      try:
+        os.setpgid(0, 0)
+        # Commands running in the parent belong to the parent
+        CommandEngine.defaultEngine = None
+        def terminate(signum, frame):
+          if not CommandEngine.defaultEngine is None:
+            CommandEngine.defaultEngine.killAll()
+          os._exit(1)
+        signal.signal(signal.SIGTERM, terminate)
+        cmd.function(resultWrite)
+        status = 0
+      except:
+        import traceback
+        traceback.print_exc()
+    finally:
+      os._exit(status)
+    return
+
+  def start(self, cmd):
+    '''Fork the process for a command'''
+    if cmd.function is None:
+      outputRead, outputWrite = os.pipe()
+      errorRead,  errorWrite  = os.pipe()
+      pid = os.fork()
+      if pid == 0:
+        os.close(outputRead)
+        os.close(errorRead)
+        self.runChild(cmd, outputWrite, errorWrite)
+      os.close(outputWrite)
+      os.close(errorWrite)
+      cmd.streams = {outputRead: 'output', errorRead: 'error'}
+    else:
+      sys.stdout.flush()
+      sys.stderr.flush()
+      resultRead, resultWrite = os.pipe()
+      pid = os.fork()
+      if pid == 0:
+        os.close(resultRead)
+        self.runFunction(cmd, resultWrite)
+      os.close(resultWrite)
+      cmd.streams = {resultRead: 'output'}
+    try:
+      # Also set in the parent, so that the group exists before any kill
+      os.setpgid(pid, pid)
+    except OSError:
+      pass
+    cmd.pid     = pid
+    cmd.started = time.time()
+    if not cmd.timeout is None:
+      cmd.deadline = cmd.started+cmd.timeout
+    for fd in cmd.streams:
+      self.fds[fd] = cmd
+    self.running.append(cmd)
+    return
+
+  def closeStreams(self, cmd):
+    for fd in cmd.streams:
+      if fd in self.fds:
+        del self.fds[fd]
+        os.close(fd)
+    cmd.streams = {}
+    return
+
+  def reap(self, cmd, status = None):
+    '''Wait for the process of a command, and record its status unless one is given'''
+    self.closeStreams(cmd)
+    try:
+      if hasattr(os, 'wait4'):
+        (pid, exitStatus, rusage) = os.wait4(cmd.pid, 0)
+        cmd.usage = ResourceUsage.getUsage(rusage)
+      else:
+        (pid, exitStatus) = os.waitpid(cmd.pid, 0)
+    except OSError:
+      exitStatus = -1
+    if status is None:
+      status = exitStatus
+    cmd.finish(status)
+    if cmd in self.running:
+      self.running.remove(cmd)
+    return
+
+  def kill(self, cmd, status = -1):
+    '''Stop a command and its process group, or remove it from the queue if it has not started'''
+    import signal
+
+    if cmd.isDone():
+      return
+    if cmd in self.pending:
+      self.pending.remove(cmd)
+      cmd.finish(status)
+      return
+    try:
+      if cmd.function is None:
+        os.killpg(cmd.pid, signal.SIGKILL)
+      else:
+        # A worker kills its own commands before it exits
+        os.kill(cmd.pid, signal.SIGTERM)
+    except OSError:
+      pass
+    self.reap(cmd, status)
+    return
+
+  def killAll(self):
+    '''Stop every running and queued command'''
+    for cmd in self.pending[:]+self.running[:]:
+      self.kill(cmd)
+    return
+
+  def expire(self, now):
+    '''Kill the commands which have passed their deadline'''
+    for cmd in self.running[:]:
+      if not cmd.deadline is None and now >= cmd.deadline:
+        self.kill(cmd)
+        cmd.output   = ''
+        cmd.error    = 'Runaway process exceeded time limit of '+str(cmd.timeout)+'s\n'
+        cmd.timedOut = 1
+    return
+
+  def step(self):
+    '''Wait until some output arrives or a deadline passes, and handle it'''
+    import errno
+    import select
+
+    self.startPending()
+    if not self.running:
+      return
+    now       = time.time()
+    deadlines = [cmd.deadline for cmd in self.running if not cmd.deadline is None]
+    timeout   = None
+    if deadlines:
+      timeout = max(0, min(deadlines)-now)
+    try:
+      ready = select.select(self.fds.keys(), [], [], timeout)[0]
+    except select.error, e:
+      if e[0] == errno.EINTR:
+        return
+      raise
+    for fd in ready:
+      # Killing a command on its abort text closes all its streams, which may still be in ready
+      if not fd in self.fds:
+        continue
+      cmd  = self.fds[fd]
+      data = os.read(fd, 65536)
+      if data:
+        if cmd.addOutput(cmd.streams[fd], data):
+          self.kill(cmd, status = None)
+          cmd.aborted = 1
+        continue
+      del self.fds[fd]
+      del cmd.streams[fd]
+      os.close(fd)
+      if not cmd.streams:
+        self.reap(cmd)
+    self.expire(time.time())
+    self.startPending()
+    return
+
+  def wait(self, commands):
+    '''Run until at least one of the commands has finished, and return the finished ones
+       - If an exception interrupts the wait, every command is killed'''
+    try:
+      while 1:
+        done = [cmd for cmd in commands if cmd.isDone()]
+        if done or not commands:
+          return done
+        self.step()
+    except:
+      self.killAll()
+      raise
+    return
+
+  def waitAll(self, commands):
+    '''Run until all the commands have finished'''
+    remaining = list(commands)
+    while remaining:
+      for cmd in self.wait(remaining):
+        remaining.remove(cmd)
+    return
+
+  def run(self, command, argv = None, cwd = None, timeout = None, abortText = None, headLines = None, tailLines = None, tee = None):
+    '''Run a single command, returning its Command once it has finished'''
+    cmd = self.submit(command, argv, cwd, timeout, abortText, headLines, tailLines, tee)
+    self.waitAll([cmd])
+    return cmd
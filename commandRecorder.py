@@ -0,0 +1,266 @@
+'''
+  The CommandRecorder records every command run by executeShellCommand(), and answers the same
+commands from the recording without running them. A recorded configure can then be replayed on a
+machine without the compilers, to measure and test the framework itself, and it takes the same path
+through the configure modules each time.
+
+  An entry is addressed by a hash of
+    - The command line and working directory, with the registered directories, such as the
+      configure temporary directory, replaced by placeholders, and the include flags for those
+      directories sorted
+    - The contents of each file on the command line inside a registered directory, such as a
+      source file, and of the headers in each such directory on the command line
+A file produced by an earlier command is identified by the key of that command rather than by its
+contents, since object files and executables record the name of the temporary directory. Programs
+and files outside the registered directories are not part of the key, so that a recording can be
+replayed on another machine.
+
+  Each entry holds the output, error, and status of the command, the files it wrote in the
+directories of the files on its command line, such as an object file and its dependency file, and, for reference, the identity of its inputs and the relevant environment. Entries
+are stored like those of the ProbeCache, one pickle per key, and the environment of the recording is
+stored once beside them. A command missing from the recording is an error when replaying, which
+names the variables whose values differ from the recording.
+
+  Only commands are recorded. Lookups which configure makes itself, such as os.path.isfile() or
+os.access() on a compiler or package directory, are answered by the machine replaying, so a replay
+only follows the recorded path through the modules on a machine with the same files and environment.
+Where they differ, configure runs a command that was not recorded, and the replay fails there.
+'''
+import os
+import cPickle
+
+try:
+  from hashlib import md5 as new_md5
+except ImportError:
+  from md5 import new as new_md5
+
+class CommandRecorder(object):
+  version     = '1'
+  environment = ['PATH', 'LD_LIBRARY_PATH', 'LIBRARY_PATH', 'CPATH', 'CC', 'CFLAGS', 'LANG', 'LC_ALL']
+  # The recorder used by executeShellCommand(), or None
+  defaultRecorder = None
+
+  def __init__(self, directory, mode = 'record'):
+    self.directory   = directory
+    self.mode        = mode
+    # Pairs (directory, placeholder), the most recently registered first
+    self.directories = []
+    # Map from a file written by a command to (key, size and modification time)
+    self.producers   = {}
+    self.recorded    = 0
+    self.replayed    = 0
+    self.envSaved    = 0
+    return
+
+  def __str__(self):
+    if self.isReplaying():
+      return 'Replayed '+str(self.replayed)+' commands from '+self.directory
+    return 'Recorded '+str(self.recorded)+' commands in '+self.directory
+
+  def isRecording(self):
+    return self.mode == 'record'
+
+  def isReplaying(self):
+    return self.mode == 'replay'
+
+  def addDirectory(self, directory):
+    '''Register a directory whose name differs between runs, such as the configure temporary directory'''
+    directory = os.path.join(directory, '')[:-1]
+    if not [d for d, placeholder in self.directories if d == directory]:
+      self.directories.insert(0, (directory, '@RECORD_DIR'+str(len(self.directories))+'@'))
+    return
+
+  def normalize(self, text):
+    for directory, placeholder in self.directories:
+      text = text.replace(directory, placeholder)
+    return text
+
+  def denormalize(self, text):
+    for directory, placeholder in self.directories:
+      text = text.replace(placeholder, directory)
+    return text
+
+  def normalizeCommand(self, command):
+    '''Replace the registered directories by placeholders, and sort the include flags for those directories
+       - As for the ProbeCache, these come from an unordered set, and only select the directory holding confdefs.h'''
+    tokens   = self.normalize(command).split()
+    includes = [token for token in tokens if token.startswith('-I@RECORD_DIR')]
+    includes.sort()
+    includes.reverse()
+    for i, token in enumerate(tokens):
+      if token.startswith('-I@RECORD_DIR'):
+        tokens[i] = includes.pop()
+    return ' '.join(tokens)
+
+  def isRegistered(self, filename):
+    return len([d for d, placeholder in self.directories if filename == d or filename.startswith(d+os.sep)]) > 0
+
+  def getStat(self, filename):
+    try:
+      st = os.stat(filename)
+    except OSError:
+      return None
+    return (st.st_size, st.st_mtime)
+
+  def getPaths(self, command, cwd):
+    '''Return the paths inside registered directories on a command line, including those in -I, -L, and -o options'''
+    paths = []
+    for token in command.split():
+      for part in token.replace('=', ',').split(','):
+        part = part.strip('\'"')
+        if part[0:2] in ['-I', '-L', '-o']:
+          part = part[2:]
+        if not part or part.startswith('-'):
+          continue
+        if not os.path.isabs(part):
+          if not cwd or not os.path.exists(os.path.join(cwd, part)):
+            continue
+          part = os.path.join(cwd, part)
+        part = os.path.normpath(part)
+        if self.isRegistered(part) and not part in paths:
+          paths.append(part)
+    return paths
+
+  def getDirectoryStat(self, directory):
+    '''Return a map from each file in the directory to its stat'''
+    stats = {}
+    if os.path.isdir(directory):
+      for name in os.listdir(directory):
+        stats[name] = self.getStat(os.path.join(directory, name))
+    return stats
+
+  def getFileIdentity(self, filename):
+    '''A file is identified by the command which wrote it, or by its contents, and a directory by its headers'''
+    name = self.normalize(filename)
+    if filename in self.producers:
+      key, stat = self.producers[filename]
+      if stat == self.getStat(filename):
+        return name+'=command:'+key
+    if os.path.isfile(filename):
+      f = file(filename, 'rb')
+      digest = new_md5(self.normalize(f.read())).hexdigest()
+      f.close()
+      return name+'=md5:'+digest
+    if os.path.isdir(filename):
+      headers = [header for header in os.listdir(filename) if header.endswith('.h')]
+      headers.sort()
+      return name+'=dir:'+','.join([self.getFileIdentity(os.path.join(filename, header)) for header in headers])
+    return name+'=missing'
+
+  def getKey(self, command, cwd = None):
+    '''Return (key, inputs, stats) for a command about to run, where stats are those of the files in the directories it may write, used to find the files it writes'''
+    paths  = self.getPaths(command, cwd)
+    inputs = [self.getFileIdentity(filename) for filename in paths]
+    inputs.sort()
+    parts  = [self.version, self.normalizeCommand(command), self.normalize(str(cwd))]+inputs
+    dirs   = dict([(os.path.dirname(filename), 1) for filename in paths if not os.path.isdir(filename)]).keys()
+    return (new_md5('\0'.join(parts)).hexdigest(), inputs, [(directory, self.getDirectoryStat(directory)) for directory in dirs])
+
+  def getEntryName(self, key):
+    return os.path.join(self.directory, key[0:2], key)
+
+  def getEnvironment(self):
+    return dict([(var, os.environ.get(var, '')) for var in self.environment])
+
+  def getEnvironmentName(self):
+    return os.path.join(self.directory, 'environment')
+
+  def saveEnvironment(self):
+    '''Store the environment of the recording once, so that a failed replay can name what differs'''
+    import tempfile
+
+    if self.envSaved:
+      return
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError:
+        # A parallel worker may have created it
+        if not os.path.isdir(self.directory): raise
+    fd, tmpName = tempfile.mkstemp(prefix = '.environment', dir = self.directory)
+    f = os.fdopen(fd, 'wb')
+    cPickle.dump(self.getEnvironment(), f, 2)
+    f.close()
+    os.rename(tmpName, self.getEnvironmentName())
+    self.envSaved = 1
+    return
+
+  def loadEnvironment(self):
+    '''Return the environment of the recording, and raise RuntimeError if the directory holds no recording'''
+    try:
+      f = file(self.getEnvironmentName(), 'rb')
+      environment = cPickle.load(f)
+      f.close()
+    except (IOError, OSError, EOFError, cPickle.UnpicklingError, ValueError):
+      raise RuntimeError('No recording made with -record found in '+self.directory)
+    return environment
+
+  def getChangedEnvironment(self):
+    '''Return a description of each variable whose value differs from the recording'''
+    try:
+      recorded = self.loadEnvironment()
+    except RuntimeError:
+      return []
+    current = self.getEnvironment()
+    return [var+' was '+repr(recorded.get(var, ''))+' and is '+repr(current[var]) for var in self.environment if not recorded.get(var, '') == current[var]]
+
+  def record(self, cmd, key, inputs, stats):
+    '''Store a finished command, along with the files it wrote, given the stats from getKey()'''
+    import tempfile
+
+    artifacts = []
+    for directory, before in stats:
+      for name, stat in self.getDirectoryStat(directory).items():
+        filename = os.path.join(directory, name)
+        if os.path.isfile(filename) and not before.get(name) == stat:
+          f = file(filename, 'rb')
+          artifacts.append((self.normalize(filename), f.read(), os.stat(filename).st_mode & 0777))
+          f.close()
+          self.producers[filename] = (key, stat)
+    self.saveEnvironment()
+    entry = {'command': self.normalize(cmd.command), 'cwd': self.normalize(str(cmd.cwd)), 'inputs': inputs,
+             'environment': self.getEnvironment(),
+             'output': self.normalize(cmd.output), 'error': self.normalize(cmd.error), 'status': cmd.status, 'artifacts': artifacts}
+    name  = self.getEntryName(key)
+    if not os.path.isdir(os.path.dirname(name)):
+      try:
+        os.makedirs(os.path.dirname(name))
+      except OSError:
+        # A parallel worker may have created it
+        if not os.path.isdir(os.path.dirname(name)): raise
+    fd, tmpName = tempfile.mkstemp(prefix = '.'+key, dir = os.path.dirname(name))
+    f = os.fdopen(fd, 'wb')
+    cPickle.dump(entry, f, 2)
+    f.close()
+    os.rename(tmpName, name)
+    self.recorded += 1
+    return
+
+  def replay(self, cmd):
+    '''Answer a command from the recording, writing the files it wrote, and raise RuntimeError if it was not recorded
+       - The error names the variables which differ from the recording, since the files and programs configure looks up itself are not replayed'''
+    (key, inputs, stats) = self.getKey(cmd.command, cmd.cwd)
+    try:
+      f = file(self.getEntryName(key), 'rb')
+      entry = cPickle.load(f)
+      f.close()
+    except (IOError, OSError, EOFError, cPickle.UnpicklingError, ValueError):
+      msg = 'Command not found in the recording '+self.directory+':\n'+cmd.command+'\nwith inputs:\n'+'\n'.join(inputs)
+      changed = self.getChangedEnvironment()
+      if changed:
+        msg += '\nThe environment differs from the recording:\n'+'\n'.join(changed)
+      msg += '\nOnly commands are replayed, and files found by configure itself must be the same as when recording'
+      raise RuntimeError(msg)
+    for name, data, mode in entry['artifacts']:
+      filename = self.denormalize(name)
+      if os.path.isfile(filename): os.remove(filename)
+      f = file(filename, 'wb')
+      f.write(data)
+      f.close()
+      os.chmod(filename, mode)
+      self.producers[filename] = (key, self.getStat(filename))
+    cmd.addOutput('output', self.denormalize(entry['output']))
+    cmd.addOutput('error', self.denormalize(entry['error']))
+    cmd.finish(entry['status'])
+    self.replayed += 1
+    return
@@ -14,6 +14,13 @@ class Configure(config.base.Configure):
     self.libraries    = framework.require('config.libraries', self)
     return
 
+  def hasGNUAsm(self, architectures):
+    '''Return True if the predefined macros show GCC or Clang, with the asm keyword, targeting one of the architectures'''
+    macros = self.getPredefinedMacros()
+    if not self.isGNUCompatible() or '__STRICT_ANSI__' in macros:
+      return 0
+    return len([arch for arch in architectures if arch in macros]) > 0
+
   def configureCPURelax(self):
     ''' Definitions for cpu relax assembly instructions '''
     # Definition for cpu_relax()
@@ -22,7 +29,7 @@ class Configure(config.base.Configure):
     # twin processor; it also happens to serve as a compiler barrier
 
     # x86
-    if self.checkCompile('', 'asm volatile("rep; nop" ::: "memory");'):
+    if self.hasGNUAsm(['__x86_64__', '__i386__']) or self.checkCompile('', 'asm volatile("rep; nop" ::: "memory");'):
       self.addDefine('CPU_RELAX()','asm volatile("rep; nop" ::: "memory")')
       return
     # PowerPC
@@ -36,14 +43,16 @@ class Configure(config.base.Configure):
   def configureMemoryBarriers(self):
     ''' Definitions for memory barrier instructions'''
     # ---- Definitions for x86_64 -----
+    # These instructions come with SSE2, which every x86_64 has
+    sse2 = self.hasGNUAsm(['__x86_64__', '__SSE2__'])
     # General Memory Barrier
-    if self.checkCompile('','asm volatile("mfence":::"memory")'):
+    if sse2 or self.checkCompile('','asm volatile("mfence":::"memory")'):
       self.addDefine('MEMORY_BARRIER()','asm volatile("mfence":::"memory")')
     # Read Memory Barrier
-    if self.checkCompile('','asm volatile("lfence":::"memory")'):
+    if sse2 or self.checkCompile('','asm volatile("lfence":::"memory")'):
       self.addDefine('READ_MEMORY_BARRIER()','asm volatile("lfence":::"memory")')
     # Write Memory Barrier
-    if self.checkCompile('','asm volatile("sfence":::"memory")'):
+    if sse2 or self.checkCompile('','asm volatile("sfence":::"memory")'):
       self.addDefine('WRITE_MEMORY_BARRIER()','asm volatile("sfence":::"memory")')
     return
 
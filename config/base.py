@@ -27,9 +27,23 @@ return a success or failure indication based upon the status and output.
 
   outputPreprocess(), checkPreprocess(), preprocess()
   outputCompile(),    checkCompile()
-  outputLink(),       checkLink()
+  outputLink(),       checkLink(), checkLinkBatch()
   outputRun(),        checkRun()
 
+  Each of these runs its command through executeProbe(), which consults the persistent probe cache
+when it is enabled with --probe-cache. The headers confdefs.h and conffix.h which each probe includes
+are kept in the temporary directory, and the Framework rewrites them only when a define, typedef, or
+prototype has changed. Every compile or preprocess starts a new probe in its own scratch directory,
+given by getProbeDir(), which also holds the linked executable. These directories are removed along
+with the temporary directory at the end of configure, except for those of failing probes when
+--keep-probe-files is given.
+
+  Checks which the compiler answers through its predefined macros, such as the sizes of the basic
+types or the byte order, first consult the macro table for the current language, and run a probe only
+when the macro is absent.
+
+  getPredefinedMacros(), getPredefinedMacro(), getPredefinedInteger(), isGNUCompatible()
+
   The language used for these operation is managed with a stack, similar to autoconf.
 
   pushLanguage(), popLanguage()
@@ -57,6 +71,7 @@ can be defined which applies to every substitution from the object. Typedefs and
 function prototypes are placed in a separate header in order to accomodate languges
 such as Fortran whose preprocessor can sometimes fail at these statements.
 '''
+import profiler
 import script
 
 import os
@@ -89,6 +104,8 @@ class Configure(script.Script):
       self.logPrint('All intermediate test results are stored in '+self._tmpDir)
     return self._tmpDir
   def setTmpDir(self, temp):
+    if hasattr(self, 'probeDir'):
+      del self.probeDir
     if hasattr(self, '_tmpDir'):
       if os.path.isdir(self._tmpDir):
         import shutil
@@ -110,10 +127,25 @@ class Configure(script.Script):
     self.logWrite('TEST '+str(test.im_func.func_name)+' from '+str(test.im_class.__module__)+'('+str(test.im_func.func_code.co_filename)+':'+str(test.im_func.func_code.co_firstlineno)+')\n')
     self.logPrint('TESTING: '+str(test.im_func.func_name)+' from '+str(test.im_class.__module__)+'('+str(test.im_func.func_code.co_filename)+':'+str(test.im_func.func_code.co_firstlineno)+')', debugSection = 'screen', indent = 0)
     if test.__doc__: self.logWrite('  '+test.__doc__+'\n')
-    #t = time.time()
     if not isinstance(args, list): args = [args]
-    ret = apply(test, args,kargs)
-    #self.logPrint('  TIME: '+str(time.time() - t)+' sec', debugSection = 'screen', indent = 0)
+    event = {'module': test.im_class.__module__, 'function': test.im_func.func_name, 'location': test.im_func.func_code.co_filename+':'+str(test.im_func.func_code.co_firstlineno)}
+    self.logEvent('test-start', **event)
+    start   = time.time()
+    profile = profiler.Profiler.defaultProfiler
+    if not profile is None:
+      profile.enter('test', event['module']+'.'+event['function'])
+    self.logPushIndent()
+    try:
+      try:
+        ret = apply(test, args,kargs)
+      except:
+        self.logEvent('test-end', duration = time.time() - start, status = 'error', **event)
+        raise
+    finally:
+      self.logPopIndent()
+      if not profile is None:
+        profile.leave()
+    self.logEvent('test-end', duration = time.time() - start, status = 'ok', **event)
     return ret
 
   #################################
@@ -128,6 +160,7 @@ class Configure(script.Script):
   def addMakeMacro(self, name, value):
     '''Designate that "name" should be defined to "value" in the makefile header (bmake file)'''
     self.framework.logPrint('Defined make macro "'+name+'" to "'+str(value)+'"')
+    self.logEvent('make-macro', module = self.__module__, name = name, value = str(value))
     self.makeMacros[name] = value
     return
 
@@ -143,19 +176,26 @@ class Configure(script.Script):
   def addDefine(self, name, value):
     '''Designate that "name" should be defined to "value" in the configuration header'''
     self.framework.logPrint('Defined "'+name+'" to "'+str(value)+'"')
+    self.logEvent('define', module = self.__module__, name = name, value = str(value))
+    oldValue = self.defines.get(name)
     self.defines[name] = value
+    self.framework.getHeaderRendering().addDefine(self, name, oldValue)
     return
 
   def delDefine(self, name):
     '''Designate that "name" should be deleted (never put in)  configuration header'''
     self.framework.logPrint('Deleting "'+name+'"')
-    if name in self.defines: del self.defines[name]
+    if name in self.defines:
+      oldValue = self.defines[name]
+      del self.defines[name]
+      self.framework.getHeaderRendering().delDefine(self, name, oldValue)
     return
 
   def addTypedef(self, name, value):
     '''Designate that "name" should be typedefed to "value" in the configuration header'''
     self.framework.logPrint('Typedefed "'+name+'" to "'+str(value)+'"')
     self.typedefs[value] = name
+    self.framework.getHeaderRendering().changeFixes()
     return
 
   def addPrototype(self, prototype, language = 'All'):
@@ -167,17 +207,20 @@ class Configure(script.Script):
     if not language in self.prototypes:
       self.prototypes[language] = []
     self.prototypes[language].append(prototype)
+    self.framework.getHeaderRendering().changeFixes()
     return
 
   def addSubstitution(self, name, value):
     '''Designate that "@name@" should be replaced by "value" in all files which experience substitution'''
     self.framework.logPrint('Substituting "'+name+'" with "'+str(value)+'"')
+    self.logEvent('substitution', module = self.__module__, name = name, value = str(value))
     self.subst[name] = value
     return
 
   def addArgumentSubstitution(self, name, arg):
     '''Designate that "@name@" should be replaced by "arg" in all files which experience substitution'''
     self.framework.logPrint('Substituting "'+name+'" with '+str(arg)+'('+str(self.framework.argDB[arg])+')')
+    self.logEvent('substitution', module = self.__module__, name = name, argument = arg)
     self.argSubst[name] = arg
     return
 
@@ -284,6 +327,24 @@ class Configure(script.Script):
     self.language.pop()
     return self.language[-1]
 
+  def getProbeDir(self):
+    '''Return the scratch directory of the current probe, or the temporary directory before any probe'''
+    if hasattr(self, 'probeDir'):
+      return self.probeDir
+    return self.tmpDir
+
+  def newProbeDir(self):
+    '''Give the next probe its own scratch directory, so that its files cannot collide with those of another probe'''
+    self.probeDir = self.framework.createProbeDir(self.tmpDir)
+    return self.probeDir
+
+  def getHeaderInclude(self, header):
+    '''Return the name which includes a probe header from the scratch directory of the probe
+       - The relative name finds our header before those of other children, which are also on the include path'''
+    if self.getProbeDir() == self.tmpDir:
+      return os.path.basename(header)
+    return '../'+os.path.basename(header)
+
   def getHeaders(self):
     self.compilerDefines = os.path.join(self.tmpDir, 'confdefs.h')
     self.compilerFixes   = os.path.join(self.tmpDir, 'conffix.h')
@@ -299,8 +360,8 @@ class Configure(script.Script):
     self.getHeaders()
     compiler            = self.framework.getCompilerObject(self.language[-1])
     compiler.checkSetup()
-    self.compilerSource = os.path.join(self.tmpDir, 'conftest'+compiler.sourceExtension)
-    self.compilerObj    = os.path.join(self.tmpDir, compiler.getTarget(self.compilerSource))
+    self.compilerSource = os.path.join(self.getProbeDir(), 'conftest'+compiler.sourceExtension)
+    self.compilerObj    = os.path.join(self.getProbeDir(), compiler.getTarget(self.compilerSource))
     return compiler.getProcessor()
 
   def getCompilerFlags(self):
@@ -310,7 +371,7 @@ class Configure(script.Script):
     self.getHeaders()
     linker            = self.framework.getLinkerObject(self.language[-1])
     linker.checkSetup()
-    self.linkerSource = os.path.join(self.tmpDir, 'conftest'+linker.sourceExtension)
+    self.linkerSource = os.path.join(self.getProbeDir(), 'conftest'+linker.sourceExtension)
     self.linkerObj    = linker.getTarget(self.linkerSource, 0)
     return linker.getProcessor()
 
@@ -321,7 +382,7 @@ class Configure(script.Script):
     self.getHeaders()
     linker            = self.framework.getSharedLinkerObject(self.language[-1])
     linker.checkSetup()
-    self.linkerSource = os.path.join(self.tmpDir, 'conftest'+linker.sourceExtension)
+    self.linkerSource = os.path.join(self.getProbeDir(), 'conftest'+linker.sourceExtension)
     self.linkerObj    = linker.getTarget(self.linkerSource, 1)
     return linker.getProcessor()
 
@@ -332,7 +393,7 @@ class Configure(script.Script):
     self.getHeaders()
     linker            = self.framework.getDynamicLinkerObject(self.language[-1])
     linker.checkSetup()
-    self.linkerSource = os.path.join(self.tmpDir, 'conftest'+linker.sourceExtension)
+    self.linkerSource = os.path.join(self.getProbeDir(), 'conftest'+linker.sourceExtension)
     self.linkerObj    = linker.getTarget(self.linkerSource, 1)
     return linker.getProcessor()
 
@@ -383,8 +444,8 @@ class Configure(script.Script):
       includes += '\n'
     if language in ['C', 'CUDA', 'Cxx']:
       codeStr = ''
-      if self.compilerDefines: codeStr = '#include "'+os.path.basename(self.compilerDefines)+'"\n'
-      codeStr += '#include "conffix.h"\n'+includes
+      if self.compilerDefines: codeStr = '#include "'+self.getHeaderInclude(self.compilerDefines)+'"\n'
+      codeStr += '#include "'+self.getHeaderInclude('conffix.h')+'"\n'+includes
       if not body is None:
         if codeBegin is None:
           codeBegin = '\nint main() {\n'
@@ -406,6 +467,47 @@ class Configure(script.Script):
       raise RuntimeError('Cannot determine code body for language: '+language)
     return codeStr
 
+  def executeProbe(self, command, checkCommand = None, inputs = [], outputs = [], timeout = 600.0, lineLimit = 0, kind = None):
+    '''Execute a probe command, consulting the probe cache if it is enabled
+       - The inputs are files read by the command which do not appear on the command line
+       - The outputs are files produced by the command, which are restored on a cache hit
+       - The kind, such as compile or link, names the probe when profiling
+       - This returns a tuple of the (output, error, statuscode)'''
+    profile = profiler.Profiler.defaultProfiler
+    if profile is None or kind is None:
+      return self.executeProbeCached(command, checkCommand, inputs, outputs, timeout, lineLimit)
+    profile.enter('probe', kind)
+    try:
+      return self.executeProbeCached(command, checkCommand, inputs, outputs, timeout, lineLimit)
+    finally:
+      profile.leave()
+
+  def executeProbeCached(self, command, checkCommand, inputs, outputs, timeout, lineLimit):
+    cache = self.framework.getProbeCache()
+    if cache is None:
+      (output, error, status) = Configure.executeShellCommand(command, checkCommand = checkCommand, timeout = timeout, log = self.framework.log, lineLimit = lineLimit)
+      if status: self.framework.addFailedProbeDir(self.getProbeDir())
+      return (output, error, status)
+    tmpDir    = self.framework.tmpDir
+    workspace = self.getProbeDir()
+    key       = cache.getKey(command, inputs, outputs, tmpDir, workspace)
+    result    = cache.get(key, outputs, tmpDir, workspace)
+    self.logEvent('probe-cache', key = key, hit = not result is None)
+    if result is None:
+      (output, error, status) = Configure.executeShellCommand(command, checkCommand = checkCommand, timeout = timeout, log = self.framework.log, lineLimit = lineLimit)
+      if not (status == -1 and error.startswith('Runaway process')):
+        cache.put(key, output, error, status, outputs, tmpDir, workspace)
+    else:
+      (output, error, status) = result
+      if not checkCommand:
+        checkCommand = Configure.defaultCheckCommand
+      self.framework.log.write('sh: '+command+'\n')
+      self.framework.log.write('Cached probe '+key+'\n')
+      self.framework.log.write('sh: '+output+'\n')
+      checkCommand(command, status, output, error)
+    if status: self.framework.addFailedProbeDir(workspace)
+    return (output, error, status)
+
   def preprocess(self, codeStr, timeout = 600.0):
     def report(command, status, output, error):
       if error or status:
@@ -415,16 +517,14 @@ class Configure(script.Script):
         self.framework.log.write('Source:\n'+self.getCode(codeStr))
       return
 
+    self.newProbeDir()
     command = self.getPreprocessorCmd()
-    if self.compilerDefines: self.framework.outputHeader(self.compilerDefines)
-    self.framework.outputCHeader(self.compilerFixes)
+    if self.compilerDefines: self.framework.outputProbeHeader(self.compilerDefines)
+    self.framework.outputProbeCHeader(self.compilerFixes)
     f = file(self.compilerSource, 'w')
     f.write(self.getCode(codeStr))
     f.close()
-    (out, err, ret) = Configure.executeShellCommand(command, checkCommand = report, timeout = timeout, log = self.framework.log, lineLimit = 1000)
-    if self.cleanup:
-      for filename in [self.compilerDefines, self.compilerFixes, self.compilerSource]:
-        if os.path.isfile(filename): os.remove(filename)
+    (out, err, ret) = self.executeProbe(command, checkCommand = report, inputs = [self.compilerDefines, self.compilerFixes], timeout = timeout, lineLimit = 1000, kind = 'preprocess')
     return (out, err, ret)
 
   def outputPreprocess(self, codeStr):
@@ -470,19 +570,17 @@ class Configure(script.Script):
         self.framework.log.write('Source:\n'+self.getCode(includes, body, codeBegin, codeEnd))
       return
 
-    cleanup = cleanup and self.framework.doCleanup
+    self.newProbeDir()
     command = self.getCompilerCmd()
-    if self.compilerDefines: self.framework.outputHeader(self.compilerDefines)
-    self.framework.outputCHeader(self.compilerFixes)
+    if self.compilerDefines: self.framework.outputProbeHeader(self.compilerDefines)
+    self.framework.outputProbeCHeader(self.compilerFixes)
     f = file(self.compilerSource, 'w')
     f.write(self.getCode(includes, body, codeBegin, codeEnd))
     f.close()
-    (out, err, ret) = Configure.executeShellCommand(command, checkCommand = report, log = self.framework.log)
+    (out, err, ret) = self.executeProbe(command, checkCommand = report, inputs = [self.compilerDefines, self.compilerFixes], outputs = [self.compilerObj], kind = 'compile')
     if not os.path.isfile(self.compilerObj):
       err += '\nPETSc Error: No output file produced'
-    if cleanup:
-      for filename in [self.compilerDefines, self.compilerFixes, self.compilerSource, self.compilerObj]:
-        if os.path.isfile(filename): os.remove(filename)
+      self.framework.addFailedProbeDir(self.getProbeDir())
     return (out, err, ret)
 
   def checkCompile(self, includes = '', body = '', cleanup = 1, codeBegin = None, codeEnd = None):
@@ -525,7 +623,6 @@ class Configure(script.Script):
       self.linkerObj = ''
       return (out, ret)
 
-    cleanup = cleanup and self.framework.doCleanup
     if shared == 'dynamic':
       cmd = self.getDynamicLinkerCmd()
     elif shared:
@@ -542,13 +639,8 @@ class Configure(script.Script):
         self.framework.log.write(' in '+self.getLinkerCmd()+'\n')
         self.framework.log.write('Source:\n'+self.getCode(includes, body, codeBegin, codeEnd))
       return
-    (out, err, ret) = Configure.executeShellCommand(cmd, checkCommand = report, log = self.framework.log)
+    (out, err, ret) = self.executeProbe(cmd, checkCommand = report, outputs = [self.linkerObj], kind = 'link')
     self.linkerObj = linkerObj
-    if os.path.isfile(self.compilerObj): os.remove(self.compilerObj)
-    if cleanup:
-      if os.path.isfile(self.linkerObj):os.remove(self.linkerObj)
-      pdbfile = os.path.splitext(self.linkerObj)[0]+'.pdb'
-      if os.path.isfile(pdbfile): os.remove(pdbfile)
     return (out+err, ret)
 
   def checkLink(self, includes = '', body = '', cleanup = 1, codeBegin = None, codeEnd = None, shared = 0):
@@ -556,6 +648,37 @@ class Configure(script.Script):
     output = self.filterLinkOutput(output)
     return not (returnCode or len(output))
 
+  def getBatchCode(self, probes):
+    '''Combine several (includes, body) pairs into a single pair
+       - Identical includes appear once, and each body is placed in its own block
+       - A single probe is returned unchanged'''
+    if len(probes) == 1:
+      return probes[0]
+    includes = []
+    for inc, body in probes:
+      if inc and not inc[-1] == '\n':
+        inc += '\n'
+      if not inc in includes:
+        includes.append(inc)
+    return (''.join(includes), ''.join(['{\n'+body+';\n}\n' for inc, body in probes]))
+
+  def checkLinkBatch(self, probes, cleanup = 1, codeBegin = None, codeEnd = None, shared = 0):
+    '''Return a list of flags indicating which of the (includes, body) probes link, using as few links as possible
+       - All probes are linked together, and on failure the set is bisected to isolate the failures
+       - Fortran probes are linked one at a time'''
+    if not probes:
+      return []
+    if self.language[-1] == 'FC':
+      return [self.checkLink(includes, body, cleanup, codeBegin, codeEnd, shared) for includes, body in probes]
+    (includes, body) = self.getBatchCode(probes)
+    if self.checkLink(includes, body, cleanup, codeBegin, codeEnd, shared):
+      return [1]*len(probes)
+    if len(probes) == 1:
+      return [0]
+    self.framework.logPrint('Batch link of '+str(len(probes))+' probes failed, bisecting')
+    half = len(probes)/2
+    return self.checkLinkBatch(probes[:half], cleanup, codeBegin, codeEnd, shared)+self.checkLinkBatch(probes[half:], cleanup, codeBegin, codeEnd, shared)
+
   # Should be static
   def getLinkerFlagsName(self, language):
     if language in ['C', 'CUDA', 'Cxx', 'FC']:
@@ -581,7 +704,6 @@ class Configure(script.Script):
           raise ConfigureSetupError('Must give a default value for '+defaultOutputArg+' since executables cannot be run')
       else:
         raise ConfigureSetupError('Running executables on this system is not supported')
-    cleanup = cleanup and self.framework.doCleanup
     if executor:
       command = executor+' '+self.linkerObj
     else:
@@ -591,26 +713,81 @@ class Configure(script.Script):
     status  = 1
     self.framework.log.write('Executing: '+command+'\n')
     try:
-      (output, error, status) = Configure.executeShellCommand(command, log = self.framework.log)
+      (output, error, status) = self.executeProbe(command, kind = 'run')
     except RuntimeError, e:
       self.framework.log.write('ERROR while running executable: '+str(e)+'\n')
-    if os.path.isfile(self.compilerObj):
-      try:
-        os.remove(self.compilerObj)
-      except RuntimeError, e:
-        self.framework.log.write('ERROR while removing object file: '+str(e)+'\n')
-    if cleanup and os.path.isfile(self.linkerObj):
-      try:
-        if os.path.exists('/usr/bin/cygcheck.exe'): time.sleep(1)
-        os.remove(self.linkerObj)
-      except RuntimeError, e:
-        self.framework.log.write('ERROR while removing executable file: '+str(e)+'\n')
     return (output+error, status)
 
   def checkRun(self, includes = '', body = '', cleanup = 1, defaultArg = '', executor = None):
     (output, returnCode) = self.outputRun(includes, body, cleanup, defaultArg, executor)
     return not returnCode
 
+  def getPredefinedMacros(self):
+    '''Return a dictionary of the macros predefined by the compiler for the current language, which is empty if it cannot list them
+       - The compiler is run with -dM -E once per toolchain and set of flags, and the result is shared by all children'''
+    import config.toolchain
+
+    language = self.language[-1]
+    if not language in ['C', 'Cxx'] or not self.framework.argDB['with-predefined-macros']:
+      return {}
+    compiler = self.getCompiler()
+    source   = os.path.join(self.tmpDir, 'conftest-macros'+os.path.splitext(self.compilerSource)[1])
+    args     = '-dM -E '+self.getCompilerFlags()+' '+source
+    key      = (compiler+' '+args).replace(self.tmpDir, '')
+    if not key in self.framework.predefinedMacros:
+      macros = {}
+      if not os.path.isfile(source):
+        file(source, 'w').close()
+      try:
+        (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, args, log = self.framework.log, directory = self.tmpDir)
+        for line in output.splitlines():
+          tokens = line.split(None, 2)
+          # Function-like macros are not used for answering checks
+          if len(tokens) < 2 or not tokens[0] == '#define' or tokens[1].find('(') >= 0: continue
+          if len(tokens) == 2:
+            macros[tokens[1]] = ''
+          else:
+            macros[tokens[1]] = tokens[2].strip()
+      except RuntimeError, e:
+        self.logPrint('Compiler cannot list its predefined macros: '+str(e))
+      self.framework.predefinedMacros[key] = macros
+    return self.framework.predefinedMacros[key]
+
+  def getPredefinedMacro(self, name):
+    '''Return the value of a macro predefined by the compiler for the current language, following macros defined as other macros, or None
+       - A macro which refers back to itself, such as one given by -D in the flags, has no value'''
+    macros = self.getPredefinedMacros()
+    value  = None
+    seen   = {}
+    while name in macros:
+      if name in seen:
+        return None
+      seen[name] = 1
+      value = macros[name]
+      name  = value
+    return value
+
+  def getPredefinedInteger(self, name):
+    '''Return the value of an integer macro predefined by the compiler for the current language, or None'''
+    value = self.getPredefinedMacro(name)
+    if value is None:
+      return None
+    try:
+      return int(value.rstrip('uUlL'), 0)
+    except ValueError:
+      return None
+
+  def isGNUCompatible(self):
+    '''Return True if the compiler for the current language is GCC or Clang targeting a Unix system, as shown by its predefined macros
+       - Other compilers defining __GNUC__ accept different extensions, so their checks still run probes'''
+    macros = self.getPredefinedMacros()
+    if not '__GNUC__' in macros:
+      return 0
+    for name in ['__INTEL_COMPILER', '__PGI', '__NVCOMPILER', '__ibmxl__', '__IBMC__', '__xlc__', '_CRAYC', '__SUNPRO_C', '_MSC_EXTENSIONS', '_WIN32', '__CYGWIN__']:
+      if name in macros:
+        return 0
+    return 1
+
   def splitLibs(self,libArgs):
     '''Takes a string containing a list of libraries (including potentially -L, -l, -w etc) and generates a list of libraries'''
     dirs = []
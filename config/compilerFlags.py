@@ -95,15 +95,16 @@ class Configure(config.base.Configure):
             flags = []
           else:
             flags = options.getCompilerFlags(language, self.setCompilers.getCompiler(), bopt)
+          testFlags = []
           for testFlag in flags:
             if isinstance(testFlag,tuple):
               testFlag = ' '.join(testFlag)
-            try:
-              self.framework.logPrint('Trying '+language+' compiler flag '+testFlag)
-              self.setCompilers.addCompilerFlag(testFlag)
-            except RuntimeError:
-              self.framework.logPrint('Rejected '+language+' compiler flag '+testFlag)
-              self.rejected[language].append(testFlag)
+            self.framework.logPrint('Trying '+language+' compiler flag '+testFlag)
+            testFlags.append(testFlag)
+          # The flags are tested together, and bisected only if the compiler rejects them
+          for testFlag in self.setCompilers.addCompilerFlags(testFlags):
+            self.framework.logPrint('Rejected '+language+' compiler flag '+testFlag)
+            self.rejected[language].append(testFlag)
       except RuntimeError:
         pass
       self.setCompilers.popLanguage()
@@ -1,4 +1,5 @@
 import config.base
+import config.toolchain
 import os
 import re
 
@@ -236,7 +237,10 @@ class CompilerOptions(config.base.Configure):
           flags = "lslpp -L xlfcmp | grep xlfcmp | awk '{print $2}'"
         else:
           flags = compiler+' --version'
-      (output, error, status) = config.base.Configure.executeShellCommand(flags, log = self.framework.log)
+      if flags == compiler+' --version':
+        (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--version', log = self.framework.log)
+      else:
+        (output, error, status) = config.base.Configure.executeShellCommand(flags, log = self.framework.log)
       if not status:
         if compiler.find('win32fe') > -1:
           version = '\\n'.join(output.split('\n')[0:2])
@@ -1,4 +1,5 @@
 import config.base
+import config.toolchain
 
 import re
 import os
@@ -131,6 +132,16 @@ class Configure(config.base.Configure):
     self.addDefine('CXX_STATIC_INLINE', self.cxxStaticInlineKeyword)
     return
 
+  def getPredefinedRestrict(self):
+    '''Return the restrict keyword implied by the predefined macros of the current language, or None
+       - C99 has restrict, and GCC and Clang have __restrict__ in every other case'''
+    version = self.getPredefinedInteger('__STDC_VERSION__')
+    if self.language[-1] == 'C' and not version is None and version >= 199901:
+      return 'restrict'
+    if self.isGNUCompatible():
+      return ' __restrict__'
+    return None
+
   def checkRestrict(self,language):
     '''Check for the C/CXX restrict keyword'''
     self.pushLanguage(language)
@@ -139,8 +150,13 @@ class Configure(config.base.Configure):
     # restrict (it's a bit stronger, in that __restrict pointers can't
     # overlap even with non __restrict pointers), but I think it should be
     # okay under the circumstances where restrict is normally used.
-    for kw in ['restrict', ' __restrict__', '__restrict']:
-      if self.checkCompile('', 'float * '+kw+' x;'):
+    predefined = self.getPredefinedRestrict()
+    if predefined is None:
+      keywords = ['restrict', ' __restrict__', '__restrict']
+    else:
+      keywords = [predefined]
+    for kw in keywords:
+      if not predefined is None or self.checkCompile('', 'float * '+kw+' x;'):
         if language.lower() == 'c':
           self.cRestrict = kw
         elif language.lower() == 'cxx':
@@ -158,13 +174,32 @@ class Configure(config.base.Configure):
     self.popLanguage()
     return
 
+  def getVerboseLinkOutput(self, flag):
+    '''Return the output and status of an empty link for the current language with the verbose flag
+       - The result is recorded in the toolchain profile of the linker, with the temporary directory replaced by a placeholder'''
+    profiles = config.toolchain.ToolchainProfiles.getDefault()
+    oldFlags = self.setCompilers.LDFLAGS
+    self.setCompilers.LDFLAGS += ' '+flag
+    try:
+      linker  = self.getLinker()
+      command = ' '.join([token for token in self.getLinkerCmd().split() if token.find(self.tmpDir) < 0])
+      name    = profiles.getName('link', command)
+      result  = profiles.getValue(linker, name)
+      if result is None:
+        (output, returnCode) = self.outputLink('', '')
+        profiles.setValue(linker, name, (profiles.normalize(output, self.tmpDir), returnCode))
+      else:
+        (output, returnCode) = result
+        output = profiles.denormalize(output, self.tmpDir)
+        self.logPrint('Using the toolchain profile for the verbose link: '+command+'\n'+output, 4, 'compilers')
+    finally:
+      self.setCompilers.LDFLAGS = oldFlags
+    return (output, returnCode)
+
   def checkCLibraries(self):
     '''Determines the libraries needed to link with C'''
-    oldFlags = self.setCompilers.LDFLAGS
-    self.setCompilers.LDFLAGS += ' -v'
     self.pushLanguage('C')
-    (output, returnCode) = self.outputLink('', '')
-    self.setCompilers.LDFLAGS = oldFlags
+    (output, returnCode) = self.getVerboseLinkOutput('-v')
     self.popLanguage()
 
     # PGI: kill anything enclosed in single quotes
@@ -369,11 +404,8 @@ class Configure(config.base.Configure):
 
   def checkCxxLibraries(self):
     '''Determines the libraries needed to link with C++'''
-    oldFlags = self.setCompilers.LDFLAGS
-    self.setCompilers.LDFLAGS += ' -v'
     self.pushLanguage('Cxx')
-    (output, returnCode) = self.outputLink('', '')
-    self.setCompilers.LDFLAGS = oldFlags
+    (output, returnCode) = self.getVerboseLinkOutput('-v')
     self.popLanguage()
 
     # PGI: kill anything enclosed in single quotes
@@ -693,13 +725,10 @@ class Configure(config.base.Configure):
     if not hasattr(self.setCompilers, 'CC') or not hasattr(self.setCompilers, 'FC'):
       return
     self.pushLanguage('FC')
-    oldFlags = self.setCompilers.LDFLAGS
     if config.setCompilers.Configure.isNAG(self.getCompiler()):
-      self.setCompilers.LDFLAGS += ' --verbose'
+      (output, returnCode) = self.getVerboseLinkOutput('--verbose')
     else:
-      self.setCompilers.LDFLAGS += ' -v'
-    (output, returnCode) = self.outputLink('', '')
-    self.setCompilers.LDFLAGS = oldFlags
+      (output, returnCode) = self.getVerboseLinkOutput('-v')
     self.popLanguage()
 
     # replace \CR that ifc puts in each line of output
@@ -66,6 +66,190 @@ except NameError:
   def enumerate(l):
     return zip(range(len(l)), l)
 
+class HeaderRendering(object):
+  '''An incrementally updated rendering of the probe headers, confdefs.h and conffix.h
+     - Defines given to Configure.addDefine() are appended to the rendering, any other change marks it dirty
+     - A dirty rendering is rebuilt from all the children before the next probe
+     - A header file is rewritten only if the rendering changed since it was written, and new defines are appended when possible'''
+  def __init__(self, framework):
+    self.framework    = framework
+    # Incremented whenever the output of a probe header changes
+    self.generation   = 0
+    # Incremented whenever a rendering is rebuilt, so that files written earlier cannot be appended to
+    self.version      = 0
+    self.fixesVersion = 0
+    self.dirty        = 1
+    self.fixesDirty   = 1
+    self.signature    = None
+    self.defines      = []
+    self.guards       = {}
+    self.fixes        = ''
+    # Map from a header file to (generation, version, offset, number of defines, stat)
+    self.files        = {}
+    return
+
+  def getSignature(self):
+    '''The header prefixes, and the children themselves, determine the rendering'''
+    framework = self.framework
+    signature = [str(getattr(framework, 'headerTop', '')), str(getattr(framework, 'headerBottom', ''))]
+    for child in [framework]+list(framework.childGraph.vertices):
+      signature.append((id(child), framework.getHeaderPrefix(child)))
+    return signature
+
+  def invalidate(self):
+    '''Mark the whole rendering for rebuilding'''
+    self.dirty      = 1
+    self.fixesDirty = 1
+    self.generation += 1
+    return
+
+  def getGuard(self, name):
+    return re.match(r'^(\w+)(\([\w,]+\))?', name).group(1)
+
+  def renderDefine(self, child, name):
+    '''Return the guard and text for a define, or None if it is not output'''
+    import StringIO
+
+    value = child.defines[name]
+    if not value: return None
+    fullName = self.framework.getFullDefineName(child, name)
+    comment  = ''
+    if hasattr(child, 'help') and isinstance(child.help, dict):
+      comment = child.help.get(name, '')
+    f = StringIO.StringIO()
+    self.framework.outputDefine(f, fullName, value, comment)
+    return (self.getGuard(fullName), f.getvalue())
+
+  def addDefine(self, child, name, oldValue):
+    '''Append a define which was just set, unless it replaces an earlier one'''
+    if child.defines[name] == oldValue: return
+    self.generation += 1
+    if self.dirty: return
+    if oldValue:
+      self.dirty = 1
+      return
+    define = self.renderDefine(child, name)
+    if define is None: return
+    if define[0] in self.guards:
+      # The earlier define would shadow this one in the rebuilt header
+      self.dirty = 1
+      return
+    self.guards[define[0]] = 1
+    self.defines.append(define[1])
+    return
+
+  def delDefine(self, child, name, oldValue):
+    if oldValue:
+      self.generation += 1
+      self.dirty = 1
+    return
+
+  def changeFixes(self):
+    self.generation += 1
+    self.fixesDirty = 1
+    return
+
+  def rebuild(self):
+    self.defines = []
+    self.guards  = {}
+    for child in [self.framework]+list(self.framework.childGraph.vertices):
+      if not hasattr(child, 'defines') or not isinstance(child.defines, dict): continue
+      for name in child.defines:
+        define = self.renderDefine(child, name)
+        if define is None: continue
+        self.guards[define[0]] = 1
+        self.defines.append(define[1])
+    self.dirty    = 0
+    self.version += 1
+    return
+
+  def update(self):
+    signature = self.getSignature()
+    if not signature == self.signature:
+      self.signature = signature
+      self.invalidate()
+    if self.dirty:
+      self.rebuild()
+    if self.fixesDirty:
+      import StringIO
+
+      f = StringIO.StringIO()
+      self.framework.outputFixes(f)
+      self.fixes         = f.getvalue()
+      self.fixesDirty    = 0
+      self.fixesVersion += 1
+    return
+
+  def getStat(self, filename):
+    try:
+      st = os.stat(filename)
+    except OSError:
+      return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+  def forget(self, filename):
+    '''Discard the state of a header file written by other means'''
+    if filename in self.files: del self.files[filename]
+    return
+
+  def getHead(self, filename):
+    guard = 'INCLUDED_'+os.path.basename(filename).upper().replace('.', '_')
+    head  = '#if !defined('+guard+')\n#define '+guard+'\n\n'
+    if hasattr(self.framework, 'headerTop'):
+      head += str(self.framework.headerTop)+'\n'
+    return head
+
+  def writeFile(self, filename, data, offset = 0):
+    dir = os.path.dirname(filename)
+    if dir and not os.path.exists(dir):
+      os.makedirs(dir)
+    if self.framework.file_create_pause: time.sleep(1)
+    if offset:
+      f = file(filename, 'r+')
+      f.seek(offset)
+      f.truncate()
+    else:
+      f = file(filename, 'w')
+    f.write(data)
+    f.close()
+    return
+
+  def outputHeader(self, filename):
+    '''Bring confdefs.h up to date, appending the new defines when possible'''
+    self.update()
+    state = self.files.get(filename)
+    stat  = self.getStat(filename)
+    if not state is None and state[4] == stat:
+      if state[0] == self.generation: return
+      if state[1] == self.version and state[3] == len(self.defines): return
+    tail = ''
+    if hasattr(self.framework, 'headerBottom'):
+      tail = str(self.framework.headerBottom)+'\n'
+    tail += '#endif\n'
+    if not state is None and state[4] == stat and state[1] == self.version:
+      offset = state[2]
+      new    = ''.join(self.defines[state[3]:])
+      self.writeFile(filename, new+tail, offset)
+      offset += len(new)
+    else:
+      head   = self.getHead(filename)
+      body   = ''.join(self.defines)
+      self.writeFile(filename, head+body+tail)
+      offset = len(head)+len(body)
+    self.files[filename] = (self.generation, self.version, offset, len(self.defines), self.getStat(filename))
+    return
+
+  def outputCHeader(self, filename):
+    '''Bring conffix.h up to date'''
+    self.update()
+    state = self.files.get(filename)
+    if not state is None and state[4] == self.getStat(filename) and state[1] == self.fixesVersion:
+      return
+    guard = 'INCLUDED_'+os.path.basename(filename).upper().replace('.', '_')
+    self.writeFile(filename, '#if !defined('+guard+')\n#define '+guard+'\n\n'+self.fixes+'#endif\n')
+    self.files[filename] = (self.generation, self.fixesVersion, 0, 0, self.getStat(filename))
+    return
+
 class Framework(config.base.Configure, script.LanguageProcessor):
   '''This needs to manage configure information in itself just as Builder manages it for configurations'''
   def __init__(self, clArgs = None, argDB = None, loadArgDB = 1, tmpDir = None):
@@ -107,6 +291,10 @@ class Framework(config.base.Configure, script.LanguageProcessor):
     self.configureParent    = None
     # List of packages actually found
     self.packages           = []
+    # Scratch directories of probes which failed
+    self.failedProbeDirs    = []
+    # Map from a compiler command to the macros it predefines
+    self.predefinedMacros   = {}
     self.createChildren()
     # Create argDB for user specified options only
     self.clArgDB = dict([(nargs.Arg.parseArgument(arg)[0], arg) for arg in self.clArgs])
@@ -118,6 +306,8 @@ class Framework(config.base.Configure, script.LanguageProcessor):
     d = script.LanguageProcessor.__getstate__(self, d)
     if 'configureParent' in d:
       del d['configureParent']
+    if '_headerRendering' in d:
+      del d['_headerRendering']
     return d
 
   def __setstate__(self, d):
@@ -144,10 +334,42 @@ class Framework(config.base.Configure, script.LanguageProcessor):
           dirs.extend(self.listDirs(os.path.join(base, dir),rest ))
     return dirs
 
+  def getTmpDirParent(self):
+    '''Return the directory given by --probe-tmpdir, such as the RAM filesystem /dev/shm, if executables can be run from it'''
+    parent = self.argDB.get('probe-tmpdir')
+    if not parent:
+      return None
+    if not os.path.isdir(parent) or not os.access(parent, os.W_OK):
+      self.logPrint('Cannot create probe directories in '+parent+', using the default temporary directory')
+      return None
+    # Filesystems such as /dev/shm are often mounted noexec
+    fd, name = tempfile.mkstemp(prefix = 'petsc-', suffix = '.sh', dir = parent)
+    os.write(fd, '#!/bin/sh\nexit 0\n')
+    os.close(fd)
+    os.chmod(name, 0700)
+    try:
+      try:
+        self.executeShellCommand(name, log = self.log)
+      except RuntimeError, e:
+        self.logPrint('Cannot run executables in '+parent+', using the default temporary directory: '+str(e))
+        parent = None
+    finally:
+      os.remove(name)
+    return parent
+
+  def addRecordedDirectory(self, directory):
+    '''Tell the recorder of commands, if there is one, that the directory differs between runs'''
+    import commandRecorder
+
+    if not commandRecorder.CommandRecorder.defaultRecorder is None:
+      commandRecorder.CommandRecorder.defaultRecorder.addDirectory(directory)
+    return
+
   def getTmpDir(self):
     if not hasattr(self, '_tmpDir'):
-      self._tmpDir = tempfile.mkdtemp(prefix = 'petsc-')
+      self._tmpDir = tempfile.mkdtemp(prefix = 'petsc-', dir = self.getTmpDirParent())
       self.logPrint('All intermediate test results are stored in '+self._tmpDir)
+      self.addRecordedDirectory(self._tmpDir)
     return self._tmpDir
   def setTmpDir(self, temp):
     if hasattr(self, '_tmpDir'):
@@ -158,8 +380,63 @@ class Framework(config.base.Configure, script.LanguageProcessor):
         delattr(self, '_tmpDir')
     if not temp is None:
       self._tmpDir = temp
+      self.addRecordedDirectory(self._tmpDir)
     return
   tmpDir = property(getTmpDir, setTmpDir, doc = 'Temporary directory for test byproducts')
+  def createProbeDir(self, dir):
+    '''Create a uniquely named scratch directory for a probe inside the given directory
+       - The directories are numbered in order, so that a probe has the same directory in every run
+       - All probe directories are removed along with the temporary directory by cleanup()'''
+    import errno
+
+    if not hasattr(self, 'probeDirCounts'):
+      self.probeDirCounts = {}
+    count = self.probeDirCounts.get(dir, 0)
+    while 1:
+      count += 1
+      name   = os.path.join(dir, 'probe-'+str(count))
+      try:
+        os.mkdir(name)
+        break
+      except OSError, e:
+        if not e.errno == errno.EEXIST: raise
+    self.probeDirCounts[dir] = count
+    return name
+
+  def addFailedProbeDir(self, dir):
+    '''Record the scratch directory of a failing probe, which is kept if --keep-probe-files is given'''
+    if not dir in self.failedProbeDirs:
+      self.failedProbeDirs.append(dir)
+    return
+
+  def getHeaderRendering(self):
+    '''Return the incremental rendering of the probe headers'''
+    if not hasattr(self, '_headerRendering'):
+      self._headerRendering = HeaderRendering(self)
+    return self._headerRendering
+
+  def getProbeCache(self):
+    '''Return the persistent probe cache, or None if it is disabled'''
+    if not hasattr(self, '_probeCache'):
+      if self.argDB['probe-cache'] == 'off':
+        self._probeCache = None
+      else:
+        import config.probeCache
+        self._probeCache = config.probeCache.ProbeCache(self.argDB['probe-cache-dir'], self.argDB['probe-cache'], self.argDB['probe-cache-size']*1024*1024)
+        self.logPrint('Using probe cache in '+self._probeCache.directory+' ('+self._probeCache.mode+')')
+    return self._probeCache
+
+  def setupToolchainProfiles(self):
+    '''Make the toolchain profiles used by all children, which are stored with the probe cache unless it is disabled'''
+    import config.toolchain
+
+    if self.argDB['probe-cache'] == 'off':
+      profiles = config.toolchain.ToolchainProfiles()
+    else:
+      profiles = config.toolchain.ToolchainProfiles(self.argDB['probe-cache-dir'], self.argDB['probe-cache'])
+    config.toolchain.ToolchainProfiles.defaultProfiles = profiles
+    return profiles
+
   def getFileCreatePause(self):
     if not hasattr(self, '_file_create_pause'):
       return self.argDB['with-file-create-pause']
@@ -199,6 +476,16 @@ class Framework(config.base.Configure, script.LanguageProcessor):
     help.addArgument('Framework', '-with-external-packages-dir=<dir>', nargs.Arg(None, None, 'Location to install downloaded packages'))
     help.addArgument('Framework', '-with-batch=<bool>',          nargs.ArgBool(None, 0, 'Machine using cross-compilers or a batch system to submit jobs'))
     help.addArgument('Framework', '-with-file-create-pause=<bool>', nargs.ArgBool(None, 0, 'Add 1 sec pause between config temp file delete/recreate'))
+    help.addArgument('Framework', '-probe-cache=<off,read,readwrite>', nargs.ArgString(None, 'off', 'Use a persistent cache of compile, link, and run probe results', regExp = '^(off|read|readwrite)$'))
+    help.addArgument('Framework', '-probe-cache-dir=<dir>',    nargs.Arg(None, os.path.join(os.path.expanduser('~'), '.petsc-probe-cache'), 'Directory for the probe cache'))
+    help.addArgument('Framework', '-probe-cache-size=<MB>',    nargs.ArgInt(None, 512, 'Maximum size of the probe cache in megabytes', min = 1))
+    help.addArgument('Framework', '-probe-tmpdir=<dir>',       nargs.Arg(None, '', 'Directory for the probe scratch files, for instance the RAM filesystem /dev/shm'))
+    help.addArgument('Framework', '-keep-probe-files=<bool>',  nargs.ArgBool(None, 0, 'Keep the scratch files of failing probes for debugging'))
+    help.addArgument('Framework', '-with-predefined-macros=<bool>', nargs.ArgBool(None, 1, 'Answer checks from the macros predefined by the compiler when possible'))
+    help.addArgument('Framework', '-configure-jobs=<num>',       nargs.ArgInt(None, 1, 'Number of configure modules to run in parallel', min = 1))
+    help.addArgument('Framework', '-profile-configure=<bool>',   nargs.ArgBool(None, 0, 'Report the time taken by each child, test, probe, and command'))
+    help.addArgument('Framework', '-profile-configure-top=<num>', nargs.ArgInt(None, 20, 'Number of the slowest tests and children reported by the profile', min = 1))
+    help.addArgument('Framework', '-profile-configure-stacks=<file>', nargs.Arg(None, 'configure.stacks', 'File for the profile stacks, in the folded format of flamegraph.pl'))
     return help
 
   def getCleanup(self):
@@ -250,8 +537,26 @@ class Framework(config.base.Configure, script.LanguageProcessor):
     self.log.write('\n')
     return
 
+  def removeProbeDirs(self, keep):
+    '''Remove the probe directories, except those in keep, leaving the rest of the temporary directory'''
+    import shutil
+
+    for root, dirs, files in os.walk(self.tmpDir):
+      for dir in dirs[:]:
+        if not dir.startswith('probe-'): continue
+        dirs.remove(dir)
+        dir = os.path.join(root, dir)
+        if not dir in keep:
+          shutil.rmtree(dir)
+    return
+
   def cleanup(self):
     self.actions.output(self.log)
+    if self.argDB['keep-probe-files'] and self.failedProbeDirs:
+      self.removeProbeDirs(self.failedProbeDirs)
+      self.logPrint('Kept the files of '+str(len(self.failedProbeDirs))+' failing probes in '+self.tmpDir, debugSection = 'screen')
+      del self._tmpDir
+      return
     self.tmpDir = None
     return
 
@@ -738,6 +1043,7 @@ class Framework(config.base.Configure, script.LanguageProcessor):
       if dir and not os.path.exists(dir):
         os.makedirs(dir)
       if self.file_create_pause: time.sleep(1)
+      self.getHeaderRendering().forget(name)
       f = file(name, 'w')
       filename = os.path.basename(name)
     guard = 'INCLUDED_'+filename.upper().replace('.', '_')
@@ -765,11 +1071,20 @@ class Framework(config.base.Configure, script.LanguageProcessor):
       if dir and not os.path.exists(dir):
         os.makedirs(dir)
       if self.file_create_pause: time.sleep(1)
+      self.getHeaderRendering().forget(name)
       f = file(name, 'w')
       filename = os.path.basename(name)
     guard = 'INCLUDED_'+filename.upper().replace('.', '_')
     f.write('#if !defined('+guard+')\n')
     f.write('#define '+guard+'\n\n')
+    self.outputFixes(f)
+    f.write('#endif\n')
+    if not isinstance(name, file):
+      f.close()
+    return
+
+  def outputFixes(self, f):
+    '''Write the typedefs and prototypes of the C specific configuration header'''
     self.outputTypedefs(f, self)
     for child in self.childGraph.vertices:
       self.outputTypedefs(f, child)
@@ -790,9 +1105,16 @@ class Framework(config.base.Configure, script.LanguageProcessor):
     for child in self.childGraph.vertices:
       self.outputPrototypes(f, child, 'C')
     f.write('#endif\n')
-    f.write('#endif\n')
-    if not isinstance(name, file):
-      f.close()
+    return
+
+  def outputProbeHeader(self, name):
+    '''Bring the configuration header used by probes up to date, rewriting it only if it has changed'''
+    self.getHeaderRendering().outputHeader(name)
+    return
+
+  def outputProbeCHeader(self, name):
+    '''Bring the C specific configuration header used by probes up to date, rewriting it only if it has changed'''
+    self.getHeaderRendering().outputCHeader(name)
     return
 
   def getOptionsString(self, omitArgs = []):
@@ -904,8 +1226,8 @@ class Framework(config.base.Configure, script.LanguageProcessor):
         sys.exit('Unable to generate test file for cross-compilers/batch-system\n')
       import shutil
       # Could use shutil.copy, but want an error if confname exists as a directory
-      shutil.copyfile(os.path.join(self.tmpDir,'conftest'),confname)
-      shutil.copymode(os.path.join(self.tmpDir,'conftest'),confname)
+      shutil.copyfile(self.linkerObj,confname)
+      shutil.copymode(self.linkerObj,confname)
       self.compilers.CPPFLAGS = oldFlags
       self.compilers.LIBS = oldLibs
       self.logClear()
@@ -921,21 +1243,43 @@ class Framework(config.base.Configure, script.LanguageProcessor):
   def configure(self, out = None):
     '''Configure the system
        - Must delay database initialization until children have contributed variable types
-       - Any child with the "_configured" attribute will not be configured'''
+       - Any child with the "_configured" attribute will not be configured
+       - Children are configured in parallel worker processes when configure-jobs > 1'''
     import graph
+    import config.scheduler
+    import config.toolchain
+    import commandRecorder
+    import profiler
 
     self.setup()
+    if self.argDB['profile-python'] and profiler.PythonProfiler.defaultProfiler is None:
+      return profiler.PythonProfiler(self.argDB['profile-python']).run(self.configure, out)
+    if self.argDB['profile-configure']:
+      profiler.Profiler.defaultProfiler = profiler.Profiler()
+    self.setupToolchainProfiles()
     self.outputBanner()
     self.updateDependencies()
     self.executeTest(self.configureExternalPackagesDir)
-    for child in graph.DirectedGraph.topologicalSort(self.childGraph):
-      if not hasattr(child, '_configured'):
-        child.configure()
-      else:
-        child.no_configure()
-      child._configured = 1
+    config.scheduler.Scheduler(self, self.argDB['configure-jobs']).configure(graph.DirectedGraph.topologicalSort(self.childGraph))
     if self.argDB['with-batch']:
       self.configureBatch()
+    self.logPrint(str(config.toolchain.ToolchainProfiles.getDefault()))
+    if not self.getProbeCache() is None:
+      self.logPrint(str(self.getProbeCache()))
+      self.getProbeCache().evict()
+    self.logResourceUsage()
+    if not commandRecorder.CommandRecorder.defaultRecorder is None:
+      self.logPrint(str(commandRecorder.CommandRecorder.defaultRecorder))
     self.dumpConfFiles()
+    if not profiler.Profiler.defaultProfiler is None:
+      self.outputProfile(profiler.Profiler.defaultProfiler)
+      profiler.Profiler.defaultProfiler = None
     self.cleanup()
     return 1
+
+  def outputProfile(self, profile):
+    '''Report the slowest tests and children, and write the profile stacks for a flame graph'''
+    self.logWrite(profile.getSummary(self.argDB['profile-configure-top']), debugSection = 'screen', forceScroll = 1)
+    profile.writeStacks(self.argDB['profile-configure-stacks'])
+    self.logPrint('Wrote the profile stacks to '+self.argDB['profile-configure-stacks'], debugSection = 'screen', indent = 0, forceScroll = 1)
+    return
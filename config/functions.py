@@ -26,9 +26,8 @@ class Configure(config.base.Configure):
   def haveFunction(self, function):
     return self.getDefineName(function) in self.defines
 
-  def check(self, funcName, libraries = None):
-    '''Checks for the function "funcName", and if found defines HAVE_"funcName"'''
-    self.framework.log.write('Checking for function '+funcName+'\n')
+  def getCheckCode(self, funcName):
+    '''Return the (includes, body) pair which links only if "funcName" is present'''
     # Don't include <ctype.h> because on OSF/1 3.0 it includes <sys/types.h>
     # which includes <sys/select.h> which contains a prototype for
     # select.  Similarly for bzero.
@@ -58,6 +57,17 @@ choke me
 '''+funcName+'''();
 #endif
 '''
+    return (includes, body)
+
+  def check(self, funcName, libraries = None):
+    '''Checks for the function "funcName", and if found defines HAVE_"funcName"'''
+    return self.checkFunctions([funcName], libraries)[0]
+
+  def checkFunctions(self, funcNames, libraries = None):
+    '''Checks for each function in "funcNames", defining HAVE_"funcName" for those found, and returns a list of flags
+       - All functions are checked with a single link when they are present, see checkLinkBatch()'''
+    for funcName in funcNames:
+      self.framework.log.write('Checking for function '+funcName+'\n')
     if libraries:
       oldLibs = self.compilers.LIBS
       if not isinstance(libraries, list):
@@ -68,11 +78,14 @@ choke me
           self.compilers.LIBS += ' '+library
         else:
           self.compilers.LIBS += ' -l'+library
-    found = self.checkLink(includes, body)
+    found = self.checkLinkBatch(map(self.getCheckCode, funcNames))
     if libraries:
       self.compilers.LIBS = oldLibs
-    if found:
-      self.addDefine(self.getDefineName(funcName), 1)
+    for funcName, present in zip(funcNames, found):
+      if present:
+        self.addDefine(self.getDefineName(funcName), 1)
+      elif len(funcNames) > 1:
+        self.framework.log.write('Function '+funcName+' not found\n')
     return found
 
   def checkMemcmp(self):
@@ -197,5 +210,6 @@ choke me
       self.executeTest(self.checkSignalHandlerType)
     self.executeTest(self.checkFreeReturnType)
     self.executeTest(self.checkVariableArgumentLists)
-    map(lambda function: self.executeTest(self.check, function), self.functions)
+    if self.functions:
+      self.executeTest(self.checkFunctions, [self.functions])
     return
@@ -0,0 +1,182 @@
+'''
+  An Introspection collects the questions of a configure module about the target, such as the size
+of a type or the byte order, into a single C program. Each query is a block of code which sets the
+long integer "value", and the program prints one "name value" line per query. It is built and run
+once, and each check then reads its answer with getResult(), running its own program only when the
+answer is missing.
+
+  Queries which are integer constant expressions, such as sizeof() or a limit from limits.h, and the
+byte order, are first extracted from an object file without running anything. Each constant is
+written into an initialized character array as a tag followed by its decimal digits, which the
+compiler computes and places in the data of the object, and the byte order is read from the bytes
+of a known integer. This works with cross compilers and batch systems, where nothing can be run,
+and also saves the run on native builds. It fails, leaving the queries to the program, when the
+object does not hold the data, for instance with link time optimization.
+
+  The output of the program is flushed after every query, so that a program which fails partway
+through still answers the queries before the failure. The program is not run in batch mode, where
+the checks add their code to the batch program of the Framework instead.
+'''
+import re
+
+try:
+  enumerate([0, 1])
+except NameError:
+  def enumerate(l):
+    return zip(range(len(l)), l)
+
+class Introspection(object):
+  tag        = '@PETSC_INTROSPECTION:'
+  # Number of decimal digits extracted, which holds any long long
+  digits     = 19
+  # Value stored after the byte order tag, whose bytes give the byte order
+  orderValue = '0x01020304UL'
+
+  def __init__(self, configure):
+    # The configure object used to build and run the program
+    self.configure = configure
+    self.includes  = []
+    self.setup     = []
+    self.cleanup   = []
+    # List of (name, code, expression) in the order they are printed
+    self.queries   = []
+    # Names of the queries for the byte order, which are 1 for big endian
+    self.byteOrder = []
+    self.results   = {}
+    return
+
+  def addInclude(self, includes):
+    '''Add an include or a list of includes to the program, omitting duplicates'''
+    if not isinstance(includes, list):
+      includes = [includes]
+    for include in includes:
+      if not include in self.includes:
+        self.includes.append(include)
+    return
+
+  def addSetup(self, setup):
+    '''Add code to be run before the queries'''
+    if not isinstance(setup, list):
+      setup = [setup]
+    self.setup.extend(setup)
+    return
+
+  def addCleanup(self, cleanup):
+    '''Add code to be run after the queries'''
+    if not isinstance(cleanup, list):
+      cleanup = [cleanup]
+    self.cleanup.extend(cleanup)
+    return
+
+  def addQuery(self, name, code, expression = None):
+    '''Add a query, whose code sets the long integer "value"
+       - If the answer is an integer constant expression, giving it allows the answer to be found by compiling alone'''
+    self.queries.append((name, code, expression))
+    return
+
+  def addByteOrderQuery(self, name):
+    '''Add a query whose answer is 1 if the target is big endian and 0 if it is little endian'''
+    self.addQuery(name, '  union {long l; char c[sizeof(long)];} u;\n  u.l = 1;\n  value = (u.c[sizeof(long) - 1] == 1);')
+    self.byteOrder.append(name)
+    return
+
+  def getCode(self):
+    '''Return the includes and body of the program'''
+    includes = '\n'.join(['#include <stdio.h>']+self.includes)+'\n'
+    body     = self.setup[:]
+    for name, code, expression in self.queries:
+      body.extend(['{', '  long value = 0;', code, '  printf("%s %ld\\n", "'+name+'", value);', '  fflush(stdout);', '}'])
+    body.extend(self.cleanup)
+    return (includes, '\n'.join(body))
+
+  def getCharacters(self, text):
+    return ', '.join(["'"+c+"'" for c in text])
+
+  def getExtractionCode(self):
+    '''Return the includes which place the constant expressions and the byte order in the object file'''
+    code      = ['#include <stdio.h>']+self.includes
+    constants = [(query[0], query[2]) for query in self.queries if not query[2] is None]
+    for i, (name, expression) in enumerate(constants):
+      digits = []
+      for d in range(self.digits-1, -1, -1):
+        # Division truncates toward zero, so the digits of a negative value are negated
+        power = '1'+'0'*d+'LL'
+        digits.append("(char) ('0' + ((%s) < 0 ? -((%s) / %s %% 10) : ((%s) / %s %% 10)))" % (expression, expression, power, expression, power))
+      code.append('const char petsc_introspection_'+str(i)+'[] = {'+self.getCharacters(self.tag+name+':')+', (char) ((%s) < 0 ? \'-\' : \'+\'), ' % (expression,)+', '.join(digits)+", '@'};")
+    if [query for query in self.queries if query[0] in self.byteOrder]:
+      code.append('const struct {char tag['+str(len(self.tag)+5)+']; unsigned long value;} petsc_introspection_order = {{'+self.getCharacters(self.tag+'order')+'}, '+self.orderValue+'};')
+    return '\n'.join(code)+'\n'
+
+  def parseObject(self, data):
+    '''Return the answers found in the data of an object file'''
+    results = {}
+    for match in re.finditer(re.escape(self.tag)+r'([A-Za-z0-9_.\-]+):([+-])(\d{'+str(self.digits)+'})@', data):
+      value = int(match.group(3), 10)
+      if match.group(2) == '-':
+        value = -value
+      results[match.group(1)] = value
+    start = data.find(self.tag+'order')
+    if start >= 0:
+      window = data[start+len(self.tag)+5:start+len(self.tag)+5+32]
+      if window.find('\x01\x02\x03\x04') >= 0:
+        order = 1
+      elif window.find('\x04\x03\x02\x01') >= 0:
+        order = 0
+      else:
+        order = None
+      if not order is None:
+        for name in self.byteOrder:
+          results[name] = order
+    return results
+
+  def extract(self):
+    '''Compile the constant expressions and byte order into an object file, and read the answers from its data'''
+    import os
+
+    self.configure.pushLanguage('C')
+    (output, error, status) = self.configure.outputCompile(self.getExtractionCode(), '', cleanup = 0)
+    obj = self.configure.compilerObj
+    self.configure.popLanguage()
+    if status or not os.path.isfile(obj):
+      return {}
+    f = file(obj, 'rb')
+    data = f.read()
+    f.close()
+    return self.parseObject(data)
+
+  def parseOutput(self, output):
+    '''Return the answers found in the output of the program'''
+    names   = [query[0] for query in self.queries]
+    results = {}
+    for line in output.splitlines():
+      tokens = line.split()
+      if len(tokens) == 2 and tokens[0] in names:
+        try:
+          results[tokens[0]] = int(tokens[1])
+        except ValueError:
+          pass
+    return results
+
+  def run(self):
+    '''Answer the queries by compiling alone if possible, and otherwise by building and running the program'''
+    if not self.queries:
+      return self.results
+    if [query for query in self.queries if not query[2] is None or query[0] in self.byteOrder]:
+      results = self.extract()
+      self.configure.logPrint('Introspection extracted '+str(len(results))+' of '+str(len(self.queries))+' queries from an object file')
+      self.results.update(results)
+      self.queries = [query for query in self.queries if not query[0] in results]
+    if self.queries and not self.configure.framework.argDB['with-batch']:
+      self.configure.pushLanguage('C')
+      (includes, body) = self.getCode()
+      (output, status) = self.configure.outputRun(includes, body)
+      self.configure.popLanguage()
+      results = self.parseOutput(output)
+      self.configure.logPrint('Introspection answered '+str(len(results))+' of '+str(len(self.queries))+' queries')
+      self.results.update(results)
+    self.queries = []
+    return self.results
+
+  def getResult(self, name):
+    '''Return the answer to a query, or None if the program did not answer it'''
+    return self.results.get(name)
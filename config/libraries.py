@@ -145,9 +145,12 @@ class Configure(config.base.Configure):
   def check(self, libName, funcs, libDir = None, otherLibs = [], prototype = '', call = '', fortranMangle = 0, cxxMangle = 0):
     '''Checks that the library "libName" contains "funcs", and if it does defines HAVE_LIB"libName"
        - libDir may be a list of directories
-       - libName may be a list of library names'''
+       - libName may be a list of library names
+       - All functions are checked with a single link when they are present, see checkLinkBatch(), except for Fortran
+       - HAVE_LIB"libName" is defined if the first function is found, even when the check fails on a later one'''
     if not isinstance(funcs,list): funcs = [funcs]
     if not isinstance(libName, list): libName = [libName]
+    probes = []
     for f, funcName in enumerate(funcs):
       # Handle Fortran mangling
       if fortranMangle:
@@ -189,32 +192,43 @@ extern "C" {
           body = call[f]
       else:
         body = funcName+'()\n'
-      # Setup link line
-      oldLibs = self.setCompilers.LIBS
-      if libDir:
-        if not isinstance(libDir, list): libDir = [libDir]
-        for dir in libDir:
-          self.setCompilers.LIBS += ' -L'+dir
-      # new libs may/will depend on system libs so list new libs first!
-      # Matt, do not change this without talking to me
-      if libName and otherLibs:
-        self.setCompilers.LIBS = ' '+self.toString(libName+otherLibs) +' '+ self.setCompilers.LIBS
-      elif otherLibs:
-        self.setCompilers.LIBS = ' '+self.toString(otherLibs) +' '+ self.setCompilers.LIBS
-      elif libName:
-        self.setCompilers.LIBS = ' '+self.toString(libName) +' '+ self.setCompilers.LIBS
-      self.pushLanguage(self.language[-1])
-      found = 0
-      if self.checkLink(includes, body):
-        found = 1
-        # add to list of found libraries
-        if libName:
-          for lib in libName:
-            shortlib = self.getShortLibName(lib)
-            if shortlib: self.addDefine(self.getDefineName(shortlib), 1)
-      self.setCompilers.LIBS = oldLibs
-      self.popLanguage()
-      if not found: return 0
+      probes.append((includes, body))
+    if not probes: return 1
+    # Setup link line
+    oldLibs = self.setCompilers.LIBS
+    if libDir:
+      if not isinstance(libDir, list): libDir = [libDir]
+      for dir in libDir:
+        self.setCompilers.LIBS += ' -L'+dir
+    # new libs may/will depend on system libs so list new libs first!
+    # Matt, do not change this without talking to me
+    if libName and otherLibs:
+      self.setCompilers.LIBS = ' '+self.toString(libName+otherLibs) +' '+ self.setCompilers.LIBS
+    elif otherLibs:
+      self.setCompilers.LIBS = ' '+self.toString(otherLibs) +' '+ self.setCompilers.LIBS
+    elif libName:
+      self.setCompilers.LIBS = ' '+self.toString(libName) +' '+ self.setCompilers.LIBS
+    self.pushLanguage(self.language[-1])
+    if self.language[-1] == 'FC':
+      # Fortran bodies cannot be combined, so stop at the first missing function
+      found = []
+      for includes, body in probes:
+        found.append(self.checkLink(includes, body))
+        if not found[-1]:
+          break
+    else:
+      found = self.checkLinkBatch(probes)
+    # As when the functions were linked in turn, the library is defined once the first function links, even if a later one is missing
+    if found[0]:
+      # add to list of found libraries
+      if libName:
+        for lib in libName:
+          shortlib = self.getShortLibName(lib)
+          if shortlib: self.addDefine(self.getDefineName(shortlib), 1)
+    self.setCompilers.LIBS = oldLibs
+    self.popLanguage()
+    for present in found:
+      if not present: return 0
     return 1
 
   def checkMath(self):
@@ -1,4 +1,5 @@
 from __future__ import generators
+import commandEngine
 import config.base
 
 import os
@@ -52,6 +53,7 @@ class Package(config.base.Configure):
     self.archIndependent  = 0    # 1 means the install directory does not incorporate the ARCH name
     self.downloadonWindows   = 0  # 1 means the --download-package works on Microsoft Windows
     self.worksonWindows      = 0  # 1 means that package can be used on Microsof Windows
+    self.buildOutputLines    = 1000 # number of lines kept from the start and end of the output of a build, which is logged in full as it runs
     # Outside coupling
     self.defaultInstallDir= os.path.abspath('externalpackages')
     return
@@ -182,7 +184,12 @@ class Package(config.base.Configure):
     if not os.path.isdir(self.libDir):     os.mkdir(self.libDir)
     if not os.path.isdir(self.includeDir): os.mkdir(self.includeDir)
     if not os.path.isdir(self.confDir):    os.mkdir(self.confDir)
-    return os.path.abspath(self.Install())
+    commandEngine.ResourceUsage.enter(self.__module__+'.Install')
+    try:
+      installDir = self.Install()
+    finally:
+      commandEngine.ResourceUsage.leave()
+    return os.path.abspath(installDir)
 
   def getChecksum(self,source, chunkSize = 1024*1024):
     '''Return the md5 checksum for a given file, which may also be specified by its filename
@@ -997,13 +1004,13 @@ class GNUPackage(Package):
     ### Configure and Build package
     try:
       self.logPrintBox('Running configure on ' +self.PACKAGE+'; this may take several minutes')
-      output1,err1,ret1  = config.base.Configure.executeShellCommand('cd '+self.packageDir+' && ./configure '+args, timeout=2000, log = self.framework.log)
+      output1,err1,ret1  = config.base.Configure.executeShellCommand('cd '+self.packageDir+' && ./configure '+args, timeout=2000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
     except RuntimeError, e:
       raise RuntimeError('Error running configure on ' + self.PACKAGE+': '+str(e))
     try:
       self.logPrintBox('Running make on '+self.PACKAGE+'; this may take several minutes')
-      output2,err2,ret2  = config.base.Configure.executeShellCommand('cd '+self.packageDir+' && make && make install', timeout=6000, log = self.framework.log)
-      output3,err3,ret3  = config.base.Configure.executeShellCommand('cd '+self.packageDir+' && make clean', timeout=200, log = self.framework.log)
+      output2,err2,ret2  = config.base.Configure.executeShellCommand('cd '+self.packageDir+' && make && make install', timeout=6000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
+      output3,err3,ret3  = config.base.Configure.executeShellCommand('cd '+self.packageDir+' && make clean', timeout=200, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
     except RuntimeError, e:
       raise RuntimeError('Error running make; make install on '+self.PACKAGE+': '+str(e))
     self.postInstall(output1+err1+output2+err2+output3+err3, self.package)
@@ -4,6 +4,7 @@
 from __future__ import generators
 import user
 import config.base
+import config.introspection
 import config.package
 import os
 from stat import *
@@ -186,24 +187,31 @@ class Configure(config.package.Package):
     oldLibs  = self.compilers.LIBS
     self.compilers.CPPFLAGS += ' '+self.headers.toString(self.include)
     self.compilers.LIBS = self.libraries.toString(self.lib)+' '+self.compilers.LIBS
-    if self.checkLink('#include <mpi.h>\n', 'int flag;if (MPI_Finalized(&flag));\n'):
+    # All functions are checked with a single link when they are present
+    (finalized, inPlace, typeCreateStruct, commCreateErrhandler, commSetErrhandler) = self.checkLinkBatch([
+      ('#include <mpi.h>\n', 'int flag;if (MPI_Finalized(&flag));\n'),
+      ('#include <mpi.h>\n', 'if (MPI_Allreduce(MPI_IN_PLACE,0, 1, MPI_INT, MPI_SUM, MPI_COMM_SELF));\n'),
+      ('#include <mpi.h>\n', 'int count=2; int blocklens[2]={0,1}; MPI_Aint indices[2]={0,1}; MPI_Datatype old_types[2]={0,1}; MPI_Datatype *newtype = 0;\n \
+                                             if (MPI_Type_create_struct(count, blocklens, indices, old_types, newtype));\n'),
+      ('#include <mpi.h>\n', 'MPI_Comm_errhandler_fn * p_err_fun = 0; MPI_Errhandler * p_errhandler = 0; if (MPI_Comm_create_errhandler(p_err_fun,p_errhandler));\n'),
+      ('#include <mpi.h>\n', 'if (MPI_Comm_set_errhandler(MPI_COMM_WORLD,MPI_ERRORS_RETURN));\n')])
+    if finalized:
       self.haveFinalized = 1
       self.addDefine('HAVE_MPI_FINALIZED', 1)
-    if self.checkLink('#include <mpi.h>\n', 'if (MPI_Allreduce(MPI_IN_PLACE,0, 1, MPI_INT, MPI_SUM, MPI_COMM_SELF));\n'):
+    if inPlace:
       self.haveInPlace = 1
       self.addDefine('HAVE_MPI_IN_PLACE', 1)
-    if self.checkLink('#include <mpi.h>\n', 'int count=2; int blocklens[2]={0,1}; MPI_Aint indices[2]={0,1}; MPI_Datatype old_types[2]={0,1}; MPI_Datatype *newtype = 0;\n \
-                                             if (MPI_Type_create_struct(count, blocklens, indices, old_types, newtype));\n'):
+    if typeCreateStruct:
       self.haveTypeCreateStruct = 1
     else:
       self.haveTypeCreateStruct = 0
       self.framework.addDefine('MPI_Type_create_struct(count,lens,displs,types,newtype)', 'MPI_Type_struct((count),(lens),(displs),(types),(newtype))')
-    if self.checkLink('#include <mpi.h>\n', 'MPI_Comm_errhandler_fn * p_err_fun = 0; MPI_Errhandler * p_errhandler = 0; if (MPI_Comm_create_errhandler(p_err_fun,p_errhandler));\n'):
+    if commCreateErrhandler:
       self.haveCommCreateErrhandler = 1
     else:
       self.haveCommCreateErrhandler = 0
       self.framework.addDefine('MPI_Comm_create_errhandler(p_err_fun,p_errhandler)', 'MPI_Errhandler_create((p_err_fun),(p_errhandler))')
-    if self.checkLink('#include <mpi.h>\n', 'if (MPI_Comm_set_errhandler(MPI_COMM_WORLD,MPI_ERRORS_RETURN));\n'):
+    if commSetErrhandler:
       self.haveCommSetErrhandler = 1
     else:
       self.haveCommSetErrhandler = 0
@@ -232,15 +240,51 @@ class Configure(config.package.Package):
     self.compilers.LIBS = oldLibs
     return
 
+  def getMPITypes(self):
+    '''Return the (datatype, name, includes, body) of the MPI Datatype handles which compile, testing them once'''
+    if not hasattr(self, 'mpiTypes'):
+      mpitypes = [('MPI_LONG_DOUBLE', 'long-double')]
+      if self.getDefaultLanguage() == 'C': mpitypes.extend([('MPI_C_DOUBLE_COMPLEX', 'c-double-complex')])
+      self.mpiTypes = []
+      for datatype, name in mpitypes:
+        includes = '#ifdef PETSC_HAVE_STDLIB_H\n  #include <stdlib.h>\n#endif\n#include <mpi.h>\n'
+        body     = 'MPI_Aint size;\nint ierr;\nMPI_Init(0,0);\nierr = MPI_Type_extent('+datatype+', &size);\nif(ierr || (size == 0)) exit(1);\nMPI_Finalize();\n'
+        if self.checkCompile(includes, body):
+          self.mpiTypes.append((datatype, name, includes, body))
+    return self.mpiTypes
+
+  def configureIntrospection(self):
+    '''Run a single program answering the sizes of the MPI types and whether the MPI Datatype handles work
+       - The sizes come first, so that they are answered even if MPI_Init() fails'''
+    oldFlags = self.compilers.CPPFLAGS
+    oldLibs  = self.compilers.LIBS
+    self.compilers.CPPFLAGS += ' '+self.headers.toString(self.include)
+    self.compilers.LIBS = self.libraries.toString(self.lib)+' '+self.compilers.LIBS
+    self.introspection = config.introspection.Introspection(self)
+    self.types.addSizeofQuery(self.introspection, 'MPI_Comm', 'mpi.h')
+    if 'HAVE_MPI_FINT' in self.defines:
+      self.types.addSizeofQuery(self.introspection, 'MPI_Fint', 'mpi.h')
+    mpitypes = [(datatype, name) for datatype, name, includes, body in self.getMPITypes() if not 'known-mpi-'+name in self.argDB]
+    if mpitypes:
+      self.introspection.addInclude(['#include <stdlib.h>', '#include <mpi.h>'])
+      self.introspection.addQuery('mpi-init', '  value = (MPI_Init(0,0) == MPI_SUCCESS);')
+      for datatype, name in mpitypes:
+        self.introspection.addQuery('mpi-'+name, '  MPI_Aint size = 0;\n  int ierr = MPI_Type_extent('+datatype+', &size);\n  value = !(ierr || (size == 0));')
+      self.introspection.addCleanup('MPI_Finalize();')
+    self.introspection.run()
+    self.compilers.CPPFLAGS = oldFlags
+    self.compilers.LIBS = oldLibs
+    return
+
   def configureTypes(self):
     '''Checking for MPI types'''
     oldFlags = self.compilers.CPPFLAGS
     self.compilers.CPPFLAGS += ' '+self.headers.toString(self.include)
     self.framework.batchIncludeDirs.extend([self.headers.getIncludeArgument(inc) for inc in self.include])
     self.framework.addBatchLib(self.lib)
-    self.types.checkSizeof('MPI_Comm', 'mpi.h')
+    self.types.checkSizeof('MPI_Comm', 'mpi.h', self.introspection)
     if 'HAVE_MPI_FINT' in self.defines:
-      self.types.checkSizeof('MPI_Fint', 'mpi.h')
+      self.types.checkSizeof('MPI_Fint', 'mpi.h', self.introspection)
     self.compilers.CPPFLAGS = oldFlags
     return
 
@@ -250,27 +294,25 @@ class Configure(config.package.Package):
     oldLibs  = self.compilers.LIBS
     self.compilers.CPPFLAGS += ' '+self.headers.toString(self.include)
     self.compilers.LIBS = self.libraries.toString(self.lib)+' '+self.compilers.LIBS
-    mpitypes = [('MPI_LONG_DOUBLE', 'long-double')]
-    if self.getDefaultLanguage() == 'C': mpitypes.extend([('MPI_C_DOUBLE_COMPLEX', 'c-double-complex')])
-    for datatype, name in mpitypes:
-      includes = '#ifdef PETSC_HAVE_STDLIB_H\n  #include <stdlib.h>\n#endif\n#include <mpi.h>\n'
-      body     = 'MPI_Aint size;\nint ierr;\nMPI_Init(0,0);\nierr = MPI_Type_extent('+datatype+', &size);\nif(ierr || (size == 0)) exit(1);\nMPI_Finalize();\n'
-      if self.checkCompile(includes, body):
-        if 'known-mpi-'+name in self.argDB:
-          if int(self.argDB['known-mpi-'+name]):
-            self.addDefine('HAVE_'+datatype, 1)
-        elif not self.argDB['with-batch']:
-          self.pushLanguage('C')
-          if self.checkRun(includes, body, defaultArg = 'known-mpi-'+name):
-            self.addDefine('HAVE_'+datatype, 1)
-          self.popLanguage()
-        else:
-          if self.needBatchMPI:
-            self.framework.addBatchSetup('if (MPI_Init(&argc, &argv));')
-            self.framework.addBatchCleanup('if (MPI_Finalize());')
-            self.needBatchMPI = 0
-          self.framework.addBatchInclude(['#include <stdlib.h>', '#define MPICH_IGNORE_CXX_SEEK', '#define MPICH_SKIP_MPICXX 1', '#define OMPI_SKIP_MPICXX 1', '#include <mpi.h>'])
-          self.framework.addBatchBody('''
+    for datatype, name, includes, body in self.getMPITypes():
+      if 'known-mpi-'+name in self.argDB:
+        if int(self.argDB['known-mpi-'+name]):
+          self.addDefine('HAVE_'+datatype, 1)
+      elif self.introspection.getResult('mpi-init') and not self.introspection.getResult('mpi-'+name) is None:
+        if self.introspection.getResult('mpi-'+name):
+          self.addDefine('HAVE_'+datatype, 1)
+      elif not self.argDB['with-batch']:
+        self.pushLanguage('C')
+        if self.checkRun(includes, body, defaultArg = 'known-mpi-'+name):
+          self.addDefine('HAVE_'+datatype, 1)
+        self.popLanguage()
+      else:
+        if self.needBatchMPI:
+          self.framework.addBatchSetup('if (MPI_Init(&argc, &argv));')
+          self.framework.addBatchCleanup('if (MPI_Finalize());')
+          self.needBatchMPI = 0
+        self.framework.addBatchInclude(['#include <stdlib.h>', '#define MPICH_IGNORE_CXX_SEEK', '#define MPICH_SKIP_MPICXX 1', '#define OMPI_SKIP_MPICXX 1', '#include <mpi.h>'])
+        self.framework.addBatchBody('''
 {
   MPI_Aint size=0;
   int ierr=0;
@@ -436,14 +478,14 @@ class Configure(config.package.Package):
     if self.installNeeded('args.petsc'):
       try:
         self.logPrintBox('Configuring OPENMPI/MPI; this may take several minutes')
-        output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && ./configure '+args, timeout=1500, log = self.framework.log)
+        output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && ./configure '+args, timeout=1500, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
       except RuntimeError, e:
         raise RuntimeError('Error running configure on OPENMPI/MPI: '+str(e))
       try:
         self.logPrintBox('Compiling OPENMPI/MPI; this may take several minutes')
         output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && '+self.programs.make+' clean', timeout=200, log = self.framework.log)
-        output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && '+self.programs.make+' -j ' + str(self.programs.make_np)+' all', timeout=6000, log = self.framework.log)
-        output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && '+self.programs.make+' install', timeout=6000, log = self.framework.log)
+        output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && '+self.programs.make+' -j ' + str(self.programs.make_np)+' all', timeout=6000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
+        output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && '+self.programs.make+' install', timeout=6000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
         output,err,ret  = config.base.Configure.executeShellCommand('cd '+openmpiDir+' && '+self.programs.make+' clean', timeout=200, log = self.framework.log)
       except RuntimeError, e:
         raise RuntimeError('Error running make on OPENMPI/MPI: '+str(e))
@@ -545,7 +587,7 @@ class Configure(config.package.Package):
     if self.installNeeded('args.petsc'):
       try:
         self.logPrintBox('Running configure on MPICH; this may take several minutes')
-        output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && ./configure '+args, timeout=2000, log = self.framework.log)
+        output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && ./configure '+args, timeout=2000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
       except RuntimeError, e:
         import sys
         if sys.platform.startswith('cygwin'):
@@ -561,8 +603,8 @@ class Configure(config.package.Package):
         self.logPrintBox('Running make on MPICH; this may take several minutes')
         output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && '+self.programs.make+' clean', timeout=200, log = self.framework.log)
         makej_cmd = self.programs.make+' -j ' + str(self.programs.make_np)
-        output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && '+makej_cmd+' all', timeout=6000, log = self.framework.log)
-        output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && '+self.programs.make+' install', timeout=6000, log = self.framework.log)
+        output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && '+makej_cmd+' all', timeout=6000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
+        output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && '+self.programs.make+' install', timeout=6000, log = self.framework.log, tee = 1, headLines = self.buildOutputLines, tailLines = self.buildOutputLines)
         output,err,ret  = config.base.Configure.executeShellCommand('cd '+mpichDir+' && '+self.programs.make+' clean', timeout=200, log = self.framework.log)
       except RuntimeError, e:
         import sys
@@ -752,6 +794,7 @@ class Configure(config.package.Package):
     config.package.Package.configureLibrary(self)
     self.executeTest(self.configureConversion)
     self.executeTest(self.configureMPI2)
+    self.executeTest(self.configureIntrospection)
     self.executeTest(self.configureTypes)
     self.executeTest(self.configureMPITypes)
     self.executeTest(self.configureMissingPrototypes)
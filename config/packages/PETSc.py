@@ -234,13 +234,17 @@ class Configure(config.base.Configure):
     if not isinstance(libraries, list): libraries = [libraries]
     oldLibs = self.compilers.LIBS
     self.libraries.pushLanguage(self.languages.clanguage)
-    found   = (self.libraries.check(libraries, 'PetscInitializeNoArguments', otherLibs = self.otherLibs, prototype = 'int PetscInitializeNoArguments(void);') and
-               self.libraries.check(libraries, 'VecDestroy', otherLibs = self.otherLibs, prototype = 'typedef struct _p_Vec *Vec;int VecDestroy(Vec*);', call = 'VecDestroy((Vec*) 0)') and
-               self.libraries.check(libraries, 'MatDestroy', otherLibs = self.otherLibs, prototype = 'typedef struct _p_Mat *Mat;int MatDestroy(Mat*);', call = 'MatDestroy((Mat*) 0)') and
-               self.libraries.check(libraries, 'DMDestroy', otherLibs = self.otherLibs, prototype = 'typedef struct _p_DM *DA;int DMDestroy(DA*);', call = 'DMDestroy((DA*) 0)') and
-               self.libraries.check(libraries, 'KSPDestroy', otherLibs = self.otherLibs, prototype = 'typedef struct _p_KSP *KSP;int KSPDestroy(KSP*);', call = 'KSPDestroy((KSP*) 0)') and
-               self.libraries.check(libraries, 'SNESDestroy', otherLibs = self.otherLibs, prototype = 'typedef struct _p_SNES *SNES;int SNESDestroy(SNES*);', call = 'SNESDestroy((SNES*) 0)') and
-               self.libraries.check(libraries, 'TSDestroy', otherLibs = self.otherLibs, prototype = 'typedef struct _p_TS *TS;int TSDestroy(TS*);', call = 'TSDestroy((TS*) 0)'))
+    funcs      = ['PetscInitializeNoArguments', 'VecDestroy', 'MatDestroy', 'DMDestroy', 'KSPDestroy', 'SNESDestroy', 'TSDestroy']
+    prototypes = ['int PetscInitializeNoArguments(void);',
+                  'typedef struct _p_Vec *Vec;int VecDestroy(Vec*);',
+                  'typedef struct _p_Mat *Mat;int MatDestroy(Mat*);',
+                  'typedef struct _p_DM *DA;int DMDestroy(DA*);',
+                  'typedef struct _p_KSP *KSP;int KSPDestroy(KSP*);',
+                  'typedef struct _p_SNES *SNES;int SNESDestroy(SNES*);',
+                  'typedef struct _p_TS *TS;int TSDestroy(TS*);']
+    calls      = ['PetscInitializeNoArguments()', 'VecDestroy((Vec*) 0)', 'MatDestroy((Mat*) 0)', 'DMDestroy((DA*) 0)', 'KSPDestroy((KSP*) 0)', 'SNESDestroy((SNES*) 0)', 'TSDestroy((TS*) 0)']
+    # All functions are checked with a single link
+    found   = self.libraries.check(libraries, funcs, otherLibs = self.otherLibs, prototype = prototypes, call = calls)
     self.libraries.popLanguage()
     self.compilers.LIBS = oldLibs
     return found
@@ -0,0 +1,271 @@
+'''
+  The ProbeCache stores the results of configure probes, meaning the preprocessor, compiler, linker,
+and executable runs made by checkPreprocess(), checkCompile(), checkLink(), and checkRun(), so that
+they can be shared between configure runs, for instance for several PETSC_ARCH builds.
+
+  An entry is addressed by a hash of
+    - The identity of the program run (real path, size and modification time)
+    - The command line, with the configure temporary directory and the scratch directory of the
+      probe replaced by placeholders
+    - The contents of the input files, such as the source, confdefs.h, and conffix.h
+    - The identity of every absolute path on the command line, such as libraries and include directories
+    - The relevant environment variables, and the machine type
+
+A file produced in the temporary directory by an earlier probe, such as an object file or executable,
+is identified by the key of that probe rather than by its contents, since object files record the
+name of the temporary directory.
+
+  Each entry holds the status, output, and error of the command, together with the files it produced.
+Entries are written to a temporary file and renamed, so that concurrent configures can share a cache
+directory. Hits update the modification time of the entry, and eviction removes the least recently
+used entries once the cache exceeds its maximum size.
+'''
+import os
+import cPickle
+
+try:
+  enumerate([0, 1])
+except NameError:
+  def enumerate(l):
+    return zip(range(len(l)), l)
+
+try:
+  from hashlib import md5 as new_md5
+except ImportError:
+  from md5 import new as new_md5
+
+class ProbeCache(object):
+  version              = '2'
+  placeholder          = '@PROBE_TMPDIR@'
+  workspacePlaceholder = '@PROBE_WORKSPACE@'
+  environment          = ['PATH', 'LD_LIBRARY_PATH', 'LIBRARY_PATH', 'DYLD_LIBRARY_PATH', 'LD_RUN_PATH', 'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH',
+                          'COMPILER_PATH', 'GCC_EXEC_PREFIX', 'LANG', 'LC_ALL', 'LC_MESSAGES']
+
+  def __init__(self, directory, mode = 'readwrite', maxSize = 512*1024*1024):
+    self.directory = directory
+    self.mode      = mode
+    self.maxSize   = maxSize
+    self.hits      = 0
+    self.misses    = 0
+    self.writes    = 0
+    # Map from a file produced by a probe to (key, size, mtime)
+    self.producers = {}
+    return
+
+  def __str__(self):
+    return 'Probe cache in '+self.directory+' ('+self.mode+'): '+str(self.hits)+' hits, '+str(self.misses)+' misses, '+str(self.writes)+' writes'
+
+  def isReadable(self):
+    return self.mode in ['read', 'readwrite']
+
+  def isWritable(self):
+    return self.mode == 'readwrite'
+
+  def getStat(self, filename):
+    '''Return a string identifying a file or directory without reading it'''
+    try:
+      st = os.stat(filename)
+    except OSError:
+      return 'missing'
+    return str(st.st_size)+':'+repr(st.st_mtime)
+
+  def findProgram(self, name):
+    if os.path.isabs(name):
+      return name
+    for dir in os.environ.get('PATH', '').split(os.path.pathsep):
+      filename = os.path.join(dir, name)
+      if os.path.isfile(filename):
+        return filename
+    return name
+
+  def getPaths(self, command):
+    '''Return the absolute paths on a command line, including those in -I, -L, and -Wl options'''
+    paths = []
+    for token in command.split():
+      for part in token.replace('=', ',').split(','):
+        part = part.strip('\'"')
+        if part[0:2] in ['-I', '-L']:
+          part = part[2:]
+        if part.startswith('/'):
+          paths.append(part)
+    return paths
+
+  def getDirectories(self, tmpDir, workspace = None):
+    '''Return the pairs (directory, placeholder) used to normalize paths, the most specific first
+       - The workspace is the scratch directory of the probe, which has a unique name'''
+    dirs = []
+    if workspace:
+      dirs.append((os.path.join(workspace, '')[:-1], self.workspacePlaceholder))
+    dirs.append((os.path.join(tmpDir, '')[:-1], self.placeholder))
+    return dirs
+
+  def normalize(self, text, dirs):
+    for dir, placeholder in dirs:
+      text = text.replace(dir, placeholder)
+    return text
+
+  def denormalize(self, text, dirs):
+    for dir, placeholder in dirs:
+      text = text.replace(placeholder, dir)
+    return text
+
+  def getFileIdentity(self, filename, dirs):
+    '''Files in the temporary directory are identified by their producer or contents, others by size and modification time
+       - Directories are identified only by their path, since their modification time changes with every file created'''
+    if not [dir for dir, placeholder in dirs if filename.startswith(dir)]:
+      if os.path.isdir(filename):
+        return filename+'=dir'
+      return filename+'='+self.getStat(filename)
+    name = self.normalize(filename, dirs)
+    if filename in self.producers:
+      key, stat = self.producers[filename]
+      if stat == self.getStat(filename):
+        return name+'=probe:'+key
+    if os.path.isfile(filename):
+      f = file(filename)
+      digest = new_md5(self.normalize(f.read(), dirs)).hexdigest()
+      f.close()
+      return name+'=md5:'+digest
+    return name+'='+str(os.path.isdir(filename))
+
+  def normalizeCommand(self, command, dirs):
+    '''Replace the temporary directories by placeholders, and sort the include flags for the temporary directory
+       - These come from an unordered set, and only select the directory holding confdefs.h'''
+    tokens   = self.normalize(command, dirs).split()
+    includes = [token for token in tokens if token.startswith('-I'+self.placeholder)]
+    includes.sort()
+    includes.reverse()
+    for i, token in enumerate(tokens):
+      if token.startswith('-I'+self.placeholder):
+        tokens[i] = includes.pop()
+    return ' '.join(tokens)
+
+  def getKey(self, command, inputs, outputs, tmpDir, workspace = None):
+    '''Return the cache key for a command in the given temporary directory and probe workspace, reading the input files
+       - The output files are ignored, since they may be left over from an earlier probe'''
+    import platform
+
+    dirs   = self.getDirectories(tmpDir, workspace)
+    tokens = command.split()
+    parts  = [self.version, platform.system(), platform.machine(), os.getcwd(), self.normalizeCommand(command, dirs)]
+    if tokens and not [dir for dir, placeholder in dirs if tokens[0].startswith(dir)]:
+      program = os.path.realpath(self.findProgram(tokens[0]))
+      parts.append(program+'='+self.getStat(program))
+    for var in self.environment:
+      parts.append(var+'='+os.environ.get(var, ''))
+    for filename in inputs:
+      if filename:
+        parts.append(self.getFileIdentity(filename, dirs))
+    # The command itself is ordered, so its paths are sorted to remove the include directory order
+    paths = [self.getFileIdentity(filename, dirs) for filename in self.getPaths(command) if not filename in outputs]
+    paths.sort()
+    parts.extend(paths)
+    return new_md5('\0'.join(parts)).hexdigest()
+
+  def getEntryName(self, key):
+    return os.path.join(self.directory, key[0:2], key)
+
+  def addProducer(self, filename, key):
+    self.producers[filename] = (key, self.getStat(filename))
+    return
+
+  def get(self, key, outputs, tmpDir, workspace = None):
+    '''Return (output, error, status) for a cached probe and restore its output files, or None'''
+    if not self.isReadable():
+      return None
+    name = self.getEntryName(key)
+    try:
+      f = file(name, 'rb')
+      entry = cPickle.load(f)
+      f.close()
+    except (IOError, OSError, EOFError, cPickle.UnpicklingError, ValueError):
+      self.misses += 1
+      return None
+    if not len(entry['artifacts']) == len(outputs):
+      self.misses += 1
+      return None
+    for filename, artifact in zip(outputs, entry['artifacts']):
+      if os.path.isfile(filename): os.remove(filename)
+      if artifact is None:
+        if filename in self.producers: del self.producers[filename]
+        continue
+      data, mode = artifact
+      f = file(filename, 'wb')
+      f.write(data)
+      f.close()
+      os.chmod(filename, mode)
+      self.addProducer(filename, key)
+    try:
+      os.utime(name, None)
+    except OSError:
+      pass
+    self.hits += 1
+    dirs = self.getDirectories(tmpDir, workspace)
+    return (self.denormalize(entry['output'], dirs), self.denormalize(entry['error'], dirs), entry['status'])
+
+  def put(self, key, output, error, status, outputs, tmpDir, workspace = None):
+    '''Store the result of a probe along with its output files'''
+    import tempfile
+
+    artifacts = []
+    for filename in outputs:
+      if os.path.isfile(filename):
+        f = file(filename, 'rb')
+        artifacts.append((f.read(), os.stat(filename).st_mode & 0777))
+        f.close()
+        self.addProducer(filename, key)
+      else:
+        artifacts.append(None)
+        if filename in self.producers: del self.producers[filename]
+    if not self.isWritable():
+      return
+    dirs   = self.getDirectories(tmpDir, workspace)
+    entry  = {'output': self.normalize(output, dirs), 'error': self.normalize(error, dirs), 'status': status, 'artifacts': artifacts}
+    name   = self.getEntryName(key)
+    try:
+      if not os.path.isdir(os.path.dirname(name)):
+        os.makedirs(os.path.dirname(name))
+    except OSError:
+      # Another configure may have created it
+      if not os.path.isdir(os.path.dirname(name)): return
+    fd, tmpName = tempfile.mkstemp(prefix = '.'+key, dir = os.path.dirname(name))
+    try:
+      f = os.fdopen(fd, 'wb')
+      cPickle.dump(entry, f, 2)
+      f.close()
+      os.rename(tmpName, name)
+    except (IOError, OSError):
+      if os.path.isfile(tmpName): os.remove(tmpName)
+      return
+    self.writes += 1
+    return
+
+  def evict(self):
+    '''Remove the least recently used entries until the cache is smaller than the maximum size'''
+    if not self.isWritable() or not os.path.isdir(self.directory):
+      return
+    entries = []
+    size    = 0
+    for dir in os.listdir(self.directory):
+      dir = os.path.join(self.directory, dir)
+      if not os.path.isdir(dir): continue
+      for name in os.listdir(dir):
+        name = os.path.join(dir, name)
+        try:
+          st = os.stat(name)
+        except OSError:
+          continue
+        entries.append((st.st_mtime, st.st_size, name))
+        size += st.st_size
+    if size <= self.maxSize:
+      return
+    entries.sort()
+    for mtime, entrySize, name in entries:
+      try:
+        os.remove(name)
+      except OSError:
+        pass
+      size -= entrySize
+      if size <= self.maxSize:
+        break
+    return
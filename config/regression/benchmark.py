@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+'''
+  Benchmarks configure on synthetic graphs of children and packages, using the stand-in toolchain
+in fakeToolchain.py, so that the cost of the framework itself can be followed from change to change.
+For each size, it writes a graph of that many children, along with a tenth as many packages, and
+runs configure on it in a separate process, reporting
+    - The total time, and the time spent before configure in building the graph
+    - The number and average time of the probes of each kind
+    - The framework overhead, which is the time of configure outside of the commands it runs, given
+      only with one job, since the commands of several jobs overlap
+    - The processor time and peak memory of the configure process, leaving out its commands and workers
+    - The time of getChild() for every child, outputHeader(), and the topological sort, after configure
+    - The scaling of each time with the number of children, as the exponent of a power law, where an
+      exponent near 2 is an O(N^2) regression
+
+  The results are appended, under a label, to a file holding one JSON record per line, and a
+later run can be compared against the last record with a given label:
+
+    benchmark.py -sizes=100,300,1000 -label=before
+    benchmark.py -sizes=100,300,1000 -label=after -compare=before
+
+Options, given as -name=value
+    sizes        The numbers of children, 100,300,1000 by default
+    packages     The number of packages per child, 0.1 by default
+    dependencies The number of earlier children required by each child, 3 by default
+    headers      The number of headers checked by each child, 2 by default
+    functions    The number of functions checked by each child, 2 by default
+    latency      The seconds slept by each compile, link, and preprocess, 0 by default
+    jobs         The number of configure jobs, 1 by default
+    results      The file of results, benchmark.json by default
+    label        The label of these results, the date by default
+    compare      The label of the results to compare with
+    keep         Keep the scratch directories when 1
+'''
+import user
+import nargs
+
+import os
+import sys
+import time
+
+nargs.setInteractive(0)
+
+class SyntheticGraph(object):
+  '''Writes the configure modules of a synthetic graph, along with the installations of its packages
+     - Child i requires some of the children before it, and one of the packages
+     - Package i depends on some of the enabled packages before it, and every fourth package is not enabled
+     - Half of the headers and functions checked by the children are missing, by the rules of the stand-in toolchain'''
+  childTemplate = """\
+import config.base
+
+class Configure(config.base.Configure):
+  def __init__(self, framework):
+    config.base.Configure.__init__(self, framework)
+    self.headerPrefix = ''
+    self.substPrefix  = ''
+    return
+
+  def setupDependencies(self, framework):
+    config.base.Configure.setupDependencies(self, framework)
+    self.compilers = framework.require('config.compilers', self)
+    self.children  = [framework.require(name, self) for name in %(requires)r]
+    return
+
+  def checkHeader(self, header):
+    if self.checkPreprocess('#include <'+header+'>\\n'):
+      self.addDefine('HAVE_'+header[:-2].upper(), 1)
+    return
+
+  def checkFunction(self, name):
+    if self.checkLink('char '+name+'();\\n', name+'();\\n'):
+      self.addDefine('HAVE_'+name.upper(), 1)
+    return
+
+  def configure(self):
+    for header in %(headers)r:
+      self.executeTest(self.checkHeader, [header])
+    for name in %(functions)r:
+      self.executeTest(self.checkFunction, [name])
+    self.addMakeMacro('%(name)s'.upper(), '%(name)s')
+    return
+"""
+  packageTemplate = """\
+import config.package
+
+class Configure(config.package.Package):
+  def __init__(self, framework):
+    config.package.Package.__init__(self, framework)
+    self.functions = ['%(name)s_init']
+    self.includes  = ['%(name)s.h']
+    self.liblist   = [['lib%(name)s.a']]
+    return
+
+  def setupDependencies(self, framework):
+    config.package.Package.setupDependencies(self, framework)
+    self.deps = [framework.require(name, self) for name in %(requires)r]
+    return
+"""
+
+  def __init__(self, directory, size, packages = 0.1, dependencies = 3, headers = 2, functions = 2, seed = 0):
+    import random
+
+    self.directory    = directory
+    self.size         = size
+    self.numPackages  = max(1, int(size*packages))
+    self.dependencies = dependencies
+    self.headers      = headers
+    self.functions    = functions
+    self.random       = random.Random(seed)
+    self.children     = ['benchchild%05d' % i for i in range(size)]
+    self.packages     = ['benchpkg%05d' % i for i in range(self.numPackages)]
+    self.enabled      = [name for i, name in enumerate(self.packages) if not i % 4 == 3]
+    return
+
+  def writeFile(self, filename, text):
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    f = file(filename, 'w')
+    f.write(text)
+    f.close()
+    return
+
+  def getSample(self, names, number):
+    return self.random.sample(names, min(number, len(names)))
+
+  def getCheckNames(self, prefix, number, suffix = ''):
+    names = []
+    for i in range(number):
+      if self.random.random() < 0.5:
+        names.append('benchmissing_'+prefix+'_'+str(i)+suffix)
+      else:
+        names.append('benchfound_'+prefix+'_'+str(i)+suffix)
+    return names
+
+  def write(self):
+    '''Write the modules, and return the arguments which enable the packages'''
+    moduleDir = os.path.join(self.directory, 'modules')
+    for i, name in enumerate(self.packages):
+      requires = []
+      if name in self.enabled:
+        requires = self.getSample([p for p in self.packages[:i] if p in self.enabled], 2)
+      self.writeFile(os.path.join(moduleDir, name+'.py'), self.packageTemplate % {'name': name, 'requires': requires})
+    for i, name in enumerate(self.children):
+      requires = self.getSample(self.children[:i], self.dependencies)+self.getSample(self.packages, 1)
+      self.writeFile(os.path.join(moduleDir, name+'.py'), self.childTemplate % {'name': name, 'requires': requires,
+                                                                                 'headers': self.getCheckNames(name, self.headers, '.h'),
+                                                                                 'functions': self.getCheckNames(name, self.functions)})
+    args = []
+    for name in self.enabled:
+      installDir = os.path.join(self.directory, 'packages', name)
+      self.writeFile(os.path.join(installDir, 'include', name+'.h'), 'int '+name+'_init();\n')
+      self.writeFile(os.path.join(installDir, 'lib', 'lib'+name+'.a'), 'provides '+name+'_init\n')
+      args.append('--with-'+name+'-dir='+installDir)
+    return args
+
+import config.framework
+
+class BenchmarkFramework(config.framework.Framework):
+  '''A Framework which keeps its profile and the time spent in building the graph'''
+  def __init__(self, *args, **kargs):
+    config.framework.Framework.__init__(self, *args, **kargs)
+    self.profile          = None
+    self.dependenciesTime = 0.0
+    return
+
+  def updateDependencies(self):
+    start = time.time()
+    config.framework.Framework.updateDependencies(self)
+    self.dependenciesTime += time.time() - start
+    return
+
+  def outputProfile(self, profile):
+    self.profile = profile
+    return config.framework.Framework.outputProfile(self, profile)
+
+def getResourceUsage():
+  '''Return the processor time in seconds and the peak resident memory in kilobytes of this process, or (None, None) when they are not available'''
+  try:
+    import resource
+  except ImportError:
+    return (None, None)
+  usage  = resource.getrusage(resource.RUSAGE_SELF)
+  maxRSS = usage.ru_maxrss
+  if sys.platform == 'darwin':
+    maxRSS = maxRSS/1024
+  return (usage.ru_utime + usage.ru_stime, maxRSS)
+
+def runConfigure(workDir):
+  '''Configure the graph written in workDir, and write the measurements to workDir/result.json
+     - This runs in a separate process for each size, so that the peak memory belongs to one configure'''
+  import cPickle
+  import graph
+  import logger
+
+  f = file(os.path.join(workDir, 'setup.pickle'))
+  setup = cPickle.load(f)
+  f.close()
+  sys.path.insert(0, os.path.join(workDir, 'modules'))
+  os.chdir(os.path.join(workDir, 'run'))
+  start     = time.time()
+  framework = BenchmarkFramework(clArgs = setup['args'], loadArgDB = 0)
+  framework.header          = 'bench_config.h'
+  framework.cHeader         = 'bench_fix.h'
+  framework.makeMacroHeader = 'bench_macros'
+  for name in setup['children']:
+    framework.require(name, None)
+  configureStart = time.time()
+  framework.configure(out = file(os.devnull, 'w'))
+  end = time.time()
+  profile = framework.profile
+  result  = {'children': len(setup['children']), 'vertices': len(framework.childGraph.vertices),
+             'total': end - start, 'configure': end - configureStart,
+             'dependencies': configureStart - start + framework.dependenciesTime}
+  commands = [entry for (category, name), entry in profile.frames.items() if category == 'command']
+  result['commands']    = sum([entry[0] for entry in commands])
+  result['commandTime'] = sum([entry[1] for entry in commands])
+  result['overhead']    = None
+  if setup['jobs'] == 1:
+    result['overhead']  = result['configure'] - result['commandTime']
+  result['probes']      = {}
+  for kind in profile.kinds:
+    if ('probe', kind) in profile.frames:
+      calls, inclusive, exclusive = profile.frames[('probe', kind)]
+      result['probes'][kind] = {'calls': calls, 'time': inclusive, 'average': inclusive/calls, 'commandTime': profile.commandTime.get(kind, 0.0)}
+  start = time.time()
+  for name in setup['children']:
+    framework.getChild(name)
+  result['getChild'] = time.time() - start
+  start = time.time()
+  framework.outputHeader(os.path.join(workDir, 'run', 'bench_output.h'))
+  result['outputHeader'] = time.time() - start
+  start = time.time()
+  list(graph.DirectedGraph.topologicalSort(framework.childGraph))
+  result['topologicalSort'] = time.time() - start
+  (result['cpu'], result['peakMemory']) = getResourceUsage()
+  f = file(os.path.join(workDir, 'result.json'), 'w')
+  f.write(logger.encodeJSON(result)+'\n')
+  f.close()
+  return
+
+class Benchmark(object):
+  '''Runs configure on synthetic graphs of each size, and reports, stores, and compares the results'''
+  # The measurements whose scaling with the number of children is reported
+  scaled = ['total', 'dependencies', 'overhead', 'cpu', 'getChild', 'outputHeader', 'topologicalSort']
+
+  def __init__(self, argv):
+    self.argv         = argv
+    self.sizes        = [int(size) for size in self.getArgument('sizes', '100,300,1000').split(',')]
+    self.packages     = float(self.getArgument('packages', 0.1))
+    self.dependencies = int(self.getArgument('dependencies', 3))
+    self.headers      = int(self.getArgument('headers', 2))
+    self.functions    = int(self.getArgument('functions', 2))
+    self.latency      = float(self.getArgument('latency', 0.0))
+    self.jobs         = int(self.getArgument('jobs', 1))
+    self.resultsName  = self.getArgument('results', 'benchmark.json')
+    self.label        = self.getArgument('label', time.strftime('%Y-%m-%d %H:%M:%S'))
+    self.compareLabel = self.getArgument('compare', None)
+    self.keep         = int(self.getArgument('keep', 0))
+    return
+
+  def getArgument(self, name, default):
+    value = nargs.Arg.findArgument(name, self.argv)
+    if value is None:
+      return default
+    return value
+
+  def writeToolchain(self, workDir):
+    '''Write the rules of the stand-in toolchain, and a script for each of its tools, returning the configure arguments which select them'''
+    f = file(os.path.join(workDir, 'rules'), 'w')
+    for operation in ['preprocess', 'compile', 'link']:
+      f.write('latency '+operation+' '+str(self.latency)+'\n')
+    f.write('missing-header benchmissing_*\nmissing-symbol benchmissing_*\nmissing-header benchpkg*\nmissing-symbol benchpkg*\n')
+    f.close()
+    fake = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakeToolchain.py')
+    args = []
+    for tool, option in [('cc', 'with-cc'), ('ar', 'with-ar'), ('ranlib', 'with-ranlib')]:
+      name = os.path.join(workDir, 'fake'+tool)
+      f = file(name, 'w')
+      f.write('#!/bin/sh\nexec '+sys.executable+' '+fake+' '+os.path.join(workDir, 'rules')+' '+tool+' "$@"\n')
+      f.close()
+      os.chmod(name, 0755)
+      args.append('--'+option+'='+name)
+    return args
+
+  def runSize(self, size):
+    '''Write and configure a graph with the given number of children, returning the measurements'''
+    import cPickle
+    import commandEngine
+    import json
+    import shutil
+    import tempfile
+
+    workDir = tempfile.mkdtemp(prefix = 'petsc-benchmark-')
+    try:
+      os.mkdir(os.path.join(workDir, 'run'))
+      synthetic = SyntheticGraph(workDir, size, self.packages, self.dependencies, self.headers, self.functions)
+      args  = ['--with-fc=0', '--with-cxx=0', '--with-cuda=0', '--with-mpi=0', '--with-shared-libraries=0', '--noOutput=1',
+               '--profile-configure=1', '--profile-configure-stacks='+os.path.join(workDir, 'configure.stacks'),
+               '--configure-jobs='+str(self.jobs)]
+      args += self.writeToolchain(workDir)+synthetic.write()
+      f = file(os.path.join(workDir, 'setup.pickle'), 'w')
+      cPickle.dump({'args': args, 'children': synthetic.children, 'jobs': self.jobs}, f)
+      f.close()
+      cmd = commandEngine.CommandEngine().run(None, [sys.executable, os.path.abspath(__file__), '-run='+workDir])
+      if cmd.status or not os.path.isfile(os.path.join(workDir, 'result.json')):
+        raise RuntimeError('Configure of '+str(size)+' children failed, see '+os.path.join(workDir, 'run', 'configure.log')+':\n'+cmd.output+cmd.error)
+      f = file(os.path.join(workDir, 'result.json'))
+      result = json.loads(f.read())
+      f.close()
+    finally:
+      if not self.keep and os.path.isfile(os.path.join(workDir, 'result.json')):
+        shutil.rmtree(workDir)
+    return result
+
+  def getScaling(self, results):
+    '''Return the exponent of the power law fitted by least squares to each measurement against the number of children'''
+    import math
+
+    scaling = {}
+    for name in self.scaled:
+      points = [result for result in results if result['children'] > 0 and not result.get(name) is None]
+      if len(points) < 2:
+        continue
+      data = [(math.log(result['children']), math.log(max(result[name], 1.0e-6))) for result in points]
+      xMean = sum([x for x, y in data])/len(data)
+      yMean = sum([y for x, y in data])/len(data)
+      xx    = sum([(x - xMean)**2 for x, y in data])
+      if xx > 0:
+        scaling[name] = sum([(x - xMean)*(y - yMean) for x, y in data])/xx
+    return scaling
+
+  def formatTime(self, value, precision = 3):
+    if value is None:
+      return '%9s' % '-'
+    return '%8.*fs' % (precision, value)
+
+  def getReport(self, results, scaling):
+    lines = ['%8s %9s %9s %9s %9s %9s %9s %9s %9s %9s %9s' % ('children', 'total', 'graph', 'overhead', 'cpu', 'commands', 'getChild', 'header', 'sort', 'probe', 'memory')]
+    for result in results:
+      probes = result['probes'].values()
+      calls  = sum([probe['calls'] for probe in probes])
+      if calls:
+        average = sum([probe['time'] for probe in probes])/calls
+      else:
+        average = 0.0
+      memory = result['peakMemory']
+      if memory is None:
+        memory = '-'
+      else:
+        memory = '%.1fM' % (memory/1024.0,)
+      lines.append(' '.join(['%8d' % result['children']]+[self.formatTime(result[name]) for name in ['total', 'dependencies', 'overhead', 'cpu']]+
+                            ['%9d' % result['commands']]+[self.formatTime(t, 4) for t in [result['getChild'], result['outputHeader'], result['topologicalSort'], average]]+
+                            ['%9s' % memory]))
+    if scaling:
+      lines.append('Scaling exponent with the number of children (1 is linear, 2 is quadratic):')
+      for name in self.scaled:
+        if name in scaling:
+          warning = ''
+          if scaling[name] > 1.5:
+            warning = '  <-- superlinear'
+          lines.append('  %-16s %5.2f%s' % (name, scaling[name], warning))
+    return '\n'.join(lines)
+
+  def loadResults(self, label):
+    '''Return the last record with the label in the results file, or None'''
+    import json
+
+    record = None
+    if os.path.isfile(self.resultsName):
+      f = file(self.resultsName)
+      for line in f.readlines():
+        if line.strip():
+          r = json.loads(line)
+          if r['label'] == label:
+            record = r
+      f.close()
+    return record
+
+  def storeResults(self, results, scaling):
+    import logger
+    import platform
+
+    record = {'label': self.label, 'time': time.time(), 'python': platform.python_version(), 'host': platform.node(),
+              'latency': self.latency, 'jobs': self.jobs, 'results': results, 'scaling': scaling}
+    f = file(self.resultsName, 'a')
+    f.write(logger.encodeJSON(record)+'\n')
+    f.close()
+    return
+
+  def getComparison(self, results, other):
+    '''Return the ratio of each time to that of the other record, for the sizes in both'''
+    lines = ['Compared with '+other['label']+' (ratio of new to old time):',
+             '%8s %9s %9s %9s %9s %9s %9s %9s' % ('children', 'total', 'graph', 'overhead', 'cpu', 'getChild', 'header', 'sort')]
+    old = dict([(result['children'], result) for result in other['results']])
+    for result in results:
+      if not result['children'] in old:
+        continue
+      ratios = []
+      for name in self.scaled:
+        if result.get(name) is None or old[result['children']].get(name) is None:
+          ratios.append('%9s' % '-')
+        else:
+          ratios.append('%8.2fx' % (result[name]/max(old[result['children']][name], 1.0e-6),))
+      lines.append(' '.join(['%8d' % result['children']]+ratios))
+    return '\n'.join(lines)
+
+  def run(self):
+    other = None
+    if self.compareLabel:
+      other = self.loadResults(self.compareLabel)
+      if other is None:
+        raise RuntimeError('No results labeled '+self.compareLabel+' in '+self.resultsName)
+    results = []
+    for size in self.sizes:
+      results.append(self.runSize(size))
+      print self.getReport(results[-1:], {}).split('\n')[1]
+      sys.stdout.flush()
+    scaling = self.getScaling(results)
+    print self.getReport(results, scaling)
+    self.storeResults(results, scaling)
+    print 'Stored the results labeled '+self.label+' in '+self.resultsName
+    if not other is None:
+      print self.getComparison(results, other)
+    return
+
+if __name__ == '__main__':
+  workDir = nargs.Arg.findArgument('run', sys.argv[1:])
+  if workDir is None:
+    Benchmark(sys.argv[1:]).run()
+  else:
+    runConfigure(workDir)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import user
+
+import os
+import unittest
+
+class BenchmarkTest (unittest.TestCase):
+  '''Tests the stand-in toolchain and the synthetic graphs of the configure benchmark'''
+  def setUp(self):
+    import tempfile
+
+    self.directory = tempfile.mkdtemp()
+    return
+
+  def tearDown(self):
+    import shutil
+
+    shutil.rmtree(self.directory)
+    return
+
+  def writeFile(self, name, text):
+    f = file(os.path.join(self.directory, name), 'w')
+    f.write(text)
+    f.close()
+    return os.path.join(self.directory, name)
+
+  def testFakeToolchain(self):
+    '''Verify that the stand-in toolchain fails on missing headers and symbols, unless an include directory or library provides them'''
+    import fakeToolchain
+    import sys
+
+    rules = fakeToolchain.Rules(self.writeFile('rules', 'latency compile 0\nmissing-header gone*.h\nmissing-symbol gone_*\n'))
+    def run(argv):
+      stderr = sys.stderr
+      sys.stderr = file(os.devnull, 'w')
+      try:
+        return fakeToolchain.Compiler(rules).run(argv)
+      finally:
+        sys.stderr = stderr
+    source = self.writeFile('conftest.c', '#include <stdio.h>\n#include <gone.h>\nint main() {gone_function(); return 0;}\n')
+    obj    = os.path.join(self.directory, 'conftest.o')
+    self.assertEquals(1, run(['-c', '-o', obj, source]))
+    os.mkdir(os.path.join(self.directory, 'include'))
+    self.writeFile(os.path.join('include', 'gone.h'), 'int gone_function();\n')
+    self.assertEquals(0, run(['-c', '-MMD', '-o', obj, '-I'+os.path.join(self.directory, 'include'), source]))
+    self.failUnless(os.path.isfile(os.path.join(self.directory, 'conftest.d')))
+    self.assertEquals(1, run(['-o', os.path.join(self.directory, 'conftest'), obj]))
+    self.writeFile('libgone.a', 'provides gone_function\n')
+    self.assertEquals(0, run(['-o', os.path.join(self.directory, 'conftest'), obj, '-L'+self.directory, '-lgone']))
+    self.assertEquals(0, os.system(os.path.join(self.directory, 'conftest')))
+    return
+
+  def testSyntheticGraph(self):
+    '''Verify that a synthetic graph is reproducible, only requires earlier children, and enables its packages'''
+    import benchmark
+
+    graph = benchmark.SyntheticGraph(self.directory, 20, packages = 0.2)
+    args  = graph.write()
+    self.assertEquals(['benchpkg%05d' % i for i in [0, 1, 2]], graph.enabled)
+    self.assertEquals(len(graph.enabled), len(args))
+    for i, name in enumerate(graph.children):
+      f = file(os.path.join(self.directory, 'modules', name+'.py'))
+      code = f.read()
+      f.close()
+      for other in graph.children[i:]:
+        self.failIf("'"+other+"'," in code or "'"+other+"']" in code)
+    other = benchmark.SyntheticGraph(os.path.join(self.directory, 'other'), 20, packages = 0.2)
+    other.write()
+    f = file(os.path.join(self.directory, 'modules', 'benchchild00019.py'))
+    code = f.read()
+    f.close()
+    self.assertEquals(code, file(os.path.join(self.directory, 'other', 'modules', 'benchchild00019.py')).read())
+    return
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+'''
+  A stand-in for a C compiler, linker, and archiver, used to benchmark configure without the cost or
+the variability of a real toolchain. It is called as
+
+    fakeToolchain.py <rules file> cc|ar|ranlib <arguments>
+
+and accepts the arguments of gcc and ar. Object files, libraries, and executables are text files:
+an object holds its source, an archive the sources of its objects, and an executable is a shell script
+which exits with status 0.
+
+  The rules file holds one rule per line, and blank lines and lines starting with # are ignored
+    latency <operation> <seconds>  Sleep before each preprocess, compile, link, archive, or run
+    missing-header <pattern>       Fail to include a header matching the pattern, unless it is in a -I directory
+    missing-symbol <pattern>       Fail to link a program using a symbol matching the pattern, unless a library
+                                   on the command line provides it
+Patterns are matched with fnmatch. Any other header or symbol is found. A library provides the
+symbols listed on its lines of the form
+
+    provides <symbol> <symbol> ...
+'''
+import fnmatch
+import os
+import re
+import sys
+import time
+
+class Rules(object):
+  def __init__(self, filename):
+    self.latency        = {}
+    self.missingHeaders = []
+    self.missingSymbols = []
+    f = file(filename)
+    for line in f.readlines():
+      words = line.split()
+      if not words or words[0].startswith('#'):
+        continue
+      if words[0] == 'latency':
+        self.latency[words[1]] = float(words[2])
+      elif words[0] == 'missing-header':
+        self.missingHeaders.append(words[1])
+      elif words[0] == 'missing-symbol':
+        self.missingSymbols.append(words[1])
+      else:
+        raise RuntimeError('Invalid rule in '+filename+': '+line)
+    f.close()
+    return
+
+  def wait(self, operation):
+    if self.latency.get(operation, 0.0) > 0.0:
+      time.sleep(self.latency[operation])
+    return
+
+  def isMissing(self, name, patterns):
+    return len([pattern for pattern in patterns if fnmatch.fnmatch(name, pattern)]) > 0
+
+class Compiler(object):
+  '''Plays the part of gcc, preprocessing, compiling, and linking according to the Rules'''
+  includeRE = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+  symbolRE  = re.compile(r'\b([A-Za-z_]\w*)\s*\(')
+  # The macros of gcc on a 64-bit little endian machine which describe the types, so that configure need not run programs to find them
+  predefined = [('__GNUC__', 4), ('__GNUC_MINOR__', 2), ('__STDC__', 1), ('__CHAR_BIT__', 8),
+                ('__ORDER_LITTLE_ENDIAN__', 1234), ('__ORDER_BIG_ENDIAN__', 4321), ('__BYTE_ORDER__', '__ORDER_LITTLE_ENDIAN__'),
+                ('__SIZEOF_SHORT__', 2), ('__SIZEOF_INT__', 4), ('__SIZEOF_LONG__', 8), ('__SIZEOF_LONG_LONG__', 8),
+                ('__SIZEOF_POINTER__', 8), ('__SIZEOF_FLOAT__', 4), ('__SIZEOF_DOUBLE__', 8), ('__SIZEOF_SIZE_T__', 8)]
+
+  def __init__(self, rules):
+    self.rules    = rules
+    self.output   = None
+    self.sources  = []
+    self.objects  = []
+    self.includes = []
+    self.libDirs  = []
+    self.libs     = []
+    self.mode     = 'link'
+    self.depFile  = 0
+    return
+
+  def parseArguments(self, argv):
+    i = 0
+    while i < len(argv):
+      arg = argv[i]
+      if arg in ['-o', '-I', '-L', '-MF']:
+        i  += 1
+        arg = arg+argv[i]
+      if arg == '-c':
+        self.mode = 'compile'
+      elif arg == '-E':
+        self.mode = 'preprocess'
+      elif arg in ['-MMD', '-MD']:
+        self.depFile = 1
+      elif arg.startswith('-o'):
+        self.output = arg[2:]
+      elif arg.startswith('-I'):
+        self.includes.append(arg[2:])
+      elif arg.startswith('-L'):
+        self.libDirs.append(arg[2:])
+      elif arg.startswith('-l'):
+        self.libs.append(arg[2:])
+      elif arg.startswith('-'):
+        pass
+      elif os.path.splitext(arg)[1] in ['.c', '.cc', '.cpp', '.cxx', '.C', '.h']:
+        self.sources.append(arg)
+      else:
+        self.objects.append(arg)
+      i += 1
+    return
+
+  def read(self, filename):
+    f = file(filename)
+    text = f.read()
+    f.close()
+    return text
+
+  def findHeader(self, header, sourceDir):
+    for d in [sourceDir]+self.includes:
+      if os.path.isfile(os.path.join(d, header)):
+        return os.path.join(d, header)
+    return None
+
+  def checkHeaders(self, source):
+    '''Return the error for the first missing header included by the source, following the headers found, or None'''
+    pending = [source]
+    seen    = {}
+    while pending:
+      filename = pending.pop()
+      if filename in seen:
+        continue
+      seen[filename] = 1
+      for header in self.includeRE.findall(self.read(filename)):
+        found = self.findHeader(header, os.path.dirname(filename))
+        if not found is None:
+          pending.append(found)
+        elif self.rules.isMissing(header, self.rules.missingHeaders):
+          return filename+':1: fatal error: '+header+': No such file or directory\n'
+    return None
+
+  def findLibrary(self, lib):
+    for d in self.libDirs:
+      for ext in ['.a', '.so']:
+        if os.path.isfile(os.path.join(d, 'lib'+lib+ext)):
+          return os.path.join(d, 'lib'+lib+ext)
+    return None
+
+  def checkSymbols(self, code):
+    '''Return the error for the first missing symbol used by the code, or None'''
+    provided = {}
+    libs     = [self.findLibrary(lib) for lib in self.libs]+[o for o in self.objects if os.path.splitext(o)[1] in ['.a', '.so']]
+    for lib in libs:
+      if not lib is None:
+        for line in self.read(lib).split('\n'):
+          if line.startswith('provides '):
+            for symbol in line.split()[1:]:
+              provided[symbol] = 1
+    for symbol in self.symbolRE.findall(code):
+      if not symbol in provided and self.rules.isMissing(symbol, self.rules.missingSymbols):
+        return 'undefined reference to `'+symbol+"'\ncollect2: error: ld returned 1 exit status\n"
+    return None
+
+  def write(self, filename, text, mode = None):
+    f = file(filename, 'w')
+    f.write(text)
+    f.close()
+    if not mode is None:
+      os.chmod(filename, mode)
+    return
+
+  def run(self, argv):
+    if '--version' in argv or '-v' in argv or '-V' in argv:
+      sys.stdout.write('fake (stand-in for gcc) 1.0\n')
+      return 0
+    self.parseArguments(argv)
+    if '-dM' in argv:
+      sys.stdout.write(''.join(['#define '+name+' '+str(value)+'\n' for name, value in self.predefined]))
+      return 0
+    self.rules.wait(self.mode)
+    for source in self.sources:
+      error = self.checkHeaders(source)
+      if not error is None:
+        sys.stderr.write(error)
+        return 1
+    if self.mode == 'preprocess':
+      for source in self.sources:
+        sys.stdout.write('# 1 "'+source+'"\n'+self.read(source))
+      return 0
+    code = ''.join([self.read(source) for source in self.sources+self.objects if os.path.isfile(source)])
+    if self.mode == 'compile':
+      if self.output is None:
+        self.output = os.path.splitext(os.path.basename(self.sources[0]))[0]+'.o'
+      self.write(self.output, code)
+      if self.depFile:
+        self.write(os.path.splitext(self.output)[0]+'.d', self.output+': '+' '.join(self.sources)+'\n')
+      return 0
+    error = self.checkSymbols(code)
+    if not error is None:
+      sys.stderr.write(error)
+      return 1
+    if self.output is None:
+      self.output = 'a.out'
+    script = '#!/bin/sh\n'
+    if self.rules.latency.get('run', 0.0) > 0.0:
+      script += 'sleep '+str(self.rules.latency['run'])+'\n'
+    self.write(self.output, script+'exit 0\n', 0755)
+    return 0
+
+def archive(rules, argv):
+  '''Plays the part of ar, where an archive holds the text of its objects'''
+  rules.wait('archive')
+  if not argv or argv[0] in ['--version', '-V']:
+    sys.stdout.write('fake ar 1.0\n')
+    return 0
+  if len(argv) < 2:
+    return 1
+  text = ''
+  for name in argv[2:]:
+    if not os.path.isfile(name):
+      sys.stderr.write('ar: '+name+': No such file or directory\n')
+      return 1
+    f = file(name)
+    text += f.read()
+    f.close()
+  f = file(argv[1], 'w')
+  f.write(text)
+  f.close()
+  return 0
+
+def main(argv):
+  rules = Rules(argv[0])
+  tool  = argv[1]
+  if tool == 'cc':
+    return Compiler(rules).run(argv[2:])
+  elif tool == 'ar':
+    return archive(rules, argv[2:])
+  elif tool == 'ranlib':
+    return 0
+  raise RuntimeError('Unknown tool '+tool)
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -51,6 +51,402 @@ class FrameworkTest (unittest.TestCase):
     self.failUnless(os.path.isfile(self.framework.logName))
     return
 
+  def testBufferedLog(self):
+    '''Verify that the log is written in blocks and on flush, and that indentation follows the tests'''
+    import logger
+    import tempfile
+
+    (fd, name) = tempfile.mkstemp()
+    os.close(fd)
+    log = logger.BufferedLog(name)
+    log.flushInterval = 1000
+    log.write('first\n')
+    self.assertEquals('', file(name).read())
+    log.bufferSize = 10
+    log.write('second\n')
+    self.assertEquals('first\nsecond\n', file(name).read())
+    log.write('third\n')
+    log.close()
+    self.assertEquals('first\nsecond\nthird\n', file(name).read())
+    os.remove(name)
+    self.framework.setup()
+    self.framework.out = None
+    self.framework.log = logger.BufferedLog(name)
+    self.framework.logPrint('outer')
+    class Test(object):
+      def test(self, framework):
+        framework.logPrint('inner')
+        return
+    self.framework.executeTest(Test().test, self.framework)
+    self.framework.log.close()
+    self.failUnless('\n'+self.framework.debugIndent+'inner\n' in file(name).read())
+    self.assertEquals(0, logger.Logger.indentLevel)
+    os.remove(name)
+    return
+
+  def testEventLog(self):
+    '''Verify that tests, commands, and defines are recorded as JSON events'''
+    import config.base
+    import logger
+    import json
+    import tempfile
+
+    (fd, name) = tempfile.mkstemp()
+    os.close(fd)
+    logger.Logger.defaultEvents = logger.BufferedLog(name)
+    try:
+      self.framework.setup()
+      mod = config.base.Configure(self.framework)
+      class Test(object):
+        def test(self, mod):
+          mod.addDefine('EVENT', 1)
+          mod.executeShellCommand(['printf', 'abc'], log = mod.framework.log)
+          return
+      mod.executeTest(Test().test, mod)
+      logger.Logger.defaultEvents.close()
+    finally:
+      logger.Logger.defaultEvents = None
+    events = [json.loads(line) for line in file(name).readlines()]
+    os.remove(name)
+    self.assertEquals(['test-start', 'define', 'command', 'test-end'], [event['event'] for event in events])
+    self.assertEquals('test', events[0]['function'])
+    self.assertEquals(('EVENT', '1'), (events[1]['name'], events[1]['value']))
+    self.assertEquals((['printf', 'abc'], 0, 3), (events[2]['argv'], events[2]['status'], events[2]['outputSize']))
+    self.assertEquals('ok', events[3]['status'])
+    return
+
+  def testProfiler(self):
+    '''Verify that the profile separates inclusive and exclusive time, and totals commands by probe kind'''
+    import commandEngine
+    import profiler
+    import tempfile
+
+    profile = profiler.Profiler()
+    profile.enter('child', 'config.a')
+    profile.enter('test', 'config.a.check')
+    profile.enter('probe', 'compile')
+    cmd = commandEngine.Command('cc -c x.c', ['/usr/bin/cc', '-c', 'x.c'])
+    cmd.started, cmd.finished = (10.0, 10.5)
+    profile.addCommand(cmd)
+    profile.leave()
+    profile.leave()
+    worker = profile.fork()
+    worker.record('test', 'config.a.other', 2.0)
+    profile.merge(worker.getRecords())
+    profile.leave()
+    self.assertEquals(0.5, profile.commandTime['compile'])
+    self.assertEquals([1, 0.5, 0.5], profile.stacks[('config.a', 'config.a.check', 'compile', 'cc')])
+    (calls, inclusive, exclusive) = profile.frames[('child', 'config.a')]
+    self.failUnless(inclusive > 0 and exclusive == 0.0)
+    self.assertEquals('config.a.other', profile.getSlowest('test', 1)[0][0])
+    name = tempfile.mktemp()
+    profile.writeStacks(name)
+    self.failUnless('config.a;config.a.other 2000000\n' in file(name).read())
+    os.remove(name)
+    return
+
+  def testPythonProfiler(self):
+    '''Verify that the Python profile attributes the time of each child, and writes the combined profile and summary'''
+    import profiler
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    name      = os.path.join(directory, 'python.prof')
+    profile   = profiler.PythonProfiler(name)
+    def run():
+      profiler.PythonProfiler.defaultProfiler.enterChild('config.child')
+      sum(range(1000))
+      profiler.PythonProfiler.defaultProfiler.leaveChild()
+      return 1
+    self.assertEquals(1, profile.run(run))
+    self.failUnless(profiler.PythonProfiler.defaultProfiler is None)
+    self.failUnless(os.path.isfile(os.path.join(name+'.d', 'config.child.pstats')))
+    self.failUnless(os.path.isfile(name))
+    self.failUnless('s  config.child\n' in file(name+'.txt').read())
+    shutil.rmtree(directory)
+    return
+
+  def testProbeHeader(self):
+    '''Verify that the probe header is only rewritten when a define changes, and matches the full header'''
+    import config.base
+    import time
+
+    mod = config.base.Configure(self.framework)
+    self.framework.addChild(mod)
+    self.framework.argDB['with-file-create-pause'] = 0
+    name = os.path.join(self.framework.tmpDir, 'confdefs.h')
+    full = os.path.join(self.framework.tmpDir, 'full', 'confdefs.h')
+    mod.addDefine('FIRST', 1)
+    self.framework.outputProbeHeader(name)
+    mtime = os.path.getmtime(name)
+    time.sleep(0.01)
+    self.framework.outputProbeHeader(name)
+    self.assertEquals(mtime, os.path.getmtime(name))
+    for define, value in [('SECOND', 2), ('FIRST', 3), ('THIRD', 0)]:
+      mod.addDefine(define, value)
+      self.framework.outputProbeHeader(name)
+      self.framework.outputHeader(full)
+      lines = file(name).readlines()
+      lines.sort()
+      fullLines = file(full).readlines()
+      fullLines.sort()
+      self.assertEquals(fullLines, lines)
+    mod.delDefine('SECOND')
+    self.framework.outputProbeHeader(name)
+    self.failIf('SECOND' in file(name).read())
+    self.framework.tmpDir = None
+    return
+
+  def testIntrospection(self):
+    '''Verify that one introspection program holds every query, and that the queries answered before a failure are kept'''
+    import config.introspection
+
+    introspection = config.introspection.Introspection(None)
+    introspection.addInclude(['#include <stdlib.h>', '#include <stdlib.h>'])
+    introspection.addQuery('sizeof-char', '  value = (long) sizeof(char);')
+    introspection.addQuery('answer', '  value = 42;')
+    introspection.addQuery('after', '  value = 1;')
+    (includes, body) = introspection.getCode()
+    self.assertEquals(1, includes.count('#include <stdlib.h>'))
+    self.assertEquals(3, body.count('fflush(stdout);'))
+    self.assertEquals({'sizeof-char': 1, 'answer': 42}, introspection.parseOutput('sizeof-char 1\nanswer 42\nAborted\nafter\n'))
+    return
+
+  def testIntrospectionObject(self):
+    '''Verify that constants and the byte order are read from the data of an object file'''
+    import config.introspection
+
+    introspection = config.introspection.Introspection(None)
+    introspection.addQuery('int-min', '', 'INT_MIN')
+    introspection.addByteOrderQuery('endian')
+    data = '\0\1'+introspection.tag+'int-min:-0000000002147483648@\0'+introspection.tag+'order\0\0\0\x04\x03\x02\x01\0\0\0\0'
+    self.assertEquals({'int-min': -2147483648, 'endian': 0}, introspection.parseObject(data))
+    self.assertEquals(1, introspection.getExtractionCode().count('petsc_introspection_order'))
+    return
+
+  def testIntrospectionCompiled(self):
+    '''Verify that the answers are read from an object built by the C compiler, with and without optimization and debugging'''
+    import config.base
+    import config.introspection
+    import shutil
+    import struct
+    import sys
+    import tempfile
+
+    compiler = os.environ.get('CC')
+    if not compiler:
+      for name in ['cc', 'gcc', 'clang']:
+        for dir in os.environ.get('PATH', '').split(os.path.pathsep):
+          if os.path.isfile(os.path.join(dir, name)):
+            compiler = name
+            break
+        if compiler:
+          break
+    if not compiler:
+      # No C compiler is available
+      return
+    introspection = config.introspection.Introspection(None)
+    introspection.addInclude('#include <limits.h>')
+    introspection.addQuery('sizeof-long', '', 'sizeof(long)')
+    introspection.addQuery('int-min', '', 'INT_MIN')
+    introspection.addByteOrderQuery('endian')
+    directory = tempfile.mkdtemp()
+    source    = os.path.join(directory, 'conftest.c')
+    f = file(source, 'w')
+    f.write(introspection.getExtractionCode())
+    f.close()
+    (fd, logName) = tempfile.mkstemp()
+    log = os.fdopen(fd, 'w')
+    try:
+      for flags in ['-O0', '-O2', '-O2 -g']:
+        obj = os.path.join(directory, 'conftest.o')
+        (output, error, status) = config.base.Configure.executeShellCommand(compiler+' '+flags+' -c -o '+obj+' '+source, log = log)
+        f = file(obj, 'rb')
+        data = f.read()
+        f.close()
+        self.assertEquals({'sizeof-long': struct.calcsize('l'), 'int-min': -2147483648, 'endian': int(sys.byteorder == 'big')}, introspection.parseObject(data))
+        os.remove(obj)
+    finally:
+      log.close()
+      os.remove(logName)
+      shutil.rmtree(directory)
+    return
+
+  def testBisectFlags(self):
+    '''Verify that flags tested together give the result of testing them in turn, with fewer tests'''
+    import config.setCompilers
+
+    mod    = config.setCompilers.Configure(self.framework)
+    flags  = ['-O', '-bad1', '-g', '-Wall', '-bad2', '-fPIC', '-W', '-pipe']
+    tested = []
+    added  = []
+    def check(flag):
+      tested.append(flag)
+      return flag.find('-bad') < 0
+    def accept(flags):
+      added.extend(flags)
+      return
+    self.assertEquals((['-O', '-g', '-Wall', '-fPIC', '-W', '-pipe'], ['-bad1', '-bad2']), mod.bisectFlags(flags, check, accept))
+    self.assertEquals(['-O', '-g', '-Wall', '-fPIC', '-W', '-pipe'], added)
+    self.failUnless(len(tested) < 2*len(flags))
+    tested = []
+    self.assertEquals((flags[0:1], []), mod.bisectFlags(flags[0:1], check))
+    self.assertEquals(1, len(tested))
+    return
+
+  def testLinkBatch(self):
+    '''Verify that probes linked together give the answers of linking them in turn, with fewer links'''
+    import config.functions
+    import config.libraries
+
+    mod   = config.functions.Configure(self.framework)
+    links = []
+    def checkLink(includes = '', body = '', cleanup = 1, codeBegin = None, codeEnd = None, shared = 0):
+      links.append(body)
+      return body.find('bad') < 0
+    mod.checkLink = checkLink
+    mod.pushLanguage('C')
+    probes = [('#include <string.h>', name+'();') for name in ['memcpy', 'strlen', 'bad', 'strcmp', 'memset', 'strchr', 'strrchr', 'memmove']]
+    serial = [checkLink(includes, body) for includes, body in probes]
+    links  = []
+    self.assertEquals(serial, mod.checkLinkBatch(probes))
+    self.failUnless(len(links) < len(probes))
+    (includes, body) = mod.getBatchCode(probes)
+    self.assertEquals(1, includes.count('#include <string.h>'))
+    self.assertEquals(probes[0], mod.getBatchCode(probes[0:1]))
+    links = []
+    self.assertEquals([], mod.checkLinkBatch([]))
+    self.assertEquals(0, len(links))
+    self.assertEquals([1], mod.checkLinkBatch(probes[0:1]))
+    self.assertEquals([0], mod.checkLinkBatch(probes[2:3]))
+    self.assertEquals(2, len(links))
+    self.framework.setup()
+    self.assertEquals([1, 0, 1], mod.checkFunctions(['memcpy', 'bad', 'strlen']))
+    self.failUnless('HAVE_MEMCPY' in mod.defines)
+    self.failUnless('HAVE_STRLEN' in mod.defines)
+    self.failIf('HAVE_BAD' in mod.defines)
+    libraries = config.libraries.Configure(self.framework)
+    libraries.setCompilers = self.framework.require('config.setCompilers', None)
+    libraries.setCompilers.LIBS = ''
+    libraries.checkLink = checkLink
+    libraries.pushLanguage('C')
+    links = []
+    self.failUnless(libraries.check('', ['memcpy', 'strlen', 'strcmp']))
+    self.failIf(libraries.check('', ['memcpy', 'bad']))
+    self.assertEquals(4, len(links))
+    # The library is defined when its first function links, as when the functions were linked in turn
+    self.failIf(libraries.check('foo', ['memcpy', 'strlen', 'bad']))
+    self.failUnless('HAVE_LIBFOO' in libraries.defines)
+    self.failIf(libraries.check('bar', ['bad', 'memcpy']))
+    self.failIf('HAVE_LIBBAR' in libraries.defines)
+    self.failUnless(libraries.check('baz', ['memcpy', 'strlen']))
+    self.failUnless('HAVE_LIBBAZ' in libraries.defines)
+    mod.popLanguage()
+    libraries.popLanguage()
+    return
+
+  def testPredefinedMacros(self):
+    '''Verify that checks are answered from the macros listed by the compiler, and otherwise fall back to running probes'''
+    import config.compilers
+    import config.toolchain
+    import config.types
+
+    defines = '''#define __GNUC__ 12
+#define __STDC_VERSION__ 201710L
+#define __STDC_HOSTED__ 1
+#define __SIZEOF_LONG__ 8
+#define __LONG_MAX__ 0x7fffffffffffffffL
+#define __INT_MAX__ 0x7fffffffL
+#define __WCHAR_MAX__ 2147483647U
+#define __SIZE_MAX__ 0xffffffffffffffffUL
+#define __CHAR_BIT__ __BITS__
+#define __BITS__ 8
+#define __ORDER_LITTLE_ENDIAN__ 1234
+#define __ORDER_BIG_ENDIAN__ 4321
+#define __BYTE_ORDER__ __ORDER_LITTLE_ENDIAN__
+#define __has_include(STR) __has_include__(STR)
+#define __MAX(a, b) ((a) > (b) ? (a) : (b))
+#define __EMPTY__
+#define __SELF__ __SELF__
+#define __CYCLE_A__ __CYCLE_B__
+#define __CYCLE_B__ __CYCLE_A__
+'''
+    class Profiles(object):
+      def getOutput(self, compiler, args, checkCommand = None, log = None, directory = None):
+        return (defines, '', 0)
+    probes = []
+    def stub(mod):
+      def getCompiler():
+        mod.compilerSource = os.path.join(self.framework.tmpDir, 'conftest.c')
+        return 'cc'
+      def outputRun(includes, body, cleanup = 1, defaultOutputArg = '', executor = None):
+        probes.append(body)
+        return ('4\n', 0)
+      mod.getCompiler      = getCompiler
+      mod.getCompilerFlags = lambda: ''
+      mod.outputRun        = outputRun
+      mod.pushLanguage('C')
+      return mod
+    self.framework.setup()
+    self.framework.argDB['with-predefined-macros'] = 1
+    defaultProfiles = config.toolchain.ToolchainProfiles.defaultProfiles
+    config.toolchain.ToolchainProfiles.defaultProfiles = Profiles()
+    try:
+      types = stub(config.types.Configure(self.framework))
+      macros = types.getPredefinedMacros()
+      self.assertEquals([], [name for name in macros if name.find('(') >= 0])
+      self.assertEquals(None, types.getPredefinedMacro('__has_include'))
+      self.assertEquals(None, types.getPredefinedMacro('__MAX'))
+      self.assertEquals('', types.getPredefinedMacro('__EMPTY__'))
+      self.assertEquals(None, types.getPredefinedInteger('__EMPTY__'))
+      # Macros defined in terms of themselves, as by -D in the flags, have no value
+      self.assertEquals(None, types.getPredefinedMacro('__SELF__'))
+      self.assertEquals(None, types.getPredefinedMacro('__CYCLE_A__'))
+      self.assertEquals(None, types.getPredefinedInteger('__CYCLE_B__'))
+      self.assertEquals(8, types.getPredefinedInteger('__CHAR_BIT__'))
+      self.assertEquals(2147483647, types.getPredefinedInteger('__INT_MAX__'))
+      self.assertEquals(2147483647, types.getPredefinedInteger('__WCHAR_MAX__'))
+      self.assertEquals(0xffffffffffffffffL, types.getPredefinedInteger('__SIZE_MAX__'))
+      self.assertEquals(201710, types.getPredefinedInteger('__STDC_VERSION__'))
+      self.failUnless(types.isGNUCompatible())
+      self.assertEquals('little', types.getPredefinedEndian())
+      self.assertEquals(8, types.getPredefinedSizeof('long'))
+      self.assertEquals(None, types.getPredefinedSizeof('int'))
+      types.checkSizeof('long')
+      self.assertEquals([], probes)
+      self.assertEquals(8, types.defines['SIZEOF_LONG'])
+      # A type without a predefined size is still run
+      types.checkSizeof('int')
+      self.assertEquals(1, len(probes))
+      self.assertEquals(4, types.defines['SIZEOF_INT'])
+      compilers = stub(config.compilers.Configure(self.framework))
+      self.assertEquals('restrict', compilers.getPredefinedRestrict())
+      defines = '#define __GNUC__ 4\n#define __INTEL_COMPILER 1900\n#define __CHAR_BIT__ __CHAR_BIT__\n#define __STDC_VERSION__ __STDC_VERSION__\n'
+      self.framework.predefinedMacros = {}
+      self.failIf(types.isGNUCompatible())
+      self.assertEquals(None, types.getPredefinedEndian())
+      self.assertEquals(None, compilers.getPredefinedRestrict())
+      self.assertEquals(None, types.getPredefinedInteger('__CHAR_BIT__'))
+      compiles = []
+      def checkCompile(includes = '', body = '', cleanup = 1, codeBegin = None, codeEnd = None):
+        compiles.append(body)
+        return 1
+      compilers.checkCompile = checkCompile
+      compilers.checkRestrict('C')
+      self.assertEquals(['float * restrict x;'], compiles)
+      self.assertEquals('restrict', compilers.cRestrict)
+      self.framework.predefinedMacros = {}
+      self.framework.argDB['with-predefined-macros'] = 0
+      self.assertEquals({}, types.getPredefinedMacros())
+      types.checkSizeof('long')
+      self.assertEquals(2, len(probes))
+      types.popLanguage()
+      compilers.popLanguage()
+    finally:
+      config.toolchain.ToolchainProfiles.defaultProfiles = defaultProfiles
+    return
+
   def testFullDefaultConfigure(self):
     '''Verify that a configure with all the default modules works correctly'''
     import config.base
@@ -59,7 +455,7 @@ class FrameworkTest (unittest.TestCase):
     self.framework.addChild(mod)
     for package in os.listdir(os.path.dirname(config.__file__)):
       (packageName, ext) = os.path.splitext(package)
-      if not packageName.startswith('.') and not packageName.startswith('#') and not packageName.endswith('-old') and ext == '.py' and not packageName in ['__init__', 'base', 'framework', 'autoconf']:
+      if not packageName.startswith('.') and not packageName.startswith('#') and not packageName.endswith('-old') and ext == '.py' and not packageName in ['__init__', 'base', 'framework', 'autoconf', 'scheduler', 'probeCache', 'toolchain', 'introspection']:
         packageObj = self.framework.require('config.'+packageName, mod)
     self.failUnless(self.framework.configure())
     return
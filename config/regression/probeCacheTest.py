@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import user
+
+import os
+import shutil
+import tempfile
+import unittest
+
+class ProbeCacheTest (unittest.TestCase):
+  '''Tests the persistent cache of configure probe results'''
+  def setUp(self):
+    self.tmpDir   = tempfile.mkdtemp(prefix = 'petsc-')
+    self.cacheDir = tempfile.mkdtemp(prefix = 'probes-')
+    return
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpDir)
+    shutil.rmtree(self.cacheDir)
+    return
+
+  def writeFile(self, name, contents):
+    f = file(os.path.join(self.tmpDir, name), 'w')
+    f.write(contents)
+    f.close()
+    return os.path.join(self.tmpDir, name)
+
+  def testRoundTrip(self):
+    '''Verify that a stored probe is found in another temporary directory, and restores its outputs'''
+    import config.probeCache
+
+    cache   = config.probeCache.ProbeCache(self.cacheDir)
+    source  = self.writeFile('conftest.c', 'int main() {return 0;}\n')
+    obj     = self.writeFile('conftest.o', 'object')
+    command = 'cc -c -o '+obj+' '+source
+    key     = cache.getKey(command, [], [obj], self.tmpDir)
+    cache.put(key, 'out '+self.tmpDir, '', 0, [obj], self.tmpDir)
+    shutil.rmtree(self.tmpDir)
+    self.tmpDir = tempfile.mkdtemp(prefix = 'petsc-')
+    source  = self.writeFile('conftest.c', 'int main() {return 0;}\n')
+    obj     = os.path.join(self.tmpDir, 'conftest.o')
+    command = 'cc -c -o '+obj+' '+source
+    self.assertEquals(key, cache.getKey(command, [], [obj], self.tmpDir))
+    self.assertEquals(('out '+self.tmpDir, '', 0), cache.get(key, [obj], self.tmpDir))
+    self.assertEquals('object', file(obj).read())
+    self.writeFile('conftest.c', 'int main() {return 1;}\n')
+    self.assertNotEquals(key, cache.getKey(command, [], [obj], self.tmpDir))
+    return
+
+  def testWorkspace(self):
+    '''Verify that the scratch directory of a probe does not change its key'''
+    import config.probeCache
+
+    cache = config.probeCache.ProbeCache(self.cacheDir)
+    keys  = []
+    for name in ['probe-1', 'probe-2']:
+      workspace = os.path.join(self.tmpDir, name)
+      os.mkdir(workspace)
+      source = os.path.join(workspace, 'conftest.c')
+      f = file(source, 'w')
+      f.write('#include "../confdefs.h"\nint main() {return 0;}\n')
+      f.close()
+      obj = os.path.join(workspace, 'conftest.o')
+      keys.append(cache.getKey('cc -c -o '+obj+' '+source, [], [obj], self.tmpDir, workspace))
+    self.assertEquals(keys[0], keys[1])
+    return
+
+  def testReadOnly(self):
+    '''Verify that a read only cache is never written'''
+    import config.probeCache
+
+    cache = config.probeCache.ProbeCache(self.cacheDir, 'read')
+    key   = cache.getKey('true', [], [], self.tmpDir)
+    cache.put(key, '', '', 0, [], self.tmpDir)
+    self.assertEquals(None, cache.get(key, [], self.tmpDir))
+    self.assertEquals([], os.listdir(self.cacheDir))
+    return
+
+  def testEviction(self):
+    '''Verify that the least recently used entries are evicted first'''
+    import config.probeCache
+    import time
+
+    cache = config.probeCache.ProbeCache(self.cacheDir, maxSize = 1)
+    keys  = [cache.getKey('echo '+str(i), [], [], self.tmpDir) for i in range(3)]
+    for i, key in enumerate(keys):
+      cache.put(key, 'x'*100, '', 0, [], self.tmpDir)
+      os.utime(cache.getEntryName(key), (time.time()+i, time.time()+i))
+    cache.maxSize = os.path.getsize(cache.getEntryName(keys[0]))*2
+    cache.evict()
+    self.failIf(os.path.exists(cache.getEntryName(keys[0])))
+    self.failUnless(os.path.exists(cache.getEntryName(keys[1])))
+    self.failUnless(os.path.exists(cache.getEntryName(keys[2])))
+    return
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+import user
+
+import os
+import unittest
+
+class RDictTest (unittest.TestCase):
+  '''Tests the persistence of RDict'''
+  def setUp(self):
+    import tempfile
+
+    self.cwd       = os.getcwd()
+    self.directory = tempfile.mkdtemp()
+    os.chdir(self.directory)
+    return
+
+  def tearDown(self):
+    import shutil
+
+    os.chdir(self.cwd)
+    shutil.rmtree(self.directory)
+    return
+
+  def getDict(self, readonly = False):
+    import RDict
+
+    return RDict.RDict(autoShutdown = 0, readonly = readonly)
+
+  def startParent(self, address, idleTimeout = None):
+    '''Start a dictionary in the directory parent with a server in another thread, and change to the directory child'''
+    import threading
+
+    os.mkdir('parent')
+    os.mkdir('child')
+    os.chdir('parent')
+    parentDB = self.getDict()
+    server   = parentDB.createServer(address)
+    thread   = threading.Thread(target = server.serve_forever, kwargs = {'idleTimeout': idleTimeout, 'pollInterval': 0.1})
+    thread.setDaemon(1)
+    thread.start()
+    os.chdir(os.path.join(self.directory, 'child'))
+    return (parentDB, server, thread)
+
+  def stopParent(self, parentDB, server, thread):
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    parentDB.shutdown()
+    return
+
+  def testJournal(self):
+    '''Verify that changes are appended to the journal, replayed on load up to a torn record, and compacted into the snapshot'''
+    import nargs
+
+    argDB = self.getDict()
+    argDB['a'] = 1
+    argDB['b'] = 'two'
+    argDB.setType('c', nargs.ArgInt(None, 3, 'Three'))
+    argDB.setType('temp', nargs.Arg(None, 4, 'Temporary', isTemporary = 1))
+    del argDB['b']
+    self.failIf(os.path.exists('RDict.db'))
+    journalSize = os.path.getsize('RDict.db.journal')
+    argDB.shutdown()
+    argDB = self.getDict()
+    self.assertEquals(['a', 'c'], sorted(argDB.keys()))
+    self.assertEquals(1, argDB['a'])
+    self.assertEquals(3, argDB['c'])
+    # A record cut short by a crash is discarded
+    f = file('RDict.db.journal', 'ab')
+    f.write('\0\0\0\x40\0\0')
+    f.close()
+    argDB = self.getDict(readonly = True)
+    self.assertEquals(['a', 'c'], sorted(argDB.keys()))
+    self.assertEquals(journalSize + 6, os.path.getsize('RDict.db.journal'))
+    argDB = self.getDict()
+    self.assertEquals(journalSize, os.path.getsize('RDict.db.journal'))
+    argDB.compactSize = 0
+    argDB['d'] = 'x'*1000
+    self.failUnless(os.path.exists('RDict.db'))
+    self.assertEquals(0, os.path.getsize('RDict.db.journal'))
+    argDB['a'] = 5
+    argDB.shutdown()
+    argDB = self.getDict()
+    self.assertEquals(['a', 'c', 'd'], sorted(argDB.keys()))
+    self.assertEquals(5, argDB['a'])
+    return
+
+  def testLazySnapshot(self):
+    '''Verify that entries of the snapshot are only unpickled when used, and that an earlier pickled dictionary still loads'''
+    import RDict
+    import cPickle
+    import nargs
+
+    argDB = self.getDict()
+    argDB['configureCache'] = 'x'*(1024*1024)
+    argDB['small'] = 1
+    argDB.setType('unset', nargs.Arg(None, None, 'Unset'))
+    argDB.save(force = 1)
+    argDB.shutdown()
+    argDB = self.getDict()
+    for key in ['configureCache', 'small', 'unset']:
+      self.failUnless(isinstance(dict.__getitem__(argDB, key), RDict.LazyArg))
+    self.assertEquals(['configureCache', 'small'], sorted(argDB.keys()))
+    self.assertEquals(1, argDB['small'])
+    self.failIf(isinstance(dict.__getitem__(argDB, 'small'), RDict.LazyArg))
+    self.failUnless(isinstance(dict.__getitem__(argDB, 'configureCache'), RDict.LazyArg))
+    self.assertEquals(1, cPickle.loads(cPickle.dumps(dict(argDB.localitems())))['small'].getValue())
+    argDB['small'] = 2
+    argDB.save(force = 1)
+    argDB.shutdown()
+    argDB = self.getDict()
+    self.assertEquals(2, argDB['small'])
+    self.assertEquals(1024*1024, len(argDB['configureCache']))
+    argDB.shutdown()
+    f = file('RDict.db', 'wb')
+    cPickle.dump({'old': nargs.Arg('old', 'value')}, f)
+    f.close()
+    argDB = self.getDict()
+    self.assertEquals(['old'], argDB.keys())
+    self.assertEquals('value', argDB['old'])
+    return
+
+  def testProtocol(self):
+    '''Verify that a child reaches its parent through single, batched, and posted requests, and receives the exceptions of the parent'''
+    import RDict
+    import nargs
+
+    (parentDB, server, thread) = self.startParent(('localhost', 0))
+    argDB = RDict.RDict(parentAddr = server.server_address, autoShutdown = 0)
+    try:
+      parentDB['x'] = 1
+      parentDB.setType('n', nargs.ArgInt(None, 2, 'Integer'))
+      self.assertEquals(1, argDB['x'])
+      self.failUnless('n' in argDB)
+      self.failIf('missing' in argDB)
+      argDB['x'] = 3
+      self.assertEquals(3, parentDB['x'])
+      argDB.update({'a': 'A', 'b': 'B'})
+      self.assertEquals(['A', 'B', 3, 2], argDB.getMany(['a', 'b', 'x', 'n']))
+      self.assertEquals(['a', 'b', 'n', 'x'], sorted(argDB.keys()))
+      self.assertEquals(4, len(argDB))
+      self.assertRaises(TypeError, argDB.__setitem__, 'n', 'two')
+      argDB.post('__setitem__', ('n', 5))
+      argDB.post('__setitem__', ('n', 'five'))
+      self.assertEquals(5, argDB['n'])
+      del argDB['a']
+      self.failIf(parentDB.hasType('a'))
+      self.assertEquals(0, dict.__len__(argDB))
+    finally:
+      argDB.shutdown()
+      self.stopParent(parentDB, server, thread)
+    return
+
+  def testCache(self):
+    '''Verify that a child reads entries of its parent from its cache until a change in the parent invalidates them'''
+    import RDict
+
+    (parentDB, server, thread) = self.startParent(('localhost', 0))
+    argDB = RDict.RDict(parentAddr = server.server_address, autoShutdown = 0)
+    other = RDict.RDict(parentAddr = server.server_address, autoShutdown = 0)
+    requests = []
+    request  = argDB.request
+    def countRequests(r):
+      requests.append(r)
+      return request(r)
+    argDB.request = countRequests
+    try:
+      parentDB['x'] = 1
+      self.assertEquals(1, argDB['x'])
+      self.failIf('y' in argDB)
+      self.assertEquals(2, len(requests))
+      for i in range(10):
+        self.assertEquals(1, argDB['x'])
+        self.failIf('y' in argDB)
+      self.assertEquals(2, len(requests))
+      parentDB['x'] = 2
+      self.assertEquals(2, argDB['x'])
+      other['y'] = 'why'
+      self.assertEquals('why', argDB['y'])
+      argDB['x'] = 3
+      self.assertEquals(3, other['x'])
+      self.assertEquals(3, argDB['x'])
+      del other['y']
+      self.failIf('y' in argDB)
+    finally:
+      argDB.shutdown()
+      other.shutdown()
+      self.stopParent(parentDB, server, thread)
+    return
+
+  def testServer(self):
+    '''Verify that a server on a Unix domain socket answers many children from one thread, and exits once idle'''
+    import RDict
+    import time
+
+    (parentDB, server, thread) = self.startParent(os.path.join(self.directory, 'parent', 'RDict.sock'), idleTimeout = 2)
+    children = []
+    try:
+      parentDB['shared'] = 'value'
+      for i in range(50):
+        children.append(RDict.RDict(parentAddr = server.server_address, autoShutdown = 0))
+      for i, child in enumerate(children):
+        child['child'+str(i)] = i
+      for i, child in enumerate(children):
+        self.assertEquals(['value', i], child.getMany(['shared', 'child'+str(i)]))
+      self.assertEquals(50, len(server.connections))
+      self.assertEquals(range(50), [parentDB['child'+str(i)] for i in range(50)])
+    finally:
+      for child in children:
+        child.shutdown()
+    start = time.time()
+    thread.join(10)
+    self.failIf(thread.isAlive())
+    self.failUnless(time.time() - start > 1)
+    self.stopParent(parentDB, server, thread)
+    self.failIf(os.path.exists(server.server_address))
+    return
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import user
+import nargs
+import config.base
+
+import os
+import unittest
+
+nargs.setInteractive(0)
+
+class Child(config.base.Configure):
+  '''A configure object which combines the results of the children it requires'''
+  def __init__(self, framework, name, requires = []):
+    config.base.Configure.__init__(self, framework)
+    self.headerPrefix = ''
+    self.name         = name
+    self.requires     = requires
+    return
+
+  def configure(self):
+    if self.name == 'fail':
+      raise RuntimeError('Configure failure in '+self.name)
+    self.value = self.name+''.join([child.value for child in self.requires])
+    for i in range(20):
+      self.addDefine(self.name.upper()+'_'+str(i), i)
+    self.addMakeMacro(self.name.upper()+'_VALUE', self.value)
+    self.framework.addDefine('HAVE_'+self.name.upper(), 1)
+    self.framework.packages.append(self)
+    return
+
+class SchedulerTest (unittest.TestCase):
+  '''Tests parallel configuration of the Framework children'''
+  def tearDown(self):
+    import logger
+
+    for f in ['RDict.db', 'RDict.db.journal', 'RDict.log', 'scheduler.log', 'scheduler.log.bkp', 'scheduler.h', 'schedulerMacros']:
+      if os.path.exists(f):
+        os.remove(f)
+    if not logger.Logger.defaultLog is None:
+      logger.Logger.defaultLog.close()
+      logger.Logger.defaultLog = None
+    return
+
+  def runConfigure(self, jobs, names):
+    import config.framework
+    import logger
+
+    if not logger.Logger.defaultLog is None:
+      logger.Logger.defaultLog.close()
+      logger.Logger.defaultLog = None
+    framework = config.framework.Framework(clArgs = ['--configure-jobs='+str(jobs), '--noOutput=1'], loadArgDB = 0)
+    framework.logName         = 'scheduler.log'
+    framework.header          = 'scheduler.h'
+    framework.cHeader         = ''
+    framework.makeMacroHeader = 'schedulerMacros'
+    children = {}
+    for name, requires in names:
+      children[name] = Child(framework, name, [children[r] for r in requires])
+      framework.childGraph.addVertex(children[name])
+      for r in requires:
+        framework.childGraph.addEdges(children[name], [children[r]])
+    framework.configure()
+    output = [file(f).read() for f in [framework.header, framework.makeMacroHeader]]
+    return (output, [child.name for child in framework.packages], framework)
+
+  def testParallelOutput(self):
+    '''Verify that a parallel configure produces the same output as a serial configure'''
+    names = [('a', []), ('b', ['a']), ('c', ['a']), ('d', []), ('e', ['b', 'c', 'd'])]
+    serial   = self.runConfigure(1, names)
+    parallel = self.runConfigure(3, names)
+    self.assertEquals(serial[0], parallel[0])
+    self.assertEquals(serial[1], parallel[1])
+    self.assertEquals('ebacad', [child for child in parallel[2].childGraph.vertices if child.name == 'e'][0].value)
+    return
+
+  def testParallelFailure(self):
+    '''Verify that a failure in a worker is raised in the parent'''
+    self.assertRaises(RuntimeError, self.runConfigure, 2, [('a', []), ('fail', ['a']), ('c', [])])
+    return
+
+  def testLazyArguments(self):
+    '''Verify that a worker snapshots the arguments without unpickling the unused entries of the RDict snapshot'''
+    import RDict
+    import config.scheduler
+
+    argDB = RDict.RDict(autoShutdown = 0)
+    argDB['configureCache'] = 'x'*(1024*1024)
+    argDB['checkpoint']     = 'y'
+    argDB['small']          = 1
+    argDB.save(force = 1)
+    argDB.shutdown()
+    class Framework(object):
+      pass
+    framework       = Framework()
+    framework.argDB = RDict.RDict(autoShutdown = 0)
+    framework.log   = None
+    scheduler     = config.scheduler.Scheduler(framework)
+    scheduler.ids = {}
+    try:
+      before = scheduler.snapshotArguments()
+      self.assertEquals(1, framework.argDB['small'])
+      dict.__setitem__(framework.argDB, 'checkpoint', nargs.Arg('checkpoint', 'z'))
+      (changed, removed) = scheduler.diffArguments(before)
+      self.assertEquals(['checkpoint', 'small'], sorted([key for key, value in changed]))
+      self.assertEquals([], removed)
+      self.assertEquals('z', scheduler.loads(dict(changed)['checkpoint']).getValue())
+      self.failUnless(isinstance(dict.__getitem__(framework.argDB, 'configureCache'), RDict.LazyArg))
+    finally:
+      framework.argDB.shutdown()
+    return
+
+if __name__ == '__main__':
+  unittest.main()
@@ -20,5 +20,168 @@ class ShellTest (unittest.TestCase):
     self.assertEquals(0, config.base.Configure.executeShellCommand('sleep '+str(timeout), timeout = timeout+1)[2])
     return
 
+  def testArgv(self):
+    '''Verify that commands are executed without the shell when they can be, and otherwise by the shell'''
+    import config.base
+    import os
+    import shlex
+    import tempfile
+
+    Configure = config.base.Configure
+    self.assertEquals(['cc', '-DX="a b"', 'a b.c'], Configure.getArgv('cc -DX=\'"a b"\' "a b.c"'))
+    for command in ['ls | wc', 'cd / && ls', 'echo *', 'echo x', 'X=1 env', 'cc $CFLAGS']:
+      self.assertEquals(None, Configure.getArgv(command))
+    argv = ['printf', '%s|', "it's", '', 'a b']
+    self.assertEquals(argv, shlex.split(Configure.formatArgv(argv)))
+    (fd, logName) = tempfile.mkstemp()
+    log = os.fdopen(fd, 'w')
+    try:
+      self.assertEquals("it's||a b|", Configure.executeShellCommand(argv, log = log)[0])
+      self.assertEquals('1', Configure.executeShellCommand('printf 1 | cat', log = log)[0])
+      (output, error, status) = Configure.executeShellCommand('petsc-no-such-program', checkCommand = lambda command, status, output, error: None, log = log)
+      self.assertEquals(127, os.WEXITSTATUS(status))
+    finally:
+      log.close()
+      os.remove(logName)
+    return
+
+  def testEngine(self):
+    '''Verify that commands run concurrently up to the job limit, and that a timeout kills the process group'''
+    import commandEngine
+    import os
+    import tempfile
+    import time
+
+    engine   = commandEngine.CommandEngine(jobs = 2)
+    start    = time.time()
+    commands = [engine.submit('sleep 1', ['sleep', '1']) for i in range(4)]
+    self.assertEquals(2, len(engine.running))
+    engine.waitAll(commands)
+    self.failUnless(time.time() - start < 3)
+    self.assertEquals([0, 0, 0, 0], [command.status for command in commands])
+    marker  = tempfile.mktemp()
+    command = engine.run('(sleep 2; touch '+marker+') & wait', timeout = 1)
+    self.failUnless(command.timedOut)
+    self.assertEquals(-1, command.status)
+    self.assertEquals([], engine.running)
+    time.sleep(1.5)
+    self.failIf(os.path.exists(marker))
+    def work(fd):
+      os.write(fd, 'done')
+      return
+    worker = engine.submitFunction(work)
+    engine.waitAll([worker])
+    self.assertEquals(('done', '', 0), worker.getResult())
+    return
+
+  def testAbortBothStreams(self):
+    '''Verify that a command printing the abort text on both output and error is killed once, without losing the engine'''
+    import commandEngine
+    import time
+
+    engine = commandEngine.CommandEngine()
+    for i in range(5):
+      start   = time.time()
+      # The sleep lets both streams become readable before the engine reads either
+      command = engine.submit('abort', ['sh', '-c', 'echo password: ; echo password: 1>&2; sleep 2'], abortText = 'password:')
+      time.sleep(0.2)
+      engine.waitAll([command])
+      self.failUnless(command.aborted)
+      self.failUnless(time.time() - start < 2)
+      self.assertEquals({}, engine.fds)
+    return
+
+  def testOutputBuffer(self):
+    '''Verify that bounded output keeps the first and last lines however it arrives, and counts the omitted lines'''
+    import commandEngine
+
+    for chunks in [['1\n2\n3\n4\n5\n6'], ['1', '\n2\n', '3\n4', '\n5\n6'], list('1\n2\n3\n4\n5\n6')]:
+      buffer = commandEngine.OutputBuffer(headLines = 2, tailLines = 2)
+      for chunk in chunks:
+        buffer.write(chunk)
+      self.assertEquals('1\n2\n[... 2 lines omitted ...]\n5\n6', buffer.getvalue())
+      self.assertEquals(11, buffer.size)
+    buffer = commandEngine.OutputBuffer(headLines = 5, tailLines = 5)
+    buffer.write('1\n2\n')
+    self.assertEquals('1\n2\n', buffer.getvalue())
+    return
+
+  def testResourceUsage(self):
+    '''Verify that the resources used by a command are charged to the innermost account'''
+    import commandEngine
+
+    ResourceUsage = commandEngine.ResourceUsage
+    accounts      = ResourceUsage.accounts
+    ResourceUsage.accounts = {}
+    try:
+      ResourceUsage.enter('outer')
+      ResourceUsage.enter('inner')
+      command = commandEngine.CommandEngine().run('i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done')
+      ResourceUsage.charge(command)
+      ResourceUsage.leave()
+      ResourceUsage.leave()
+      self.failUnless(command.usage['user'] + command.usage['system'] > 0)
+      self.failUnless(command.usage['maxRSS'] > 0)
+      self.assertEquals(['inner'], ResourceUsage.accounts.keys())
+      ResourceUsage.mergeAccounts(ResourceUsage.getAccounts())
+      self.assertEquals(2, ResourceUsage.accounts['inner'].commands)
+    finally:
+      ResourceUsage.accounts = accounts
+    return
+
+  def testRecorder(self):
+    '''Verify that a recorded command is replayed in another temporary directory, with the files it wrote, and that a changed input is not replayed, naming a changed environment'''
+    import commandRecorder
+    import config.base
+    import os
+    import shutil
+    import tempfile
+
+    CommandRecorder = commandRecorder.CommandRecorder
+    recording = tempfile.mkdtemp()
+    dirs      = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+    for d in dirs:
+      f = file(os.path.join(d, 'conftest.c'), 'w')
+      f.write('int main() {return 0;}\n')
+      f.close()
+    (fd, logName) = tempfile.mkstemp()
+    log = os.fdopen(fd, 'w')
+    cflags = os.environ.get('CFLAGS')
+    def run(d):
+      return config.base.Configure.executeShellCommand('cp '+os.path.join(d, 'conftest.c')+' '+os.path.join(d, 'conftest.o')+' && echo '+d, log = log)
+    try:
+      CommandRecorder.defaultRecorder = CommandRecorder(recording, 'record')
+      CommandRecorder.defaultRecorder.addDirectory(dirs[0])
+      self.assertEquals((dirs[0]+'\n', '', 0), run(dirs[0]))
+      self.assertEquals(1, CommandRecorder.defaultRecorder.recorded)
+      os.remove(os.path.join(dirs[0], 'conftest.c'))
+      CommandRecorder.defaultRecorder = CommandRecorder(recording, 'replay')
+      CommandRecorder.defaultRecorder.addDirectory(dirs[1])
+      self.assertEquals((dirs[1]+'\n', '', 0), run(dirs[1]))
+      self.assertEquals('int main() {return 0;}\n', file(os.path.join(dirs[1], 'conftest.o')).read())
+      f = file(os.path.join(dirs[1], 'conftest.c'), 'w')
+      f.write('int main() {return 1;}\n')
+      f.close()
+      self.assertRaises(RuntimeError, run, dirs[1])
+      # A miss names the variables which differ from the recording
+      os.environ['CFLAGS'] = str(cflags)+' -changed'
+      try:
+        run(dirs[1])
+        self.fail('A command not recorded was replayed')
+      except RuntimeError, e:
+        self.failUnless(str(e).find('CFLAGS was') >= 0)
+      self.assertRaises(RuntimeError, CommandRecorder(dirs[0], 'replay').loadEnvironment)
+    finally:
+      if cflags is None:
+        if 'CFLAGS' in os.environ: del os.environ['CFLAGS']
+      else:
+        os.environ['CFLAGS'] = cflags
+      CommandRecorder.defaultRecorder = None
+      log.close()
+      os.remove(logName)
+      for d in [recording]+dirs:
+        shutil.rmtree(d)
+    return
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import user
+
+import os
+import shutil
+import tempfile
+import unittest
+
+class ToolchainTest (unittest.TestCase):
+  '''Tests the profiles of compiler information commands'''
+  def setUp(self):
+    self.tmpDir   = tempfile.mkdtemp(prefix = 'petsc-')
+    self.cacheDir = tempfile.mkdtemp(prefix = 'probes-')
+    self.compiler = os.path.join(self.tmpDir, 'cc')
+    self.log      = file(os.path.join(self.tmpDir, 'toolchain.log'), 'w')
+    self.writeCompiler('echo run >> '+os.path.join(self.tmpDir, 'runs')+'\necho "$@"\n')
+    return
+
+  def tearDown(self):
+    self.log.close()
+    shutil.rmtree(self.tmpDir)
+    shutil.rmtree(self.cacheDir)
+    return
+
+  def writeCompiler(self, contents):
+    f = file(self.compiler, 'w')
+    f.write('#!/bin/sh\n'+contents)
+    f.close()
+    os.chmod(self.compiler, 0755)
+    return
+
+  def getRuns(self):
+    name = os.path.join(self.tmpDir, 'runs')
+    if not os.path.isfile(name):
+      return 0
+    return len(file(name).readlines())
+
+  def testStoredOutput(self):
+    '''Verify that a command is run once, and its profile is found by another configure'''
+    import config.toolchain
+
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    self.assertEquals('--help\n', profiles.getOutput(self.compiler, '--help', log = self.log)[0])
+    self.assertEquals('--help\n', profiles.getOutput(self.compiler, '--help', log = self.log)[0])
+    self.assertEquals(1, self.getRuns())
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    self.assertEquals('--help\n', profiles.getOutput(self.compiler, '--help', log = self.log)[0])
+    self.assertEquals(1, self.getRuns())
+    return
+
+  def testInvalidation(self):
+    '''Verify that changing the compiler invalidates its profile'''
+    import config.toolchain
+
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    profiles.getOutput(self.compiler, '-V', log = self.log)
+    self.writeCompiler('echo run >> '+os.path.join(self.tmpDir, 'runs')+'\necho version "$@"\n')
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    self.assertEquals('version -V\n', profiles.getOutput(self.compiler, '-V', log = self.log)[0])
+    self.assertEquals(2, self.getRuns())
+    return
+
+  def testStoredFailure(self):
+    '''Verify that a recorded failure raises just as the command did'''
+    import config.toolchain
+
+    self.writeCompiler('echo run >> '+os.path.join(self.tmpDir, 'runs')+'\nexit 1\n')
+    profiles = config.toolchain.ToolchainProfiles()
+    for i in range(2):
+      self.assertRaises(RuntimeError, profiles.getOutput, self.compiler, '--help', log = self.log)
+    self.failUnless(profiles.getOutput(self.compiler, '--help', checkCommand = config.toolchain.noCheck, log = self.log)[2])
+    self.assertEquals(1, self.getRuns())
+    return
+
+  def testWrapper(self):
+    '''Verify that the profile of a wrapper follows the compiler it shows, that a wrapper which shows nothing is not stored, and that PATH is part of the key'''
+    import config.toolchain
+
+    wrapper = os.path.join(self.tmpDir, 'mpicc')
+    target  = os.path.join(self.tmpDir, 'target')
+    other   = os.path.join(self.tmpDir, 'other')
+    for name in [wrapper, other]:
+      f = file(name, 'w')
+      f.write('#!/bin/sh\nif [ "$1" = -show ]; then echo `cat '+target+'` -lmpi; exit 0; fi\necho run >> '+os.path.join(self.tmpDir, 'runs')+'\necho "$@"\n')
+      f.close()
+      os.chmod(name, 0755)
+    f = file(target, 'w')
+    f.write(self.compiler)
+    f.close()
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    profiles.getOutput(wrapper, '--version', log = self.log)
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    profiles.getOutput(wrapper, '--version', log = self.log)
+    self.assertEquals(1, self.getRuns())
+    # The wrapper now invokes another compiler, as after loading a different module
+    f = file(target, 'w')
+    f.write(other)
+    f.close()
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    profiles.getOutput(wrapper, '--version', log = self.log)
+    self.assertEquals(2, self.getRuns())
+    path = os.environ.get('PATH', '')
+    try:
+      os.environ['PATH'] = self.tmpDir+os.path.pathsep+path
+      profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+      profiles.getOutput(wrapper, '--version', log = self.log)
+      self.assertEquals(3, self.getRuns())
+    finally:
+      os.environ['PATH'] = path
+    # A launcher is fingerprinted along with the compiler it runs
+    profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+    self.failIf(profiles.getFingerprint(other+' '+self.compiler, self.log) == profiles.getFingerprint(other+' '+wrapper, self.log))
+    os.remove(target)
+    for i in range(2):
+      profiles = config.toolchain.ToolchainProfiles(self.cacheDir, 'readwrite')
+      self.assertEquals(None, profiles.getFingerprint(wrapper, self.log))
+      profiles.getOutput(wrapper, '--version', log = self.log)
+    self.assertEquals(5, self.getRuns())
+    return
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,497 @@
+'''
+  The Scheduler runs the configure() method of each child in the Framework. With a single job,
+children are configured one at a time in topological order, exactly as the Framework always has.
+
+  With --configure-jobs=N, each child whose required children have all finished is configured in a
+forked worker process, run by a CommandEngine, and at most N workers run at once. A worker runs child.configure() on its
+own copy of the configure state, and then sends back
+    - The ordered list of changes to the defines, makeMacros, makeRules, typedefs, subst, and argSubst
+      of every object, recorded as they happen so that they can be replayed in the same order
+    - The changes to all other attributes of the Framework and its children, as differences from the
+      state at fork time (list appends and dictionary updates are sent as such)
+    - The changes to the argument database
+    - Its section of the log
+    - Its profile, with --profile-configure, and the resources used by its commands
+
+Results are committed in the parent in the serial topological order, so that the headers, make
+macros, and RDict are identical to a serial run. An exception in a worker is raised at the commit
+point of the failing child. A child whose changes cannot be shipped back, for instance because it
+stored an object which cannot be pickled, is simply configured again serially at its commit point.
+
+  This relies on require() declaring every child whose results are used, since a child is started
+as soon as the children it requires have committed.
+'''
+import commandEngine
+import logger
+import profiler
+
+import os
+import sys
+
+import cPickle
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from StringIO import StringIO
+
+try:
+  enumerate([0, 1])
+except NameError:
+  def enumerate(l):
+    return zip(range(len(l)), l)
+
+class UnmergeableError(RuntimeError):
+  pass
+
+class JournalDict(dict):
+  '''A dictionary which records the keys it sets and deletes, in order'''
+  def __init__(self, data, journal, index, name):
+    dict.__init__(self, data)
+    self.journal = journal
+    self.index   = index
+    self.name    = name
+    return
+
+  def __setitem__(self, key, value):
+    dict.__setitem__(self, key, value)
+    self.journal.append((self.index, self.name, 'set', key))
+    return
+
+  def __delitem__(self, key):
+    dict.__delitem__(self, key)
+    self.journal.append((self.index, self.name, 'del', key))
+    return
+
+  def update(self, *args, **kargs):
+    for key, value in dict(*args, **kargs).items():
+      self[key] = value
+    return
+
+  def setdefault(self, key, value = None):
+    if not key in self:
+      self[key] = value
+    return self[key]
+
+  def pop(self, key, *default):
+    if key in self:
+      self.journal.append((self.index, self.name, 'del', key))
+    return dict.pop(self, key, *default)
+
+  def clear(self):
+    for key in self.keys():
+      del self[key]
+    return
+
+class Scheduler(object):
+  '''Configures the children of a Framework, possibly in parallel worker processes'''
+  # Output dictionaries whose modifications are replayed in order
+  journaled  = ['defines', 'makeMacros', 'makeRules', 'typedefs', 'subst', 'argSubst']
+  # Process local attributes, and caches which are recreated on demand
+  localAttributes = ['_argDB', 'log', 'out', 'childGraph', 'languageModule', 'preprocessorObject', 'compilerObject', 'linkerObject', 'sharedLinkerObject', 'dynamicLinkerObject', '_headerRendering']
+  # Processor caches of the Framework, of which only the class chosen for each language is sent back
+  processorAttributes = ['preprocessorObject', 'compilerObject', 'linkerObject', 'sharedLinkerObject', 'dynamicLinkerObject']
+
+  def __init__(self, framework, jobs = 1):
+    self.framework = framework
+    self.jobs      = jobs
+    return
+
+  def logPrint(self, msg):
+    self.framework.logPrint(msg)
+    return
+
+  def isParallel(self):
+    '''Parallel configure requires fork() and a local argument database'''
+    if self.jobs <= 1:
+      return 0
+    if not hasattr(os, 'fork'):
+      self.logPrint('Parallel configure is not possible without os.fork(), configuring serially')
+      return 0
+    if not self.framework.argDB.parent is None:
+      self.logPrint('Parallel configure is not possible with a remote argument database, configuring serially')
+      return 0
+    if not hasattr(self.framework.log, 'fileno'):
+      self.logPrint('Parallel configure requires a log file, configuring serially')
+      return 0
+    return 1
+
+  def runConfigure(self, child):
+    '''Run the configure() of the child, as a frame of the profiles if there are any, charging its commands to the child'''
+    profile       = profiler.Profiler.defaultProfiler
+    pythonProfile = profiler.PythonProfiler.defaultProfiler
+    if not profile is None:
+      profile.enter('child', child.__module__)
+    if not pythonProfile is None:
+      pythonProfile.enterChild(child.__module__)
+    commandEngine.ResourceUsage.enter(child.__module__)
+    try:
+      child.configure()
+    finally:
+      commandEngine.ResourceUsage.leave()
+      if not pythonProfile is None:
+        pythonProfile.leaveChild()
+      if not profile is None:
+        profile.leave()
+    return
+
+  def configureChild(self, child):
+    if not hasattr(child, '_configured'):
+      self.runConfigure(child)
+    else:
+      child.no_configure()
+    child._configured = 1
+    return
+
+  def configure(self, children):
+    '''Configure each child, given in topological order'''
+    if not self.isParallel():
+      for child in children:
+        self.configureChild(child)
+      return
+    self.order   = list(children)
+    self.objects = [self.framework]
+    for name in ['help', 'actions']:
+      if hasattr(self.framework, name):
+        self.objects.append(getattr(self.framework, name))
+    self.offset  = len(self.objects)
+    self.objects.extend(self.order)
+    self.ids     = dict([(id(obj), 'v'+str(index)) for index, obj in enumerate(self.objects)])
+    self.logPrint('Configuring '+str(len(self.order))+' children with up to '+str(self.jobs)+' jobs')
+    # The temporary directory must be shared by all workers
+    self.framework.tmpDir
+    self.engine  = commandEngine.CommandEngine(self.jobs)
+    self.running = {}
+    try:
+      self.schedule()
+    finally:
+      self.killWorkers()
+    return
+
+  def schedule(self):
+    '''Start workers for the ready children, and commit results in serial order'''
+    position = dict([(id(child), index) for index, child in enumerate(self.order)])
+    waiting  = range(len(self.order))
+    results  = {}
+    next     = 0
+    while next < len(self.order):
+      while next in results:
+        self.commit(self.order[next], results[next])
+        del results[next]
+        next += 1
+      if next >= len(self.order): break
+      for index in waiting[:]:
+        if len(self.running) >= self.jobs: break
+        child = self.order[index]
+        # A package may list itself among the children it requires
+        if max([-1]+[position[id(c)] for c in self.framework.childGraph.inEdges[child] if not c is child]) >= next: continue
+        waiting.remove(index)
+        if hasattr(child, '_configured'):
+          results[index] = ('noconfigure',)
+        else:
+          self.startWorker(index)
+      if not self.running: continue
+      for worker in self.engine.wait(self.running.keys()):
+        index, logName = self.running.pop(worker)
+        results[index] = ('worker', worker.output, logName)
+    return
+
+  def startWorker(self, index):
+    import tempfile
+
+    child = self.order[index]
+    fd, logName = tempfile.mkstemp(prefix = 'worker-', suffix = '.log', dir = self.framework.tmpDir)
+    os.close(fd)
+    self.framework.log.flush()
+    def work(wfd):
+      fd = os.open(logName, os.O_WRONLY)
+      os.dup2(fd, self.framework.log.fileno())
+      os.close(fd)
+      self.runWorker(self.offset+index, child, wfd)
+    worker = self.engine.submitFunction(work, child.__module__)
+    self.running[worker] = (index, logName)
+    return
+
+  def killWorkers(self):
+    '''Stop the running workers, which also kill the commands they are running'''
+    for worker in self.running:
+      self.engine.kill(worker)
+    self.running = {}
+    return
+
+  def persistentId(self, obj):
+    '''Configure objects and streams are sent by reference'''
+    if id(obj) in self.ids:
+      return self.ids[id(obj)]
+    if obj is self.framework.argDB:
+      return 'argDB'
+    if obj is self.framework.log:
+      return 'log'
+    if obj is sys.stdout:
+      return 'stdout'
+    if obj is sys.stderr:
+      return 'stderr'
+    if isinstance(obj, type(os)):
+      return 'm'+obj.__name__
+    return None
+
+  def persistentLoad(self, pid):
+    if pid[0] == 'v':
+      return self.objects[int(pid[1:])]
+    if pid == 'argDB':
+      return self.framework.argDB
+    if pid == 'log':
+      return self.framework.log
+    if pid in ['stdout', 'stderr']:
+      return getattr(sys, pid)
+    if pid[0] == 'm':
+      __import__(pid[1:])
+      return sys.modules[pid[1:]]
+    raise cPickle.UnpicklingError('Invalid persistent id '+str(pid))
+
+  def dumps(self, value):
+    f = StringIO()
+    p = cPickle.Pickler(f, 2)
+    p.persistent_id = self.persistentId
+    p.dump(value)
+    return f.getvalue()
+
+  def loads(self, data):
+    p = cPickle.Unpickler(StringIO(data))
+    p.persistent_load = self.persistentLoad
+    return p.load()
+
+  def snapshotObject(self, obj):
+    '''Return the pickled attributes, or the identity of unpicklable attributes'''
+    attrs = {}
+    for name, value in obj.__dict__.items():
+      if name in self.localAttributes or name in self.journaled: continue
+      try:
+        attrs[name] = (1, self.dumps(value))
+      except Exception:
+        attrs[name] = (0, id(value))
+    return attrs
+
+  def snapshotArguments(self):
+    '''Return the pickled local arguments, or None for those which cannot be pickled
+       - An entry of the RDict snapshot which was never used is given by its place in the snapshot, so that it is not unpickled'''
+    import RDict
+
+    args = {}
+    for key, value in dict.items(self.framework.argDB):
+      if isinstance(value, RDict.LazyArg):
+        args[key] = ('lazy', value.offset, value.length)
+        continue
+      try:
+        args[key] = self.dumps(value)
+      except Exception:
+        args[key] = None
+    return args
+
+  def delta(self, old, current, data):
+    '''Express a change as an append or update when possible, so that concurrent changes to shared objects are merged'''
+    if not old is None and old[0]:
+      try:
+        previous = self.loads(old[1])
+        if isinstance(previous, list) and type(current) == list and current[:len(previous)] == previous:
+          return ('extend', self.dumps(current[len(previous):]))
+        if isinstance(previous, dict) and type(current) == dict:
+          update  = {}
+          for key, value in current.items():
+            if not key in previous or not previous[key] == value:
+              update[key] = value
+          removed = [key for key in previous if not key in current]
+          return ('update', self.dumps(update), removed)
+      except Exception:
+        pass
+    return ('set', data)
+
+  def runWorker(self, index, child, wfd):
+    '''Configure the child and send the results to the parent, never returning'''
+    status = 1
+    try:
+      try:
+        result = self.configureWorker(index, child)
+        data   = self.dumps(result)
+        while data:
+          data = data[os.write(wfd, data):]
+        status = 0
+      except:
+        import traceback
+
+        # The parent will report the missing result
+        traceback.print_exc(file = self.framework.log)
+        self.framework.log.flush()
+    finally:
+      # Exit without the handlers of the parent, but with the events of the worker
+      logger.BufferedLog.flushAll()
+      os._exit(status)
+    return
+
+  def configureWorker(self, index, child):
+    '''Configure the child, recording all changes to the state'''
+    self.framework.argDB.readonly = True
+    journal = []
+    for i, obj in enumerate(self.objects):
+      for name in self.journaled:
+        if name in obj.__dict__ and type(obj.__dict__[name]) == dict:
+          obj.__dict__[name] = JournalDict(obj.__dict__[name], journal, i, name)
+    before      = map(self.snapshotObject, self.objects)
+    argsBefore  = self.snapshotArguments()
+    processors  = self.snapshotProcessors()
+    numVertices = len(self.framework.childGraph.vertices)
+    profile     = profiler.Profiler.defaultProfiler
+    if not profile is None:
+      profile = profiler.Profiler.defaultProfiler = profile.fork()
+    commandEngine.ResourceUsage.accounts = {}
+    try:
+      try:
+        self.runConfigure(child)
+        if not len(self.framework.childGraph.vertices) == numVertices:
+          raise UnmergeableError('New children were created during configure')
+        if not profile is None:
+          profile = profile.getRecords()
+        result = ('ok', self.diffObjects(before), self.diffJournal(journal), self.diffArguments(argsBefore), self.diffProcessors(processors), profile, commandEngine.ResourceUsage.getAccounts())
+      except UnmergeableError, e:
+        result = ('unmergeable', str(e))
+    except:
+      import traceback
+
+      (excType, excValue, excTraceback) = sys.exc_info()
+      text = ''.join(traceback.format_exception(excType, excValue, excTraceback))
+      try:
+        error = cPickle.dumps((excType, excValue), 2)
+      except Exception:
+        error = None
+      result = ('error', error, text)
+    self.framework.log.flush()
+    return result
+
+  def diffObjects(self, before):
+    changes = []
+    for index, obj in enumerate(self.objects):
+      old   = before[index]
+      new   = self.snapshotObject(obj)
+      names = new.keys()
+      names.sort()
+      for name in names:
+        value = new[name]
+        if old.get(name) == value: continue
+        if not value[0]:
+          raise UnmergeableError('Cannot pickle attribute '+name+' of '+str(obj.__class__))
+        changes.append((index, name, self.delta(old.get(name), obj.__dict__[name], value[1])))
+      for name in old:
+        if not name in new:
+          changes.append((index, name, ('del',)))
+    return changes
+
+  def diffJournal(self, journal):
+    '''Attach the final value of each key to the recorded operations'''
+    events = []
+    for index, name, op, key in journal:
+      d = self.objects[index].__dict__[name]
+      if op == 'set' and key in d:
+        events.append((index, name, op, key, d[key]))
+      else:
+        events.append((index, name, 'del', key, None))
+    try:
+      return self.dumps(events)
+    except Exception, e:
+      raise UnmergeableError('Cannot pickle output values: '+str(e))
+    return
+
+  def snapshotProcessors(self):
+    '''Return the class of each processor object, such as the StaticLinker chosen by setCompilers'''
+    classes = {}
+    for name in self.processorAttributes:
+      for language, processor in self.framework.__dict__.get(name, {}).items():
+        classes[(name, language)] = processor.__class__.__name__
+    return classes
+
+  def diffProcessors(self, before):
+    current = self.snapshotProcessors()
+    return [(name, language, className) for (name, language), className in current.items() if not before.get((name, language)) == className]
+
+  def diffArguments(self, argsBefore):
+    args = self.snapshotArguments()
+    changed = []
+    for key, value in args.items():
+      if not argsBefore.get(key) == value:
+        if value is None:
+          raise UnmergeableError('Cannot pickle argument '+key)
+        if isinstance(value, tuple):
+          value = self.dumps(self.framework.argDB.getLocalType(key))
+        changed.append((key, value))
+    removed = [key for key in argsBefore if not key in args]
+    return (changed, removed)
+
+  def commit(self, child, result):
+    '''Apply the results for a child to the parent state'''
+    if result[0] == 'noconfigure':
+      self.configureChild(child)
+      return
+    data, logName = result[1:]
+    f = file(logName)
+    self.framework.log.write(f.read())
+    f.close()
+    os.remove(logName)
+    if not data:
+      raise RuntimeError('Configure worker for '+child.__module__+' terminated without a result')
+    result = self.loads(data)
+    if result[0] == 'error':
+      self.killWorkers()
+      self.framework.log.write(result[2])
+      if not result[1] is None:
+        try:
+          excType, excValue = cPickle.loads(result[1])
+        except Exception:
+          excType = None
+        if not excType is None:
+          raise excType, excValue
+      raise RuntimeError('Configure failed in '+child.__module__+':\n'+result[2])
+    if result[0] == 'unmergeable':
+      self.logPrint('Could not merge the results of '+child.__module__+' ('+result[1]+'), configuring it serially')
+      self.configureChild(child)
+      return
+    changes, journal, args, processors, profile, usage = result[1:]
+    commandEngine.ResourceUsage.mergeAccounts(usage)
+    if not profile is None:
+      profiler.Profiler.defaultProfiler.merge(profile)
+    for index, name, change in changes:
+      self.applyChange(self.objects[index].__dict__, name, change)
+    for index, name, op, key, value in self.loads(journal):
+      d = self.objects[index].__dict__[name]
+      if op == 'set':
+        d[key] = value
+      elif key in d:
+        del d[key]
+    argDB = self.framework.argDB
+    for name, language, className in processors:
+      self.framework.__dict__[name][language] = getattr(self.framework.getLanguageModule(language), className)(argDB)
+    changed, removed = args
+    for key, value in changed:
+      dict.__setitem__(argDB, key, self.loads(value))
+    for key in removed:
+      if dict.has_key(argDB, key):
+        dict.__delitem__(argDB, key)
+    if changed or removed:
+      argDB.save(keys = [key for key, value in changed]+list(removed))
+    # The merged defines did not pass through the rendering of the probe headers
+    self.framework.getHeaderRendering().invalidate()
+    child._configured = 1
+    return
+
+  def applyChange(self, attrs, name, change):
+    if change[0] == 'del':
+      if name in attrs: del attrs[name]
+    elif change[0] == 'extend' and type(attrs.get(name)) == list:
+      attrs[name].extend(self.loads(change[1]))
+    elif change[0] == 'update' and type(attrs.get(name)) == dict:
+      d = attrs[name]
+      for key in change[2]:
+        if key in d: del d[key]
+      d.update(self.loads(change[1]))
+    elif change[0] == 'set':
+      attrs[name] = self.loads(change[1])
+    else:
+      raise RuntimeError('Cannot merge attribute '+name)
+    return
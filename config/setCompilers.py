@@ -1,5 +1,6 @@
 from __future__ import generators
 import config.base
+import config.toolchain
 
 import os
 
@@ -114,7 +115,7 @@ class Configure(config.base.Configure):
   def isNAG(compiler):
     '''Returns true if the compiler is a NAG F90 compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' -V',checkCommand = noCheck)
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '-V', checkCommand = noCheck)
       output = output + error
       if output.find('NAGWare Fortran') >= 0 or output.find('The Numerical Algorithms Group Ltd') >= 0:
         return 1
@@ -126,7 +127,7 @@ class Configure(config.base.Configure):
   def isGNU(compiler):
     '''Returns true if the compiler is a GNU compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --help')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--help')
       output = output + error
       return (any([s in output for s in ['www.gnu.org',
                                          'bugzilla.redhat.com',
@@ -150,7 +151,7 @@ class Configure(config.base.Configure):
   def isClang(compiler):
     '''Returns true if the compiler is a Clang/LLVM compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --help')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--help')
       output = output + error
       return any([s in output for s in ['Emit Clang AST']])
     except RuntimeError:
@@ -161,7 +162,7 @@ class Configure(config.base.Configure):
   def isGfortran45x(compiler):
     '''returns true if the compiler is gfortran-4.5.x'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --version')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--version')
       output = output +  error
       import re
       if re.match(r'GNU Fortran \(.*\) (4.5.\d+|4.6.0 20100703)', output):
@@ -174,7 +175,7 @@ class Configure(config.base.Configure):
   def isGfortran46plus(compiler):
     '''returns true if the compiler is gfortran-4.6.x or later'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --version')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--version')
       output = output +  error
       import re
       if re.match(r'GNU Fortran \(.*\) (4.([6789]|\d{2,}).\d+)', output):
@@ -188,7 +189,7 @@ class Configure(config.base.Configure):
   def isG95(compiler):
     '''Returns true if the compiler is g95'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --help')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--help')
       output = output + error
       if output.find('Unrecognised option --help passed to ld') >=0:    # NAG f95 compiler
         return 0
@@ -202,7 +203,7 @@ class Configure(config.base.Configure):
   def isCompaqF90(compiler):
     '''Returns true if the compiler is Compaq f90'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --help')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--help')
       output = output + error
       if output.find('Unrecognised option --help passed to ld') >=0:    # NAG f95 compiler
         return 0
@@ -216,7 +217,7 @@ class Configure(config.base.Configure):
   def isSun(compiler):
     '''Returns true if the compiler is a Sun/Oracle compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' -V',checkCommand = noCheck)
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '-V', checkCommand = noCheck)
       output = output + error
       if output.find(' Sun ') >= 0:
         return 1
@@ -228,7 +229,7 @@ class Configure(config.base.Configure):
   def isIBM(compiler):
     '''Returns true if the compiler is a IBM compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' -flags')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '-flags')
       output = output + error
       #
       # Do not know what to look for for IBM compilers
@@ -242,7 +243,7 @@ class Configure(config.base.Configure):
   def isIntel(compiler):
     '''Returns true if the compiler is a Intel compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' --help')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '--help')
       output = output + error
       if output.find('Intel Corporation') >= 0 :
         return 1
@@ -254,7 +255,7 @@ class Configure(config.base.Configure):
   def isCray(compiler):
     '''Returns true if the compiler is a Cray compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' -V')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '-V')
       output = output + error
       if output.find('Cray Standard C') >= 0 or output.find('Cray C++') >= 0 or output.find('Cray Fortran') >= 0:
         return 1
@@ -266,7 +267,7 @@ class Configure(config.base.Configure):
   def isCrayVector(compiler):
     '''Returns true if the compiler is a Cray compiler for a Cray Vector system'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' -VV')
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '-VV')
       output = output + error
       if not status and output.find('x86') >= 0:
         return 0
@@ -283,7 +284,7 @@ class Configure(config.base.Configure):
   def isPGI(compiler):
     '''Returns true if the compiler is a PGI compiler'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(compiler+' -V',checkCommand = noCheck)
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(compiler, '-V', checkCommand = noCheck)
       output = output + error
       if output.find('The Portland Group') >= 0:
         return 1
@@ -295,7 +296,7 @@ class Configure(config.base.Configure):
   def isSolarisAR(ar):
     '''Returns true AR is solaris'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(ar + ' -V',checkCommand = noCheck)
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(ar, '-V', checkCommand = noCheck)
       output = output + error
       if output.find('Software Generation Utilities') >= 0:
         return 1
@@ -307,7 +308,7 @@ class Configure(config.base.Configure):
   def isAIXAR(ar):
     '''Returns true AR is AIX'''
     try:
-      (output, error, status) = config.base.Configure.executeShellCommand(ar + ' -V',checkCommand = noCheck)
+      (output, error, status) = config.toolchain.ToolchainProfiles.getDefault().getOutput(ar, '-V', checkCommand = noCheck)
       output = output + error
       if output.find('[-X{32|64|32_64|d64|any}]') >= 0:
         return 1
@@ -951,6 +952,39 @@ class Configure(config.base.Configure):
       return
     raise RuntimeError('Bad compiler flag: '+flag)
 
+  def bisectFlags(self, flags, check, accept = None):
+    '''Return the lists of (accepted, rejected) flags, testing the flags together and bisecting only the sets which are rejected
+       - The check is called with a string of flags, and decides rejection just as for a single flag
+       - If accept is given, it is called with each accepted set as soon as it is found, so that later tests include those flags'''
+    accepted = []
+    rejected = []
+    def bisect(flags):
+      if not flags:
+        return
+      if check(' '.join(flags)):
+        accepted.extend(flags)
+        if accept: accept(flags)
+      elif len(flags) == 1:
+        rejected.extend(flags)
+      else:
+        self.framework.logPrint('Bisecting rejected flags '+str(flags))
+        bisect(flags[:len(flags)/2])
+        bisect(flags[len(flags)/2:])
+      return
+    bisect(flags)
+    return (accepted, rejected)
+
+  def addCompilerFlags(self, flags, includes = '', body = '', compilerOnly = 0):
+    '''Add each of the flags which the compiler accepts, and return the list of those rejected
+       - This matches calling addCompilerFlag() for each flag in turn, but needs a single compile when every flag is accepted'''
+    def check(flag):
+      return self.checkCompilerFlag(flag, includes, body, compilerOnly)
+    def accept(flags):
+      for flag in flags:
+        self.insertCompilerFlag(flag, compilerOnly)
+      return
+    return self.bisectFlags(flags, check, accept)[1]
+
   def checkPIC(self):
     '''Determine the PIC option for each compiler
        - There needs to be a test that checks that the functionality is actually working'''
@@ -1207,7 +1241,7 @@ class Configure(config.base.Configure):
       self.logPrint('Checking shared linker '+linker+' using flags '+str(flags))
       if self.getExecutable(linker, resultName = 'LD_SHARED'):
         flagsArg = self.getLinkerFlagsArg()
-        goodFlags = filter(self.checkLinkerFlag, flags)
+        goodFlags = self.checkLinkerFlags(flags)
         testMethod = 'foo'
         self.sharedLinker = self.LD_SHARED
         self.sharedLibraryFlags = goodFlags
@@ -1216,7 +1250,7 @@ class Configure(config.base.Configure):
         if self.checkLink(includes = '#include <stdio.h>\nint '+testMethod+'(void) {printf("hello");\nreturn 0;}\n', codeBegin = '', codeEnd = '', cleanup = 0, shared = 1):
           oldLib  = self.linkerObj
           oldLibs = self.LIBS
-          self.LIBS += ' -L'+self.tmpDir+' -lconftest'
+          self.LIBS += ' -L'+os.path.dirname(oldLib)+' -lconftest'
           if self.checkLink(includes = 'int foo(void);', body = 'int ret = foo();\nif(ret);'):
             os.remove(oldLib)
             self.LIBS = oldLibs
@@ -1249,6 +1283,10 @@ class Configure(config.base.Configure):
     setattr(self, flagsArg, oldFlags)
     return valid
 
+  def checkLinkerFlags(self, flags):
+    '''Return the flags which the linker accepts, which matches filter(self.checkLinkerFlag, flags) but needs a single link when every flag is accepted'''
+    return self.bisectFlags(flags, self.checkLinkerFlag)[0]
+
   def addLinkerFlag(self, flag):
     '''Determine whether the linker accepts the given flag, and add it if valid, otherwise throw an exception'''
     if self.checkLinkerFlag(flag):
@@ -1267,13 +1305,12 @@ class Configure(config.base.Configure):
       languages.append('FC')
     for language in languages:
       self.pushLanguage(language)
-      for testFlag in ['-Wl,-multiply_defined,suppress', '-Wl,-multiply_defined -Wl,suppress', '-Wl,-commons,use_dylibs', '-Wl,-search_paths_first']:
-        if self.checkLinkerFlag(testFlag):
-          # expand to CC_LINKER_FLAGS or CXX_LINKER_FLAGS or FC_LINKER_FLAGS
-	  linker_flag_var = langMap[language]+'_LINKER_FLAGS'
-          val = getattr(self,linker_flag_var)
-	  val.append(testFlag)
-	  setattr(self,linker_flag_var,val)
+      for testFlag in self.checkLinkerFlags(['-Wl,-multiply_defined,suppress', '-Wl,-multiply_defined -Wl,suppress', '-Wl,-commons,use_dylibs', '-Wl,-search_paths_first']):
+        # expand to CC_LINKER_FLAGS or CXX_LINKER_FLAGS or FC_LINKER_FLAGS
+        linker_flag_var = langMap[language]+'_LINKER_FLAGS'
+        val = getattr(self,linker_flag_var)
+        val.append(testFlag)
+        setattr(self,linker_flag_var,val)
       self.popLanguage()
     return
 
@@ -1375,7 +1412,7 @@ class Configure(config.base.Configure):
       self.logPrint('Checking dynamic linker '+linker+' using flags '+str(flags))
       if self.getExecutable(linker, resultName = 'dynamicLinker'):
         flagsArg = self.getLinkerFlagsArg()
-        goodFlags = filter(self.checkLinkerFlag, flags)
+        goodFlags = self.checkLinkerFlags(flags)
         self.dynamicLibraryFlags = goodFlags
         self.dynamicLibraryExt = ext
         testMethod = 'foo'
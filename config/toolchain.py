@@ -0,0 +1,252 @@
+'''
+  A toolchain profile holds what configure learns about a compiler by running it for information,
+such as the output of --help, -V, and --version used to identify the vendor and version, and the
+verbose link used to find the implicit libraries and search paths. Each command is run at most once
+per compiler in a configure run, and when the probe cache is enabled, the profile is also stored on
+disk so that later configures with the same toolchain do not run it at all.
+
+  A profile is addressed by a fingerprint of the programs in the compiler command, such as both
+ccache and cc in "ccache cc"
+    - Their real paths, sizes, and modification times
+    - Hashes of their contents
+
+so that it is invalidated automatically whenever the compiler changes. A compiler wrapper, such as
+mpicc, is also fingerprinted by the command it shows with -show, including the compiler it invokes,
+and its profile is not stored when it cannot show that command. Each result in a profile is further
+keyed by the search paths and locale, so that a compiler found through a different PATH, for example
+after switching modules, is run again.
+'''
+import os
+import cPickle
+
+try:
+  from hashlib import md5 as new_md5
+except ImportError:
+  from md5 import new as new_md5
+
+def noCheck(command, status, output, error):
+  return
+
+class ToolchainProfiles(object):
+  # The profiles used by the Configure objects, set by the Framework
+  defaultProfiles = None
+  version     = '2'
+  placeholder = '@PROBE_TMPDIR@'
+  # Variables which change the compiler that runs, the libraries it finds, or its messages
+  environment = ['PATH', 'LD_LIBRARY_PATH', 'LIBRARY_PATH', 'DYLD_LIBRARY_PATH', 'LD_RUN_PATH', 'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'COMPILER_PATH', 'GCC_EXEC_PREFIX', 'LANG', 'LC_ALL', 'LC_MESSAGES']
+  # Programs which run another compiler, and the arguments which make them show its command
+  wrappers    = ['mpi']
+  showArgs    = ['-show', '-showme']
+
+  def __init__(self, directory = None, mode = 'off'):
+    self.directory    = directory
+    self.mode         = mode
+    self.hits         = 0
+    self.misses       = 0
+    # Map from a profile key to the dictionary of results
+    self.profiles     = {}
+    # Map from the identity of a binary to its fingerprint
+    self.fingerprints = {}
+    # Map from a wrapper command and PATH to the command it runs
+    self.wrapped      = {}
+    return
+
+  def __str__(self):
+    return 'Toolchain profiles in '+str(self.directory)+' ('+self.mode+'): '+str(self.hits)+' hits, '+str(self.misses)+' misses'
+
+  def getDefault():
+    '''Return the default profiles, which are only kept in memory unless the Framework configured them'''
+    if ToolchainProfiles.defaultProfiles is None:
+      ToolchainProfiles.defaultProfiles = ToolchainProfiles()
+    return ToolchainProfiles.defaultProfiles
+  getDefault = staticmethod(getDefault)
+
+  def isReadable(self):
+    return self.directory and self.mode in ['read', 'readwrite']
+
+  def isWritable(self):
+    return self.directory and self.mode == 'readwrite'
+
+  def findProgram(self, name):
+    if os.path.dirname(name):
+      return name
+    for dir in os.environ.get('PATH', '').split(os.path.pathsep):
+      filename = os.path.join(dir, name)
+      if os.path.isfile(filename):
+        return filename
+    return name
+
+  def isWrapper(self, program):
+    name = os.path.basename(program)
+    return [prefix for prefix in self.wrappers if name.startswith(prefix)]
+
+  def getFileFingerprint(self, filename):
+    '''Return the fingerprint of a program file, or None if it cannot be read'''
+    filename = os.path.realpath(filename)
+    try:
+      st = os.stat(filename)
+    except OSError:
+      return None
+    identity = (filename, st.st_size, st.st_mtime)
+    if not identity in self.fingerprints:
+      try:
+        f = file(filename, 'rb')
+        digest = new_md5(f.read()).hexdigest()
+        f.close()
+      except IOError:
+        return None
+      self.fingerprints[identity] = '\0'.join([filename, str(st.st_size), repr(st.st_mtime), digest])
+    return self.fingerprints[identity]
+
+  def getWrappedCommand(self, wrapper, log = None):
+    '''Return the command a compiler wrapper runs, or None if it does not show it
+       - This runs the wrapper once per configure run, since the compiler it invokes may change between runs'''
+    import logger
+    import script
+
+    if log is None:
+      log = logger.Logger.defaultLog
+    key = (wrapper, os.environ.get('PATH', ''))
+    if not key in self.wrapped:
+      self.wrapped[key] = None
+      for arg in self.showArgs:
+        try:
+          (output, error, status) = script.Script.executeShellCommand(wrapper+' '+arg, checkCommand = noCheck, log = log)
+        except RuntimeError:
+          continue
+        if not status and output.strip():
+          self.wrapped[key] = ' '.join(output.split())
+          break
+    return self.wrapped[key]
+
+  def getFingerprint(self, compiler, log = None):
+    '''Return the fingerprint of the programs which run for this compiler command, or None if they cannot be found
+       - Every argument naming a program is included, so that both the launcher and the compiler in "ccache cc" count
+       - A wrapper adds the command it shows, and the compiler named there, or returns None if it shows nothing'''
+    tokens = compiler.split()
+    if not tokens:
+      return None
+    parts = [self.version]
+    for i in range(len(tokens)):
+      if i and tokens[i].startswith('-'):
+        continue
+      filename = self.findProgram(tokens[i])
+      if i and not (os.path.isfile(filename) and os.access(filename, os.X_OK)):
+        continue
+      fingerprint = self.getFileFingerprint(filename)
+      if fingerprint is None:
+        return None
+      parts.append(fingerprint)
+      if self.isWrapper(tokens[i]):
+        wrapped = self.getWrappedCommand(tokens[i], log)
+        if wrapped is None:
+          return None
+        fingerprint = self.getFileFingerprint(self.findProgram(wrapped.split()[0]))
+        if fingerprint is None:
+          return None
+        parts.extend([wrapped, fingerprint])
+        break
+    return new_md5('\0'.join(parts)).hexdigest()
+
+  def getFilename(self, key):
+    return os.path.join(self.directory, 'toolchain', key)
+
+  def getProfile(self, compiler, log = None):
+    '''Return the key and results for a compiler, or (None, None) if it cannot be fingerprinted'''
+    key = self.getFingerprint(compiler, log)
+    if key is None:
+      return (None, None)
+    if not key in self.profiles:
+      profile = {}
+      if self.isReadable():
+        try:
+          f = file(self.getFilename(key), 'rb')
+          profile = cPickle.load(f)
+          f.close()
+          # Profiles share the eviction of the probe cache, which removes the least recently used files
+          os.utime(self.getFilename(key), None)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError, ValueError):
+          profile = {}
+      self.profiles[key] = profile
+    return (key, self.profiles[key])
+
+  def save(self, key):
+    '''Write a profile atomically, so that concurrent configures can share the directory'''
+    import tempfile
+
+    if not self.isWritable():
+      return
+    name = self.getFilename(key)
+    try:
+      if not os.path.isdir(os.path.dirname(name)):
+        os.makedirs(os.path.dirname(name))
+    except OSError:
+      # Another configure may have created it
+      if not os.path.isdir(os.path.dirname(name)): return
+    fd, tmpName = tempfile.mkstemp(prefix = '.'+key, dir = os.path.dirname(name))
+    try:
+      f = os.fdopen(fd, 'wb')
+      cPickle.dump(self.profiles[key], f, 2)
+      f.close()
+      os.rename(tmpName, name)
+    except (IOError, OSError):
+      if os.path.isfile(tmpName): os.remove(tmpName)
+    return
+
+  def getName(self, kind, command):
+    return '\0'.join([kind, ' '.join(command.split())]+[os.environ.get(var, '') for var in self.environment])
+
+  def getValue(self, compiler, name, default = None, log = None):
+    '''Return a result recorded in the profile of a compiler'''
+    key, profile = self.getProfile(compiler, log)
+    if profile is None or not name in profile:
+      self.misses += 1
+      return default
+    self.hits += 1
+    return profile[name]
+
+  def setValue(self, compiler, name, value, log = None):
+    '''Record a result in the profile of a compiler'''
+    key, profile = self.getProfile(compiler, log)
+    if profile is None:
+      return
+    profile[name] = value
+    self.save(key)
+    return
+
+  def normalize(self, text, directory):
+    if directory:
+      return text.replace(directory, self.placeholder)
+    return text
+
+  def denormalize(self, text, directory):
+    if directory:
+      return text.replace(self.placeholder, directory)
+    return text
+
+  def getOutput(self, compiler, args, checkCommand = None, log = None, directory = None):
+    '''Return (output, error, status) from running the compiler with the given arguments, which happens once per toolchain
+       - The checkCommand is also applied to a recorded result, so that it raises just as for a new run
+       - A temporary directory named in the arguments is replaced by a placeholder in the profile'''
+    import logger
+    import script
+
+    if checkCommand is None:
+      checkCommand = script.Script.defaultCheckCommand
+    if log is None:
+      log = logger.Logger.defaultLog
+    command = compiler+' '+args
+    name    = self.getName('output', self.normalize(command, directory))
+    result  = self.getValue(compiler, name, log = log)
+    if result is None:
+      result = script.Script.executeShellCommand(command, checkCommand = noCheck, log = log)
+      if not (result[2] == -1 and result[1].startswith('Runaway process')):
+        self.setValue(compiler, name, tuple([self.normalize(text, directory) for text in result[0:2]])+result[2:], log)
+    else:
+      result = tuple([self.denormalize(text, directory) for text in result[0:2]])+result[2:]
+      if not log is None:
+        log.write('Toolchain profile for: '+command+'\n')
+        log.write('sh: '+result[0]+'\n')
+    (output, error, status) = result
+    checkCommand(command, status, output, error)
+    return result
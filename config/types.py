@@ -1,9 +1,16 @@
 import config.base
+import config.introspection
 
 import os
 import re
 
 class Configure(config.base.Configure):
+  basicTypes = ['char','void *', 'short', 'int', 'long', 'long long', 'float', 'double', 'size_t']
+  mpiFix     = '''
+#define MPICH_IGNORE_CXX_SEEK
+#define MPICH_SKIP_MPICXX 1
+#define OMPI_SKIP_MPICXX 1\n'''
+
   def __init__(self, framework):
     config.base.Configure.__init__(self, framework)
     self.headerPrefix = ''
@@ -11,6 +18,7 @@ class Configure(config.base.Configure):
     self.sizes = {}
     self.c99_complex = 0
     self.cxx_complex = 0
+    self.introspection = config.introspection.Introspection(self)
     return
 
   def setupHelp(self, help):
@@ -50,8 +58,17 @@ class Configure(config.base.Configure):
     return
 
   def check__int64(self):
-    '''Checks if __int64 exists. This is primarily for windows.'''
-    if self.check('__int64'):
+    '''Checks if __int64 exists. This is primarily for windows.
+       - MinGW predefines it as a macro, and GCC and Clang on Unix do not have it'''
+    if '__int64' in self.getPredefinedMacros():
+      self.logPrint('The compiler predefines __int64')
+      found = 1
+    elif self.isGNUCompatible():
+      self.logPrint('GCC and Clang on Unix do not have __int64')
+      found = 0
+    else:
+      found = self.check('__int64')
+    if found:
       self.addDefine('HAVE___INT64',1)
     return
 
@@ -104,10 +121,17 @@ void (*signal())();
     return
 
   def checkC99Complex(self):
-    '''Check for complex numbers in in C99 std'''
+    '''Check for complex numbers in in C99 std
+       - A hosted GCC or Clang compiling C99 or later has them unless it predefines __STDC_NO_COMPLEX__'''
     includes = '#include <complex.h>\n'
     body     = 'double complex x;\n x = I;\n'
-    if self.checkLink(includes, body):
+    version  = self.getPredefinedInteger('__STDC_VERSION__')
+    if self.isGNUCompatible() and not version is None and version >= 199901 and self.getPredefinedInteger('__STDC_HOSTED__') == 1 and not '__STDC_NO_COMPLEX__' in self.getPredefinedMacros():
+      self.logPrint('The compiler predefines __STDC_VERSION__ as '+str(version)+', so it has complex numbers')
+      found = 1
+    else:
+      found = self.checkLink(includes, body)
+    if found:
       self.addDefine('HAVE_C99_COMPLEX', 1)
       self.c99_complex = 1
     return
@@ -209,10 +233,26 @@ void (*signal())();
       self.addDefine('const', '')
     return
 
+  def getPredefinedEndian(self):
+    '''Return the byte order given by the __BYTE_ORDER__ macro of the C compiler, or None'''
+    self.pushLanguage('C')
+    order  = self.getPredefinedMacro('__BYTE_ORDER__')
+    endian = None
+    if not order is None:
+      if order == self.getPredefinedMacro('__ORDER_BIG_ENDIAN__'):
+        endian = 'big'
+      elif order == self.getPredefinedMacro('__ORDER_LITTLE_ENDIAN__'):
+        endian = 'little'
+    self.popLanguage()
+    return endian
+
   def checkEndian(self):
     '''If the machine is big endian, defines WORDS_BIGENDIAN'''
     if 'known-endian' in self.framework.argDB:
       endian = self.framework.argDB['known-endian']
+    elif not self.getPredefinedEndian() is None:
+      endian = self.getPredefinedEndian()
+      self.logPrint('The compiler predefines the byte order as '+endian+' endian')
     else:
       # See if sys/param.h defines the BYTE_ORDER macro
       includes = '#include <sys/types.h>\n#ifdef HAVE_SYS_PARAM_H\n  #include <sys/param.h>\n#endif\n'
@@ -221,7 +261,12 @@ void (*signal())();
   bogus endian macros
 #endif
       '''
-      if self.checkCompile(includes, body):
+      if not self.introspection.getResult('endian') is None:
+        if self.introspection.getResult('endian'):
+          endian = 'big'
+        else:
+          endian = 'little'
+      elif self.checkCompile(includes, body):
         # It does, so check whether it is defined to BIG_ENDIAN or not
         body = '''
 #if BYTE_ORDER != BIG_ENDIAN
@@ -262,10 +307,23 @@ void (*signal())();
       self.addDefine('WORDS_BIGENDIAN', 1)
     return
 
-  def checkSizeof(self, typeName, otherInclude = None):
-    '''Determines the size of type "typeName", and defines SIZEOF_"typeName" to be the size'''
-    self.framework.log.write('Checking for size of type: '+typeName+'\n')
-    filename = 'conftestval'
+  def getPredefinedSizeof(self, typeName, otherInclude = None):
+    '''Return the size of a basic type given by the __SIZEOF_*__ macros of the C compiler, or None'''
+    macros = {'void *': '__SIZEOF_POINTER__', 'short': '__SIZEOF_SHORT__', 'int': '__SIZEOF_INT__', 'long': '__SIZEOF_LONG__',
+              'long long': '__SIZEOF_LONG_LONG__', 'float': '__SIZEOF_FLOAT__', 'double': '__SIZEOF_DOUBLE__', 'size_t': '__SIZEOF_SIZE_T__'}
+    if otherInclude:
+      return None
+    if typeName == 'char':
+      # The C standard defines the size of char
+      return 1
+    if not typeName in macros:
+      return None
+    self.pushLanguage('C')
+    size = self.getPredefinedInteger(macros[typeName])
+    self.popLanguage()
+    return size
+
+  def getSizeofIncludes(self, otherInclude = None):
     includes = '''
 #include <sys/types.h>
 #if STDC_HEADERS
@@ -273,72 +331,89 @@ void (*signal())();
 #include <stdio.h>
 #include <stddef.h>
 #endif\n'''
-    mpiFix = '''
-#define MPICH_IGNORE_CXX_SEEK
-#define MPICH_SKIP_MPICXX 1
-#define OMPI_SKIP_MPICXX 1\n'''
     if otherInclude:
       if otherInclude == 'mpi.h':
-        includes += mpiFix
+        includes += self.mpiFix
       includes += '#include <'+otherInclude+'>\n'
-    body     = 'FILE *f = fopen("'+filename+'", "w");\n\nif (!f) exit(1);\nfprintf(f, "%lu\\n", (unsigned long)sizeof('+typeName+'));\n'
+    return includes
+
+  def addSizeofQuery(self, introspection, typeName, otherInclude = None):
+    '''Add the size of type "typeName" to an introspection program, unless it is given or predefined'''
     typename = typeName.replace(' ', '-').replace('*', 'p')
-    if not 'known-sizeof-'+typename in self.framework.argDB:
-      if not self.framework.argDB['with-batch']:
-        self.pushLanguage('C')
-        if self.checkRun(includes, body) and os.path.exists(filename):
-          f    = file(filename)
-          size = int(f.read())
-          f.close()
-          os.remove(filename)
-        elif not typename == 'long-long':
-          msg = 'Cannot run executable to determine size of '+typeName+'. If this machine uses a batch system \nto submit jobs you will need to configure using ./configure with the additional option  --with-batch.\n Otherwise there is problem with the compilers. Can you compile and run code with your C/C++ (and maybe Fortran) compilers?\n'
-          raise RuntimeError(msg)
-        else:
-          self.framework.log.write('Compiler does not support long long\n')
-          size = 0
-        self.popLanguage()
+    if 'known-sizeof-'+typename in self.framework.argDB or not self.getPredefinedSizeof(typeName, otherInclude) is None:
+      return
+    introspection.addInclude(self.getSizeofIncludes(otherInclude))
+    introspection.addQuery('sizeof-'+typename, '  value = (long) sizeof('+typeName+');', 'sizeof('+typeName+')')
+    return
+
+  def checkSizeof(self, typeName, otherInclude = None, introspection = None):
+    '''Determines the size of type "typeName", and defines SIZEOF_"typeName" to be the size
+       - The size is read from the introspection program if it answered, which defaults to the one of this module'''
+    self.framework.log.write('Checking for size of type: '+typeName+'\n')
+    if introspection is None:
+      introspection = self.introspection
+    includes = self.getSizeofIncludes(otherInclude)
+    body     = 'printf("%lu\\n", (unsigned long)sizeof('+typeName+'));\n'
+    typename = typeName.replace(' ', '-').replace('*', 'p')
+    if 'known-sizeof-'+typename in self.framework.argDB:
+      size = self.framework.argDB['known-sizeof-'+typename]
+    elif not self.getPredefinedSizeof(typeName, otherInclude) is None:
+      size = self.getPredefinedSizeof(typeName, otherInclude)
+      self.logPrint('The compiler predefines the size of '+typeName+' as '+str(size))
+    elif not introspection.getResult('sizeof-'+typename) is None:
+      size = introspection.getResult('sizeof-'+typename)
+    elif not self.framework.argDB['with-batch']:
+      self.pushLanguage('C')
+      (output, status) = self.outputRun(includes, body)
+      if not status:
+        size = int(output)
+      elif not typename == 'long-long':
+        msg = 'Cannot run executable to determine size of '+typeName+'. If this machine uses a batch system \nto submit jobs you will need to configure using ./configure with the additional option  --with-batch.\n Otherwise there is problem with the compilers. Can you compile and run code with your C/C++ (and maybe Fortran) compilers?\n'
+        raise RuntimeError(msg)
       else:
-        self.framework.addBatchInclude(['#include <stdlib.h>', '#include <stdio.h>', '#include <sys/types.h>'])
-        if otherInclude:
-          if otherInclude == 'mpi.h':
-            self.framework.addBatchInclude(mpiFix)
-          self.framework.addBatchInclude('#include <'+otherInclude+'>')
-        self.framework.addBatchBody('fprintf(output, "  \'--known-sizeof-'+typename+'=%d\',\\n", sizeof('+typeName+'));')
-        # dummy value
-        size = 4
+        self.framework.log.write('Compiler does not support long long\n')
+        size = 0
+      self.popLanguage()
     else:
-      size = self.framework.argDB['known-sizeof-'+typename]
+      self.framework.addBatchInclude(['#include <stdlib.h>', '#include <stdio.h>', '#include <sys/types.h>'])
+      if otherInclude:
+        if otherInclude == 'mpi.h':
+          self.framework.addBatchInclude(self.mpiFix)
+        self.framework.addBatchInclude('#include <'+otherInclude+'>')
+      self.framework.addBatchBody('fprintf(output, "  \'--known-sizeof-'+typename+'=%d\',\\n", sizeof('+typeName+'));')
+      # dummy value
+      size = 4
     self.sizes['known-sizeof-'+typename] = int(size)
     self.addDefine('SIZEOF_'+typeName.replace(' ', '_').replace('*', 'p').upper(), size)
     return size
 
   def checkBitsPerByte(self):
     '''Determine the nubmer of bits per byte and define BITS_PER_BYTE'''
-    filename = 'conftestval'
     includes = '''
 #if STDC_HEADERS
 #include <stdlib.h>
 #include <stdio.h>
 #endif\n'''
-    body     = 'FILE *f = fopen("'+filename+'", "w");\n'+'''
+    body     = '''
     char val[2];
     int i = 0;
 
-    if (!f) exit(1);
     val[0]=\'\\1\';
     val[1]=\'\\0\';
     while(val[0]) {val[0] <<= 1; i++;}
-    fprintf(f, "%d\\n", i);\n
+    printf("%d\\n", i);\n
     '''
     if 'known-bits-per-byte' in self.framework.argDB:
       bits = self.framework.argDB['known-bits-per-byte']
+    elif not self.getPredefinedInteger('__CHAR_BIT__') is None:
+      bits = self.getPredefinedInteger('__CHAR_BIT__')
+      self.logPrint('The compiler predefines the bits per byte as '+str(bits))
+    elif not self.introspection.getResult('bits-per-byte') is None:
+      bits = self.introspection.getResult('bits-per-byte')
     elif not self.framework.argDB['with-batch']:
-      if self.checkRun(includes, body) and os.path.exists(filename):
-        f    = file(filename)
-        bits = int(f.read())
-        f.close()
-        os.remove(filename)
+      (output, status) = self.outputRun(includes, body)
+      if not status:
+        bits = int(output)
       else:
          msg = 'Cannot run executable to determine bits per bit. If this machine uses a batch system \nto submit jobs you will need to configure using ./configure with the additional option  --with-batch.\n Otherwise there is problem with the compilers. Can you compile and run code with your C/C++ (and maybe Fortran) compilers?\n'
          raise RuntimeError(msg)
@@ -361,10 +436,26 @@ void (*signal())();
 
   def checkVisibility(self):
     if self.framework.argDB['with-visibility']:
-      if not self.checkCompile('','__attribute__((visibility ("default"))) int foo(void);'):
+      version = self.getPredefinedInteger('__GNUC__')
+      if self.isGNUCompatible() and version >= 4:
+        self.logPrint('GCC 4 and Clang support visibility attributes')
+      elif not self.checkCompile('','__attribute__((visibility ("default"))) int foo(void);'):
         raise RuntimeError('Cannot use visibility attributes')
       self.addDefine('USE_VISIBILITY',1)
 
+  def configureIntrospection(self):
+    '''Answer the sizes, bits per byte, and byte order which are neither given nor predefined, from an object file or a single program'''
+    for typeName in self.basicTypes:
+      self.addSizeofQuery(self.introspection, typeName)
+    if not 'known-bits-per-byte' in self.framework.argDB and self.getPredefinedInteger('__CHAR_BIT__') is None:
+      self.introspection.addInclude('#include <limits.h>')
+      self.introspection.addQuery('bits-per-byte', '  char val[2];\n  val[0] = 1;\n  val[1] = 0;\n  while (val[0]) {val[0] <<= 1; value++;}', 'CHAR_BIT')
+    # The byte order is usually found by compiling with sys/param.h, so it only joins a program which is built anyway
+    if self.introspection.queries and not 'known-endian' in self.framework.argDB and self.getPredefinedEndian() is None:
+      self.introspection.addByteOrderQuery('endian')
+    self.introspection.run()
+    return
+
   def configure(self):
     self.executeTest(self.check_siginfo_t)
     self.executeTest(self.check__int64)
@@ -382,8 +473,9 @@ void (*signal())();
       self.executeTest(self.checkFortranKind)
       self.executeTest(self.checkFortranDReal)
     self.executeTest(self.checkConst)
+    self.executeTest(self.configureIntrospection)
     self.executeTest(self.checkEndian)
-    map(lambda type: self.executeTest(self.checkSizeof, type), ['char','void *', 'short', 'int', 'long', 'long long', 'float', 'double', 'size_t'])
+    map(lambda type: self.executeTest(self.checkSizeof, type), self.basicTypes)
     self.executeTest(self.checkBitsPerByte)
     self.executeTest(self.checkVisibility)
     return
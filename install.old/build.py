@@ -3,7 +3,6 @@ import install.urlMapping
 
 import os
 import sys
-import cPickle
 
 class Builder(install.urlMapping.UrlMapping):
   def __init__(self, stamp = None):
@@ -26,15 +25,17 @@ class Builder(install.urlMapping.UrlMapping):
     data         = None
     if os.path.exists(dictFilename):
       try:
-        dbFile = file(dictFilename)
-        data   = cPickle.load(dbFile)
+        import RDict
+        localDB = RDict.RDict(load = 0, autoShutdown = 0, readonly = True)
+        localDB.saveFilename = dictFilename
+        localDB.load()
+        data   = dict(localDB.localitems())
         self.debugPrint('Loaded argument database from '+dictFilename, 2, 'install')
         keys   = self.argDB.keys()
         for k in filter(lambda k: not k in keys, data.keys()):
           if data[k].isValueSet():
             self.argDB.setType(k, data[k])
           self.debugPrint('Set key "'+str(k)+'" in argument database', 4, 'install')
-        dbFile.close()
       except Exception, e:
         self.debugPrint('Problem loading dictionary from '+dictFilename+'\n--> '+str(e), 2, 'install')
         raise e
@@ -21,11 +21,125 @@ try:
   True, False
 except NameError:
   True, False = (0==0, 0!=0)
+try:
+  import json
+
+  def encodeJSON(obj):
+    '''Return the JSON text of obj, where an object JSON does not know is given by its string'''
+    try:
+      return json.dumps(obj, default = str)
+    except UnicodeDecodeError:
+      return json.dumps(obj, default = str, encoding = 'latin-1')
+except ImportError:
+  import re
+
+  def encodeJSON(obj):
+    '''Return the JSON text of obj, where an object JSON does not know is given by its string'''
+    if obj is None:
+      return 'null'
+    if obj is True:
+      return 'true'
+    if obj is False:
+      return 'false'
+    if isinstance(obj, (int, long, float)):
+      return repr(obj)
+    if isinstance(obj, dict):
+      return '{'+', '.join([encodeJSON(str(key))+': '+encodeJSON(value) for key, value in obj.items()])+'}'
+    if isinstance(obj, (list, tuple)):
+      return '['+', '.join(map(encodeJSON, obj))+']'
+    return '"'+re.sub(r'[\\"\x00-\x1f\x7f-\xff]', lambda m: '\\u%04x' % ord(m.group()), str(obj))+'"'
+
+class BufferedLog(file):
+  '''A log file which gathers writes in memory and writes them out in large blocks
+     - The buffer is written once it holds bufferSize characters, or when a write arrives flushInterval seconds after the last flush
+     - All open logs are flushed at exit, including an exit caused by an uncaught exception
+     - Anything which writes to the file descriptor directly must call flush() first, which fileno() does
+     - A forked process drops the data buffered by its parent, which the parent writes itself'''
+  bufferSize    = 1 << 20
+  flushInterval = 1.0
+  openLogs      = []
+
+  def __init__(self, name, mode = 'w'):
+    import time
+
+    # The file itself is unbuffered, so that everything buffered is in our hands
+    file.__init__(self, name, mode, 0)
+    self.buffer    = []
+    self.size      = 0
+    self.lastFlush = time.time()
+    self.pid       = os.getpid()
+    if not BufferedLog.openLogs:
+      import atexit
+      atexit.register(BufferedLog.flushAll)
+    BufferedLog.openLogs.append(self)
+    return
+
+  def checkProcess(self):
+    '''Drop the buffer inherited from the parent after a fork'''
+    if not self.pid == os.getpid():
+      self.buffer = []
+      self.size   = 0
+      self.pid    = os.getpid()
+    return
+
+  def write(self, data):
+    import time
+
+    self.checkProcess()
+    self.buffer.append(data)
+    self.size += len(data)
+    if self.size >= self.bufferSize or time.time() - self.lastFlush >= self.flushInterval:
+      self.flush()
+    return
+
+  def writelines(self, lines):
+    for line in lines:
+      self.write(line)
+    return
+
+  def flush(self):
+    import time
+
+    self.checkProcess()
+    if self.buffer:
+      data        = ''.join(self.buffer)
+      self.buffer = []
+      self.size   = 0
+      file.write(self, data)
+    self.lastFlush = time.time()
+    return
+
+  def fileno(self):
+    self.flush()
+    return file.fileno(self)
+
+  def close(self):
+    if not self.closed:
+      self.flush()
+      file.close(self)
+    if self in BufferedLog.openLogs:
+      BufferedLog.openLogs.remove(self)
+    return
+
+  def flushAll():
+    '''Flush every open log, which is registered to run at exit'''
+    for log in BufferedLog.openLogs:
+      try:
+        if not log.closed:
+          log.flush()
+      except (IOError, OSError):
+        pass
+    return
+  flushAll = staticmethod(flushAll)
 
 class Logger(args.ArgumentProcessor):
   '''This class creates a shared log and provides methods for writing to it'''
   defaultLog = None
   defaultOut = sys.stdout
+  # The stream of JSON events, or None if events are not recorded
+  defaultEvents = None
+  # The indentation of log lines, which is raised for the duration of each test
+  indentLevel = 0
 
   def __init__(self, clArgs = None, argDB = None, log = None, out = defaultOut, debugLevel = None, debugSections = None, debugIndent = None):
     args.ArgumentProcessor.__init__(self, clArgs, argDB)
@@ -75,6 +189,8 @@ class Logger(args.ArgumentProcessor):
     argDB.setType('debugIndent',   nargs.Arg(None, '  ', 'The string used for log indentation'))
     argDB.setType('scrollOutput',  nargs.ArgBool(None, 0, 'Flag to allow output to scroll rather than overwriting a single line'))
     argDB.setType('noOutput',      nargs.ArgBool(None, 0, 'Flag to suppress output to the terminal'))
+    argDB.setType('profile-python', nargs.Arg(None, '', 'The filename for a cProfile profile of the Python code, with a summary in <filename>.txt', isTemporary = 1))
+    argDB.setType('eventLog',      nargs.Arg(None, '', 'The filename for a stream of JSON events, one per line, recording tests, commands, and results', isTemporary = 1))
     return argDB
 
   def setup(self):
@@ -90,6 +206,7 @@ class Logger(args.ArgumentProcessor):
       self.debugSections = self.argDB['debugSections']
     if self.debugIndent is None:
       self.debugIndent   = self.argDB['debugIndent']
+    self.createEventLog()
     return
 
   def checkLog(self, logName):
@@ -118,21 +235,44 @@ class Logger(args.ArgumentProcessor):
         appendArg = nargs.Arg.findArgument('logAppend', self.clArgs)
         if self.checkLog(logName):
           if not self.argDB is None and ('logAppend' in self.argDB and self.argDB['logAppend']) or (not appendArg is None and bool(appendArg)):
-            Logger.defaultLog = file(self.logName, 'a')
+            Logger.defaultLog = BufferedLog(self.logName, 'a')
           else:
             try:
               import os
 
               os.rename(self.logName, self.logName+'.bkp')
-              Logger.defaultLog = file(self.logName, 'w')
+              Logger.defaultLog = BufferedLog(self.logName, 'w')
             except OSError:
               sys.stdout.write('WARNING: Cannot backup log file, appending instead.\n')
-              Logger.defaultLog = file(self.logName, 'a')
+              Logger.defaultLog = BufferedLog(self.logName, 'a')
         else:
-          Logger.defaultLog = file(self.logName, 'w')
+          Logger.defaultLog = BufferedLog(self.logName, 'w')
       log = Logger.defaultLog
     return log
 
+  def createEventLog(self):
+    '''Create the default event stream if an event log was requested
+       - The file is opened for appending, so that the events of forked workers are written whole'''
+    if Logger.defaultEvents is None and self.argDB['eventLog']:
+      file(self.argDB['eventLog'], 'w').close()
+      Logger.defaultEvents = BufferedLog(self.argDB['eventLog'], 'a')
+      self.logEvent('start', argv = sys.argv, cwd = os.getcwd())
+    return
+
+  def logEvent(event, **fields):
+    '''Write an event to the event stream, if there is one
+       - Each event is a JSON object on its own line with the event name, time, and process id along with the given fields'''
+    if Logger.defaultEvents is None:
+      return
+    import time
+
+    fields['event'] = event
+    fields['time']  = time.time()
+    fields['pid']   = os.getpid()
+    Logger.defaultEvents.write(encodeJSON(fields)+'\n')
+    return
+  logEvent = staticmethod(logEvent)
+
   def closeLog(self):
     '''Closes the log file'''
     self.log.close()
@@ -178,19 +318,26 @@ class Logger(args.ArgumentProcessor):
       return True
     return False
 
+  def logPushIndent(self):
+    '''Indent the following log lines one more level'''
+    Logger.indentLevel += 1
+    return
+
+  def logPopIndent(self):
+    '''Undo the last logPushIndent()'''
+    Logger.indentLevel -= 1
+    return
+
   def logIndent(self, debugLevel = -1, debugSection = None, comm = None):
     '''Write the proper indentation to the log streams'''
-    import traceback
-
-    indentLevel = len(traceback.extract_stack())-5
+    if not Logger.indentLevel and comm is None:
+      return
     for writeAll, f in enumerate([self.out, self.log]):
       if self.checkWrite(f, debugLevel, debugSection, writeAll):
+        indent = self.debugIndent*Logger.indentLevel
         if not comm is None:
-          f.write('[')
-          f.write(str(comm.rank()))
-          f.write(']')
-        for i in range(indentLevel):
-          f.write(self.debugIndent)
+          indent = '['+str(comm.rank())+']'+indent
+        f.write(indent)
     return
 
   def logBack(self):
@@ -202,9 +349,7 @@ class Logger(args.ArgumentProcessor):
   def logClear(self):
     '''Clear the current line if we are not scrolling output'''
     if not self.out is None and self.linewidth > 0:
-      self.out.write('\r')
-      self.out.write(''.join([' '] * self.linewidth))
-      self.out.write('\r')
+      self.out.write('\r'+' '*self.linewidth+'\r')
     return
 
   def logPrintDivider(self, debugLevel = -1, debugSection = None, single = 0):
@@ -235,22 +380,21 @@ class Logger(args.ArgumentProcessor):
 
 
   def logWrite(self, msg, debugLevel = -1, debugSection = None, forceScroll = 0):
-    '''Write the message to the log streams'''
+    '''Write the message to the log streams
+       - The terminal is flushed after each message, while the log file is buffered'''
     for writeAll, f in enumerate([self.out, self.log]):
       if self.checkWrite(f, debugLevel, debugSection, writeAll):
         if not forceScroll and not writeAll and self.linewidth > 0:
           global RemoveDirectory
-          self.logBack()
-          msg = msg.replace(RemoveDirectory,'')
-          for ms in msg.split('\n'):
-            f.write(ms[0:self.linewidth])
-            f.write(''.join([' '] * (self.linewidth - len(ms))))
+          linewidth = self.linewidth
+          lines     = msg.replace(RemoveDirectory,'').split('\n')
+          f.write('\r'+''.join([ms[0:linewidth]+' '*(linewidth - len(ms)) for ms in lines]))
         else:
           if not debugSection is None and not debugSection == 'screen' and len(msg):
-            f.write(str(debugSection))
-            f.write(': ')
-          f.write(msg)
-        if hasattr(f, 'flush'):
+            f.write(str(debugSection)+': '+msg)
+          else:
+            f.write(msg)
+        if not writeAll and hasattr(f, 'flush'):
           f.flush()
     return
 
@@ -1,3 +1,4 @@
+import profiler
 import script
 
 import os
@@ -207,6 +208,8 @@ class Make(script.Script):
 
   def run(self, setupOnly = 0):
     self.setup()
+    if self.argDB['profile-python'] and profiler.PythonProfiler.defaultProfiler is None:
+      return profiler.PythonProfiler(self.argDB['profile-python']).run(self.run, setupOnly)
     try:
       self.logPrint('Starting Build', debugSection = 'build')
       self.executeSection(self.configure, self.builder)
@@ -0,0 +1,215 @@
+'''
+  The Profiler records the wall clock time spent in nested frames, such as the configure() of each
+child, each test run by executeTest(), and each probe. A frame is entered and left around the code
+it measures, and a command is recorded as a frame of its own under the frame which ran it, named
+after the program. For every frame the Profiler keeps
+    - The inclusive time, from entering to leaving it
+    - The exclusive time, which leaves out the time of the frames it contains
+
+Times are gathered both by stack, for a flame graph, and by frame, for the list of the slowest
+tests. The stacks are written in the folded format read by flamegraph.pl, one line per stack with
+its exclusive time in microseconds.
+
+  Probes are frames of the kind preprocess, compile, link, or run, and the time of the commands
+they run is also totaled by kind. A profile made in a forked worker is sent back with getRecords()
+and added to the profile of the parent with merge().
+
+  The PythonProfiler instead profiles the Python code itself with cProfile, to find the overhead of
+the framework apart from the commands it runs.
+'''
+import os
+import time
+
+class Profiler(object):
+  # The profiler used by executeTest() and executeShellCommand(), or None when not profiling
+  defaultProfiler = None
+  kinds           = ['preprocess', 'compile', 'link', 'run']
+
+  def __init__(self, stack = []):
+    # Open frames as [category, name, start, time of contained frames]
+    self.stack       = [[category, name, time.time(), 0.0] for category, name in stack]
+    # Stack of names to [calls, inclusive, exclusive]
+    self.stacks      = {}
+    # (category, name) to [calls, inclusive, exclusive]
+    self.frames      = {}
+    # Probe kind to time spent in its commands
+    self.commandTime = {}
+    self.start       = time.time()
+    return
+
+  def fork(self):
+    '''Return an empty Profiler which records under the frames now open, for use in a forked worker'''
+    return Profiler([(frame[0], frame[1]) for frame in self.stack])
+
+  def enter(self, category, name):
+    '''Open a frame of the given category, such as "child", "test", or "probe"'''
+    self.stack.append([category, name.replace(';', ':'), time.time(), 0.0])
+    return
+
+  def leave(self):
+    '''Close the last frame opened'''
+    category, name, start, contained = self.stack.pop()
+    self.record(category, name, time.time() - start, contained)
+    return
+
+  def record(self, category, name, inclusive, contained = 0.0):
+    '''Add a finished frame, with the time of the frames it contained, under the open frames'''
+    stack     = tuple([frame[1] for frame in self.stack])+(name,)
+    exclusive = max(0.0, inclusive - contained)
+    for table, key in [(self.stacks, stack), (self.frames, (category, name))]:
+      if not key in table:
+        table[key] = [0, 0.0, 0.0]
+      entry     = table[key]
+      entry[0] += 1
+      entry[1] += inclusive
+      entry[2] += exclusive
+    if self.stack:
+      self.stack[-1][3] += inclusive
+      if self.stack[-1][0] == 'probe' and category == 'command':
+        kind = self.stack[-1][1]
+        self.commandTime[kind] = self.commandTime.get(kind, 0.0) + inclusive
+    return
+
+  def addCommand(self, cmd):
+    '''Record a finished Command, named after the program it ran'''
+    if cmd.started is None or cmd.finished is None:
+      return
+    if cmd.argv:
+      name = os.path.basename(cmd.argv[0])
+    else:
+      name = 'sh'
+    self.record('command', name, cmd.finished - cmd.started)
+    return
+
+  def getRecords(self):
+    '''Return the tables of this profile, to be given to merge()'''
+    return (self.stacks, self.frames, self.commandTime)
+
+  def merge(self, records):
+    '''Add the tables of a profile made by a worker forked from this one'''
+    stacks, frames, commandTime = records
+    for table, other in [(self.stacks, stacks), (self.frames, frames)]:
+      for key, (calls, inclusive, exclusive) in other.items():
+        if not key in table:
+          table[key] = [0, 0.0, 0.0]
+        entry     = table[key]
+        entry[0] += calls
+        entry[1] += inclusive
+        entry[2] += exclusive
+    for kind, t in commandTime.items():
+      self.commandTime[kind] = self.commandTime.get(kind, 0.0) + t
+    if self.stack:
+      depth = len(self.stack)+1
+      self.stack[-1][3] += sum([entry[1] for key, entry in stacks.items() if len(key) == depth])
+    return
+
+  def getSlowest(self, category, number):
+    '''Return the (name, calls, inclusive, exclusive) of the frames of the category with the largest inclusive time'''
+    frames = [(entry[1], name, entry[0], entry[2]) for (c, name), entry in self.frames.items() if c == category]
+    frames.sort()
+    frames.reverse()
+    return [(name, calls, inclusive, exclusive) for inclusive, name, calls, exclusive in frames[:number]]
+
+  def getSummary(self, number = 20):
+    '''Return a report of the slowest tests and children, and of the time of each kind of probe'''
+    lines = ['Profile of %.3fs of wall clock time' % (time.time() - self.start,)]
+    for category, title in [('test', 'Slowest tests'), ('child', 'Slowest children')]:
+      slowest = self.getSlowest(category, number)
+      if slowest:
+        lines.append(title+' (inclusive, exclusive, calls):')
+        for name, calls, inclusive, exclusive in slowest:
+          lines.append('  %9.3fs %9.3fs %6d  %s' % (inclusive, exclusive, calls, name))
+    probes = [(kind, self.frames[('probe', kind)]) for kind in self.kinds if ('probe', kind) in self.frames]
+    if probes:
+      lines.append('Probes (inclusive, in commands, calls):')
+      for kind, (calls, inclusive, exclusive) in probes:
+        lines.append('  %9.3fs %9.3fs %6d  %s' % (inclusive, self.commandTime.get(kind, 0.0), calls, kind))
+    return '\n'.join(lines)+'\n'
+
+  def writeStacks(self, filename):
+    '''Write the exclusive time of each stack in microseconds, in the folded format of flamegraph.pl'''
+    stacks = self.stacks.items()
+    stacks.sort()
+    f = file(filename, 'w')
+    for stack, (calls, inclusive, exclusive) in stacks:
+      f.write(';'.join(stack)+' '+str(int(exclusive*1e6))+'\n')
+    f.close()
+    return
+
+class PythonProfiler(object):
+  '''Profiles the Python code of configure or a build with cProfile
+     - The configure() of each child is profiled separately, so that the time of the framework itself, and of each child, can be told apart
+     - The profile of each child is written to <filename>.d/<module>.pstats, also by parallel workers
+     - The combined profile is written to filename, and a summary of the time of each child and the 50 most expensive functions to <filename>.txt'''
+  # The profiler in use, or None when not profiling
+  defaultProfiler = None
+
+  def __init__(self, filename):
+    import cProfile
+
+    self.filename = filename
+    self.childDir = filename+'.d'
+    self.profile  = cProfile.Profile()
+    # The (child, profile) pairs enabled, innermost last
+    self.stack    = [(None, self.profile)]
+    return
+
+  def run(self, function, *args):
+    '''Call the function under the profiler, and write the profiles once it returns'''
+    import glob
+
+    if os.path.isdir(self.childDir):
+      for name in glob.glob(os.path.join(self.childDir, '*.pstats')):
+        os.remove(name)
+    else:
+      os.makedirs(self.childDir)
+    PythonProfiler.defaultProfiler = self
+    self.profile.enable()
+    try:
+      return function(*args)
+    finally:
+      self.profile.disable()
+      PythonProfiler.defaultProfiler = None
+      self.output()
+
+  def enterChild(self, name):
+    '''Profile the code from now on as part of the named child, until leaveChild()'''
+    import cProfile
+
+    profile = cProfile.Profile()
+    self.stack[-1][1].disable()
+    self.stack.append((name, profile))
+    profile.enable()
+    return
+
+  def leaveChild(self):
+    (name, profile) = self.stack.pop()
+    profile.disable()
+    profile.dump_stats(os.path.join(self.childDir, name+'.pstats'))
+    self.stack[-1][1].enable()
+    return
+
+  def output(self):
+    '''Write the combined profile and the summary'''
+    import glob
+    import pstats
+
+    f        = file(self.filename+'.txt', 'w')
+    stats    = pstats.Stats(self.profile, stream = f)
+    children = []
+    for name in glob.glob(os.path.join(self.childDir, '*.pstats')):
+      child = pstats.Stats(name)
+      children.append((child.total_tt, os.path.basename(name)[:-7]))
+      stats.add(child)
+    children.sort()
+    children.reverse()
+    stats.dump_stats(self.filename)
+    # This includes the time spent waiting for commands, which appears as the time of select() and read()
+    f.write('Time profiled in the framework: %.3fs\n' % (pstats.Stats(self.profile).total_tt,))
+    f.write('Time profiled in each child:\n')
+    for t, name in children:
+      f.write('  %9.3fs  %s\n' % (t, name))
+    f.write('\n')
+    stats.sort_stats('time', 'cumulative').print_stats(50)
+    f.close()
+    return
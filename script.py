@@ -4,6 +4,8 @@ if not hasattr(sys, 'version_info'):
   sys.exit(4)
 
 import cPickle
+import re
+import shlex
 
 try:
   import subprocess
@@ -32,7 +34,14 @@ if useSelect is None:
 else:
   useSelect = int(useSelect)
 
+useShell = nargs.Arg.findArgument('useShell', sys.argv[1:])
+if useShell is None:
+  useShell = 0
+else:
+  useShell = int(useShell)
+
 import logger
+import profiler
 
 class Script(logger.Logger):
   def __init__(self, clArgs = None, argDB = None, log = None):
@@ -73,6 +82,8 @@ class Script(logger.Logger):
 
     help.addArgument('Script', '-help', nargs.ArgBool(None, 0, 'Print this help message', isTemporary = 1), ignoreDuplicates = 1)
     help.addArgument('Script', '-h',    nargs.ArgBool(None, 0, 'Print this help message', isTemporary = 1), ignoreDuplicates = 1)
+    help.addArgument('Script', '-record=<dir>', nargs.Arg(None, '', 'Record every command, with its inputs and results, in the directory', isTemporary = 1), ignoreDuplicates = 1)
+    help.addArgument('Script', '-replay=<dir>', nargs.Arg(None, '', 'Answer every command from a recording made with -record, failing on a command not recorded. Files and programs which configure looks up itself are not replayed, and must match the recording machine', isTemporary = 1), ignoreDuplicates = 1)
     return help
 
   def setup(self):
@@ -81,6 +92,7 @@ class Script(logger.Logger):
       return
     logger.Logger.setup(self)
     self._setup = 1
+    self.setupRecorder()
     if self.hasHelpFlag():
       if self.argDB.target == ['default']:
         sections = None
@@ -90,6 +102,23 @@ class Script(logger.Logger):
       sys.exit()
     return
 
+  def setupRecorder(self):
+    '''Create the CommandRecorder for -record or -replay, unless there is one'''
+    import commandRecorder
+
+    if not commandRecorder.CommandRecorder.defaultRecorder is None:
+      return
+    if self.argDB.get('record') and self.argDB.get('replay'):
+      raise RuntimeError('Commands cannot be both recorded and replayed')
+    for mode in ['record', 'replay']:
+      if self.argDB.get(mode):
+        recorder = commandRecorder.CommandRecorder(self.argDB[mode], mode)
+        if recorder.isReplaying():
+          # Fail before configuring, rather than at the first command
+          recorder.loadEnvironment()
+        commandRecorder.CommandRecorder.defaultRecorder = recorder
+    return
+
   def cleanup(self):
     '''This method outputs the action log'''
     self.actions.output(self.log)
@@ -122,27 +151,99 @@ class Script(logger.Logger):
     return module
   importModule = staticmethod(importModule)
 
+  # Characters which make a command need the shell: pipes, redirection, substitution, globbing, and command lists
+  shellCharacters = re.compile(r'[|&;<>()$`\\*?\[\]{}~#!^\n]')
+  # Builtins which behave differently from the program of the same name, or have none
+  shellBuiltins   = ['.', ':', '[', 'alias', 'cd', 'command', 'echo', 'eval', 'exec', 'exit', 'export', 'getopts', 'hash', 'kill', 'printf', 'pwd', 'read', 'readonly', 'return', 'set', 'shift', 'source', 'test', 'times', 'trap', 'type', 'ulimit', 'umask', 'unalias', 'unset', 'wait']
+
+  def getArgv(command):
+    '''Return the argument vector for a command, or None if it must be run by the shell
+       - A list is already an argument vector, and is never given to the shell
+       - A string is split into words as the shell would, unless it uses pipes, redirection, substitution, globbing, or several commands'''
+    if isinstance(command, list):
+      return command
+    argv = Script.splitWords(command)
+    if not argv or argv[0] in Script.shellBuiltins or '=' in argv[0]:
+      return None
+    return argv
+  getArgv = staticmethod(getArgv)
+
+  def splitWords(text):
+    '''Return the words of shell text, such as a set of flags, or None if it uses shell features'''
+    if useShell or Script.shellCharacters.search(text):
+      return None
+    try:
+      return shlex.split(text)
+    except ValueError:
+      return None
+  splitWords = staticmethod(splitWords)
+
+  def formatArgv(argv):
+    '''Return a shell command for an argument vector, quoting the words which need it'''
+    words = []
+    for word in argv:
+      if not word or re.search(r'[^A-Za-z0-9_@%+=:,./-]', word):
+        word = "'"+word.replace("'", "'\\''")+"'"
+      words.append(word)
+    return ' '.join(words)
+  formatArgv = staticmethod(formatArgv)
+
   if USE_SUBPROCESS:
 
     def runShellCommand(command, log=None, cwd=None):
       Popen = subprocess.Popen
       PIPE  = subprocess.PIPE
+      argv  = Script.getArgv(command)
+      if isinstance(command, list): command = Script.formatArgv(command)
       if log: log.write('Executing: %s\n' % (command,))
-      pipe = Popen(command, cwd=cwd, stdin=None, stdout=PIPE, stderr=PIPE,
-                   bufsize=-1, shell=True, universal_newlines=True)
+      if argv is None:
+        pipe = Popen(command, cwd=cwd, stdin=None, stdout=PIPE, stderr=PIPE,
+                     bufsize=-1, shell=True, universal_newlines=True)
+      else:
+        try:
+          pipe = Popen(argv, cwd=cwd, stdin=None, stdout=PIPE, stderr=PIPE,
+                       bufsize=-1, shell=False, universal_newlines=True)
+        except OSError:
+          # Let the shell report a program which cannot be run, as it did before
+          pipe = Popen(command, cwd=cwd, stdin=None, stdout=PIPE, stderr=PIPE,
+                       bufsize=-1, shell=True, universal_newlines=True)
       (out, err) = pipe.communicate()
       ret = pipe.returncode
       return (out, err, ret)
 
   else:
 
-    def openPipe(command):
-      '''We need to use the asynchronous version here since we want to avoid blocking reads'''
+    def openPipe(command, argv = None):
+      '''We need to use the asynchronous version here since we want to avoid blocking reads
+         - If an argument vector is given, the program is executed directly, and the shell runs the command only if that fails'''
       import popen2
 
       pipe = None
       if hasattr(popen2, 'Popen3'):
-        pipe   = popen2.Popen3(command, 1)
+        if argv is None:
+          pipe = popen2.Popen3(command, 1)
+        else:
+          import os
+
+          class DirectPopen3(popen2.Popen3):
+            def _run_child(self, cmd):
+              if hasattr(os, 'closerange'):
+                os.closerange(3, popen2.MAXFD)
+              else:
+                for fd in xrange(3, popen2.MAXFD):
+                  try:
+                    os.close(fd)
+                  except OSError:
+                    pass
+              try:
+                try:
+                  os.execvp(argv[0], argv)
+                except OSError:
+                  # The shell gives the usual message and status for a program which cannot be run
+                  os.execv('/bin/sh', ['/bin/sh', '-c', command])
+              finally:
+                os._exit(1)
+          pipe = DirectPopen3(command, 1)
         input  = pipe.tochild
         output = pipe.fromchild
         err    = pipe.childerr
@@ -153,46 +254,44 @@ class Script(logger.Logger):
     openPipe = staticmethod(openPipe)
 
     def runShellCommand(command, log = None, cwd = None):
+      '''Run a command, directly if it needs no shell features, returning the output, error, and status
+         - The command is a shell command string or an argument vector'''
       import select, os
 
       ret        = None
       out        = ''
       err        = ''
       loginError = 0
+      argv       = Script.getArgv(command)
+      if isinstance(command, list): command = Script.formatArgv(command)
       if cwd is not None:
         oldpath = os.getcwd()
         os.chdir(cwd)
       if log: log.write('Executing: %s\n' % (command,))
-      (input, output, error, pipe) = Script.openPipe(command)
+      (input, output, error, pipe) = Script.openPipe(command, argv)
       if cwd is not None:
         os.chdir(oldpath)
       input.close()
       if useSelect:
-        outputClosed = 0
-        errorClosed  = 0
-        lst = [output, error]
-        while 1:
-          ready = select.select(lst, [], [])
-          if len(ready[0]):
-            if error in ready[0]:
-              msg = error.readline()
-              if msg:
-                err += msg
-              else:
-                errorClosed = 1
-                lst.remove(error)
-            if output in ready[0]:
-              msg = output.readline()
-              if msg:
-                out += msg
-              else:
-                outputClosed = 1
-                lst.remove(output)
-            if out.find('password:') >= 0 or err.find('password:') >= 0:
+        # Read whatever is available in chunks, since appending line by line is quadratic for long output
+        chunks = {output.fileno(): [], error.fileno(): []}
+        recent = {output.fileno(): '', error.fileno(): ''}
+        lst    = chunks.keys()
+        while lst:
+          ready = select.select(lst, [], [])[0]
+          for fd in ready:
+            msg = os.read(fd, 65536)
+            if not msg:
+              lst.remove(fd)
+              continue
+            chunks[fd].append(msg)
+            recent[fd] = recent[fd][-len('password:'):]+msg
+            if recent[fd].find('password:') >= 0:
               loginError = 1
-              break
-          if outputClosed and errorClosed:
+          if loginError:
             break
+        out = ''.join(chunks[output.fileno()])
+        err = ''.join(chunks[error.fileno()])
       else:
         out = output.read()
         err = error.read()
@@ -212,51 +311,142 @@ class Script(logger.Logger):
     if status: raise RuntimeError('Could not execute "%s":\n%s' % (command,output+error))
   defaultCheckCommand = staticmethod(defaultCheckCommand)
 
-  def executeShellCommand(command, checkCommand = None, timeout = 600.0, log = None, lineLimit = 0, cwd=None):
-    '''Execute a shell command returning the output, and optionally provide a custom error checker
+  def runInThread(command, log, cwd, timeout):
+    '''Run a command with a timeout where the CommandEngine is not available'''
+    if useThreads:
+      import threading
+      class InShell(threading.Thread):
+        def __init__(self):
+          threading.Thread.__init__(self)
+          self.name = 'Shell Command'
+          self.setDaemon(1)
+        def run(self):
+          (self.output, self.error, self.status) = ('', '', -1) # So these fields exist even if command fails with no output
+          (self.output, self.error, self.status) = Script.runShellCommand(command, log, cwd)
+      thread = InShell()
+      thread.start()
+      thread.join(timeout)
+      if thread.isAlive():
+        error = 'Runaway process exceeded time limit of '+str(timeout)+'s\n'
+        log.write(error)
+        return ('', error, -1)
+      else:
+        return (thread.output, thread.error, thread.status)
+    else:
+      return Script.runShellCommand(command, log, cwd)
+  runInThread = staticmethod(runInThread)
+
+  def submitShellCommand(command, timeout = 600.0, log = None, cwd = None, tee = 0, headLines = None, tailLines = None):
+    '''Start a shell command without waiting for it, and return the Command to pass to finishShellCommand()
+       - The command may also be an argument vector, which is executed without the shell
+       - A command string which needs no shell features is also executed directly
+       - A command which runs past the timeout is killed along with its process group
+       - If tee is true, the output is written to the log as it arrives, rather than once the command finishes
+       - If headLines or tailLines is given, only that many lines of output and error are kept from the beginning or end
+       - When replaying a recording, the Command is answered from the recording'''
+    import commandEngine
+    import commandRecorder
+    import time
+
+    if log is None:
+      log = logger.Logger.defaultLog
+    argv = Script.getArgv(command)
+    if isinstance(command, list): command = Script.formatArgv(command)
+    log.write('sh: %s\n' % (command,))
+    recorder  = commandRecorder.CommandRecorder.defaultRecorder
+    recording = None
+    if not recorder is None:
+      if recorder.isReplaying():
+        cmd = commandEngine.Command(command, argv, cwd, timeout, headLines = headLines, tailLines = tailLines)
+        cmd.started = time.time()
+        recorder.replay(cmd)
+        return cmd
+      recording = recorder.getKey(command, cwd)
+    if not commandEngine.CommandEngine.isAvailable():
+      cmd = commandEngine.Command(command, argv, cwd, timeout, headLines = headLines, tailLines = tailLines)
+      cmd.started   = time.time()
+      cmd.recording = recording
+      if argv is None:
+        argv = command
+      (output, error, status) = Script.runInThread(argv, log, cwd, timeout)
+      cmd.addOutput('output', output)
+      cmd.addOutput('error', error)
+      cmd.finish(status)
+      return cmd
+    log.write('Executing: %s\n' % (command,))
+    abortText = None
+    if useSelect:
+      abortText = 'password:'
+    teeLog = None
+    if tee:
+      log.write('sh: ')
+      teeLog = log
+    cmd = commandEngine.CommandEngine.getDefault().submit(command, argv, cwd, timeout, abortText, headLines, tailLines, teeLog)
+    cmd.tee       = tee
+    cmd.recording = recording
+    return cmd
+  submitShellCommand = staticmethod(submitShellCommand)
+
+  def finishShellCommand(cmd, checkCommand = None, log = None, lineLimit = 0):
+    '''Wait for a Command from submitShellCommand(), and optionally provide a custom error checker
        - This returns a tuple of the (output, error, statuscode)'''
+    import commandEngine
+    import commandRecorder
+    import re
+
     if not checkCommand:
       checkCommand = Script.defaultCheckCommand
     if log is None:
       log = logger.Logger.defaultLog
-    def logOutput(log, output):
-      import re
-      # get rid of multiple blank lines
-      output = re.sub('\n[\n]*','\n', output)
-      if lineLimit:
-        output = '\n'.join(output.split('\n')[:lineLimit])
+    if not cmd.isDone():
+      commandEngine.CommandEngine.getDefault().waitAll([cmd])
+    if cmd.aborted:
+      raise RuntimeError('Could not login to site')
+    if getattr(cmd, 'recording', None):
+      (key, inputs, stats) = cmd.recording
+      commandRecorder.CommandRecorder.defaultRecorder.record(cmd, key, inputs, stats)
+    if cmd.timedOut:
+      log.write(cmd.error)
+    (output, error, status) = cmd.getResult()
+    commandEngine.ResourceUsage.charge(cmd)
+    if not logger.Logger.defaultEvents is None:
+      (outputSize, errorSize) = cmd.getSizes()
+      logger.Logger.logEvent('command', command = cmd.command, argv = cmd.argv, cwd = cmd.cwd, duration = cmd.finished - cmd.started, status = status, timedOut = cmd.timedOut, outputSize = outputSize, errorSize = errorSize, usage = cmd.usage)
+    if not profiler.Profiler.defaultProfiler is None:
+      profiler.Profiler.defaultProfiler.addCommand(cmd)
+    # get rid of multiple blank lines
+    output = re.sub('\n[\n]*','\n', output)
+    if lineLimit:
+      output = '\n'.join(output.split('\n')[:lineLimit])
+    if getattr(cmd, 'tee', 0):
+      log.write('\n')
+    else:
       log.write('sh: '+output+'\n')
-      return output
-    def runInShell(command, log, cwd):
-      if useThreads:
-        import threading
-        class InShell(threading.Thread):
-          def __init__(self):
-            threading.Thread.__init__(self)
-            self.name = 'Shell Command'
-            self.setDaemon(1)
-          def run(self):
-            (self.output, self.error, self.status) = ('', '', -1) # So these fields exist even if command fails with no output
-            (self.output, self.error, self.status) = Script.runShellCommand(command, log, cwd)
-        thread = InShell()
-        thread.start()
-        thread.join(timeout)
-        if thread.isAlive():
-          error = 'Runaway process exceeded time limit of '+str(timeout)+'s\n'
-          log.write(error)
-          return ('', error, -1)
-        else:
-          return (thread.output, thread.error, thread.status)
-      else:
-        return Script.runShellCommand(command, log, cwd)
-
-    log.write('sh: %s\n' % (command,))
-    (output, error, status) = runInShell(command, log, cwd)
-    output = logOutput(log, output)
-    checkCommand(command, status, output, error)
+    checkCommand(cmd.command, status, output, error)
     return (output, error, status)
+  finishShellCommand = staticmethod(finishShellCommand)
+
+  def executeShellCommand(command, checkCommand = None, timeout = 600.0, log = None, lineLimit = 0, cwd=None, tee = 0, headLines = None, tailLines = None):
+    '''Execute a shell command returning the output, and optionally provide a custom error checker
+       - The command may also be an argument vector, which is executed without the shell
+       - A command string which needs no shell features is also executed directly
+       - The tee, headLines, and tailLines arguments bound the memory used for a command with a lot of output, see submitShellCommand()
+       - This returns a tuple of the (output, error, statuscode)'''
+    cmd = Script.submitShellCommand(command, timeout, log, cwd, tee, headLines, tailLines)
+    return Script.finishShellCommand(cmd, checkCommand, log, lineLimit)
   executeShellCommand = staticmethod(executeShellCommand)
 
+  def logResourceUsage(self):
+    '''Log the resources used by the commands of each account, and record them as events'''
+    import commandEngine
+
+    if not commandEngine.ResourceUsage.accounts:
+      return
+    self.logPrint(commandEngine.ResourceUsage.getSummary())
+    for name, usage in commandEngine.ResourceUsage.getAccounts().items():
+      self.logEvent('usage', account = name, **usage)
+    return
+
   def loadConfigure(self, argDB = None):
     if argDB is None:
       argDB = self.argDB